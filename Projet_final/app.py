@@ -5,22 +5,36 @@ from __future__ import annotations
 import os
 import io
 import csv
+import json
+import zlib
+import hashlib
+import logging
+import multiprocessing
+import time
 from datetime import datetime
 from functools import wraps
 from typing import Optional
 
+import click
 from flask import (
     Flask, render_template, request, redirect, url_for, flash,
-    session, send_file
+    session, send_file, g, Response, stream_with_context, get_flashed_messages, make_response, abort
 )
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup, escape
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 
+import jobs
+import metrics
+import photos
+import sqlprof
 from models import (
     Database as DB,
-    ensure_schema,
+    migrate, check_query_plans, configure_engine, begin_session, end_session,
     Utilisateur, Cave, Etagere, Stock_bouteilles,
     Bouteille, Revue, SortieArchive,
+    stats_cache, user_cached, TOP_RATED_TTL, bulk_import, IMPORT_COLUMNS, TTLCache, resource_versions,
+    CONNECT_HOOKS, ENGINE_HOOKS,
 )
 
 # ---------------------------------------------------------------------
@@ -30,20 +44,154 @@ from models import (
 app = Flask(__name__)
 app.secret_key = "dev"  # ⚠ à remplacer en prod
 
-# Migrations "douces" (ajoute colonnes si absentes, idempotent)
-ensure_schema()
+# Moteur SQLite : profil WAL + PRAGMAs réglés (opt-in, recommandé sous gunicorn multi-workers)
+if os.environ.get("CAVE_DB_WAL") == "1":
+    configure_engine()
 
-# Uploads
-UPLOAD_DIR = os.path.join("static", "uploads")
+# Migrations versionnées (migrations/*.sql|.py, suivies dans schema_version)
+migrate()
+
+# Uploads (stockage par contenu + refcount, miniatures : voir photos.py)
+UPLOAD_DIR = photos.UPLOAD_DIR
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
 app.config["UPLOAD_FOLDER"] = UPLOAD_DIR
 app.config["MAX_CONTENT_LENGTH"] = 4 * 1024 * 1024  # 4 Mo
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Templates compilés gardés sur disque : un nouveau worker ne recompile pas ma_cave.html & co
+JINJA_CACHE_DIR = os.environ.get("CAVE_JINJA_CACHE", ".jinja_cache")
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+# Tâches de fond (jobs.py) : un worker en thread dans chaque processus web, démarré
+# à la 1re requête ; CAVE_JOBS_INPROCESS=0 pour ne compter que sur `flask worker`
+JOBS_INPROCESS = os.environ.get("CAVE_JOBS_INPROCESS", "1") != "0"
+
+# Instrumentation SQL (sqlprof.py) : profil par requête (en-têtes Server-Timing et
+# X-SQL-Requetes, page /_sql) en debug ou avec CAVE_SQL_PROFILE=1 ; journal des
+# requêtes lentes (CAVE_SLOW_SQL_LOG) au-delà de CAVE_SLOW_SQL_MS ms, 100 par défaut
+# en profilage. Sans ces réglages, les connexions ne sont pas instrumentées.
+SQL_PROFILE = app.debug or os.environ.get("CAVE_SQL_PROFILE") == "1"
+SLOW_SQL_MS = (float(os.environ["CAVE_SLOW_SQL_MS"]) if os.environ.get("CAVE_SLOW_SQL_MS")
+               else 100.0 if SQL_PROFILE else None)
+
+
+def enable_sql_instrumentation() -> None:
+    if SLOW_SQL_MS is not None and not sqlprof.log.handlers:
+        handler = logging.FileHandler(os.environ.get("CAVE_SLOW_SQL_LOG", "sql_lent.log"), encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        sqlprof.log.addHandler(handler)
+    sqlprof.install(SLOW_SQL_MS)
+
+
+# Métriques Prometheus (metrics.py, page /metrics) : requêtes par endpoint, pool
+# SQLite, caches, uploads ; temps SQL par verbe si les connexions sont
+# instrumentées (profilage ci-dessus ou CAVE_METRICS_SQL=1). Plusieurs processus :
+# CAVE_METRICS_DIR=<dossier partagé>.
+METRICS_SQL = os.environ.get("CAVE_METRICS_SQL") == "1"
+CONNECT_HOOKS.append(metrics.on_connect)
+ENGINE_HOOKS.append(metrics.on_engine_wait)
+sqlprof.STATEMENT_HOOKS.append(metrics.on_statement)
+metrics.watch_cache("stats", stats_cache)
+
+if SQL_PROFILE or SLOW_SQL_MS is not None or METRICS_SQL:
+    enable_sql_instrumentation()
+
+
+# ---------------------------------------------------------------------
+# Métriques HTTP (déclarées en premier : la durée inclut commit et profil)
+# ---------------------------------------------------------------------
+@app.before_request
+def start_request_timer():
+    g.metrics_t0 = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    t0 = g.pop("metrics_t0", None)
+    if t0 is not None:
+        endpoint = request.endpoint or "inconnu"
+        metrics.HTTP_DURATION.observe(time.perf_counter() - t0, endpoint)
+        metrics.HTTP_REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        metrics.maybe_flush()
+    return response
+
+
+# ---------------------------------------------------------------------
+# Profil SQL par requête (déclaré avant la session : ses hooks de fin
+# passent après le commit et la fermeture, donc les comptent)
+# ---------------------------------------------------------------------
+@app.before_request
+def start_sql_profile():
+    if SQL_PROFILE and request.endpoint not in ("static", "_sql"):
+        g.sql_profile = sqlprof.start(f"{request.method} {request.full_path.rstrip('?')}")
+
+
+@app.after_request
+def sql_profile_headers(response):
+    """Résumé SQL de la requête, commit compris (corps streamé : profil clos en fin de flux)."""
+    prof = g.get("sql_profile")
+    if prof is not None:
+        prof.status = response.status_code
+        response.headers["Server-Timing"] = prof.server_timing()
+        response.headers["X-SQL-Requetes"] = str(len(prof.queries))
+        if response.is_streamed:
+            response.response = sqlprof.stream(prof, response.response)
+            g.sql_streamed = True
+    return response
+
+
+@app.teardown_request
+def stop_sql_profile(exc):
+    prof = g.pop("sql_profile", None)
+    if prof is not None:
+        sqlprof.stop()
+        if not g.pop("sql_streamed", False):
+            sqlprof.finish(prof, prof.status or (500 if exc else None))
+
+
+# ---------------------------------------------------------------------
+# Unité de travail SQLite par requête (g.db)
+# ---------------------------------------------------------------------
+@app.before_request
+def open_db_session():
+    """Ouvre la session SQLite de la requête : tous les appels modèle la rejoignent."""
+    if JOBS_INPROCESS:
+        jobs.start_thread()
+    g.db = begin_session()
+
+
+@app.after_request
+def commit_db_session(response):
+    """Valide en un seul commit les écritures de la requête, avant l'envoi de la réponse."""
+    if "db" in g and response.status_code < 500:
+        g.db.commit()
+    return response
+
+
+@app.after_request
+def cache_hashed_uploads(response):
+    """Photos nommées par empreinte : contenu figé, cache navigateur d'un an."""
+    if request.path.startswith("/static/uploads/") and photos.is_hashed(request.path) \
+            and response.status_code in (200, 304):
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+@app.teardown_request
+def close_db_session(exc):
+    """Annule ce qui n'a pas été validé (erreur) et rend la connexion au pool."""
+    sess = g.pop("db", None)
+    if sess is not None:
+        end_session(sess, commit=False)
+
 
 # ---------------------------------------------------------------------
 # Petites aides
 # ---------------------------------------------------------------------
+app.add_template_filter(photos.thumb, "thumb")
+
+
 def current_uid() -> Optional[int]:
     """Renvoie l'ID utilisateur en session (ou None)."""
     return session.get("uid")
@@ -54,6 +202,84 @@ def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+class CursorPage:
+    """
+    Itère au plus `size` lignes d'un itérateur de lignes portant une colonne
+    `curseur`. Une fois le parcours terminé, `next_cursor` vaut le curseur à
+    passer pour la page suivante (None s'il n'y en a pas).
+    Le modèle doit fournir size + 1 lignes pour détecter la suite.
+    """
+
+    def __init__(self, rows, size: int):
+        self._rows = rows
+        self.size = size
+        self.count = 0
+        self.next_cursor: Optional[str] = None
+
+    def __iter__(self):
+        last = None
+        try:
+            for row in self._rows:
+                if self.count == self.size:
+                    self.next_cursor = last["curseur"]
+                    break
+                self.count += 1
+                last = row
+                yield row
+        finally:
+            close = getattr(self._rows, "close", None)
+            if close:
+                close()
+
+
+def stream_page(template: str, **context) -> Response:
+    """
+    Rend un template en flux (morceaux envoyés au fil du rendu) : la mémoire et
+    le délai du premier octet ne dépendent plus du nombre de lignes.
+    Les messages flash sont consommés avant l'envoi des en-têtes, sinon la
+    session (cookie) ne pourrait plus les retirer.
+    """
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template).stream(context)
+    stream.enable_buffering(64)
+    return Response(stream_with_context(stream), mimetype="text/html")
+
+
+# Change à chaque déploiement (mtime de app.py) : un ETag ne survit pas à un changement de templates
+ETAG_SALT = os.environ.get("CAVE_ETAG_SALT") or str(int(os.path.getmtime(__file__)))
+
+
+def conditional(keys_fn):
+    """
+    GET conditionnel : ETag = hash(utilisateur, URL, versions des ressources lues par la page).
+    keys_fn(**view_args) -> clés de version_ressource (triggers, migration 0010).
+    Si If-None-Match correspond, 304 avant toute requête lourde de la vue.
+    Pas d'ETag quand des messages flash attendent d'être affichés.
+    """
+    def deco(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method != "GET" or session.get("_flashes"):
+                return view(*args, **kwargs)
+            keys = keys_fn(**kwargs)
+            versions = resource_versions(keys)
+            raw = "|".join([ETAG_SALT, str(current_uid()), request.full_path]
+                           + [f"{k}={versions[k]}" for k in keys])
+            etag = hashlib.sha1(raw.encode()).hexdigest()[:24]
+            if request.if_none_match.contains(etag):
+                resp = Response(status=304)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag)
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+        return wrapped
+    return deco
+
+
 def login_required(view):
     """Décorateur qui force l'authentification avant d'accéder à la vue."""
     @wraps(view)
@@ -67,6 +293,11 @@ def login_required(view):
 # ---------------------------------------------------------------------
 # Tableau de bord (KPIs)
 # ---------------------------------------------------------------------
+def _top_rated() -> list:
+    """Top 4 global (bouteilles ayant au moins 1 avis), partagé par tous les utilisateurs."""
+    return Revue.top_rated(4)
+
+
 def build_user_stats(uid: Optional[int]) -> dict:
     """
     Construit les statistiques affichées dans l'en-tête (KPIs).
@@ -77,6 +308,9 @@ def build_user_stats(uid: Optional[int]) -> dict:
         * my_value   : valeur estimée (quantité * prix)
         * my_drunk   : nb de bouteilles bues (archives motif 'BUE')
         * my_reviews : nb d'avis rédigés par l'utilisateur
+    Les deux parties sont servies par `stats_cache` : top_rated expire (TTL), la
+    partie utilisateur suit sa version 'user:<uid>' (écritures de tous les
+    processus) : un rendu de page ne refait plus les agrégations.
     """
     stats = {
         "my_bottles": 0,
@@ -84,57 +318,10 @@ def build_user_stats(uid: Optional[int]) -> dict:
         "my_drunk": 0,
         "my_reviews": 0,
         "my_lots": 0,
-        "top_rated": [],
+        "top_rated": stats_cache.get_or_set(("top_rated",), _top_rated, ttl=TOP_RATED_TTL),
     }
-
-    with DB() as c:
-        # Top 4 global (bouteilles ayant au moins 1 avis)
-        stats["top_rated"] = c.execute("""
-            SELECT b.id_bouteille, b.nom, b.domaine, b.annee, b.type, b.region,
-                   ROUND(AVG(r.score), 2) AS moyenne, COUNT(r.id_revue) AS n
-            FROM bouteille b
-            JOIN revue r ON r.bouteille_id = b.id_bouteille
-            GROUP BY b.id_bouteille
-            HAVING n >= 1
-            ORDER BY moyenne DESC, n DESC
-            LIMIT 4
-        """).fetchall()
-
-        if not uid:
-            return stats
-
-        # KPIs liés à l'utilisateur courant
-        row = c.execute("""
-            SELECT
-              COALESCE(SUM(s.quantite), 0) AS q_bottles,
-              COALESCE(SUM(CASE WHEN s.quantite > 0 THEN 1 ELSE 0 END), 0) AS q_lots,
-              COALESCE(SUM(s.quantite * b.prix), 0.0) AS v_value
-            FROM cave cv
-            JOIN etagere e              ON e.id_cave      = cv.id_cave
-            LEFT JOIN stock_bouteilles s ON s.id_etagere   = e.id_etagere
-            LEFT JOIN bouteille b        ON b.id_bouteille = s.id_bouteille
-            WHERE cv.id_utilisateur = ?
-        """, (uid,)).fetchone()
-
-        stats["my_bottles"] = int(row["q_bottles"] or 0)
-        stats["my_lots"] = int(row["q_lots"] or 0)
-        stats["my_value"] = float(row["v_value"] or 0.0)
-
-        row2 = c.execute("""
-            SELECT COALESCE(SUM(a.quantite), 0) AS drunk
-            FROM sortie_archive a
-            JOIN stock_bouteilles s ON s.id_stock = a.id_stock
-            JOIN etagere e          ON e.id_etagere = s.id_etagere
-            JOIN cave cv            ON cv.id_cave   = e.id_cave
-            WHERE a.id_utilisateur = ?
-              AND cv.id_utilisateur = ?
-              AND UPPER(a.motif)='BUE'
-        """, (uid, uid)).fetchone()
-        stats["my_drunk"] = int(row2["drunk"] or 0)
-
-        row3 = c.execute("SELECT COUNT(*) AS n FROM revue WHERE auteur_id=?", (uid,)).fetchone()
-        stats["my_reviews"] = int(row3["n"] or 0)
-
+    if uid:
+        stats.update(user_cached("user", uid, lambda: Utilisateur.kpis(uid)))
     return stats
 
 
@@ -218,6 +405,7 @@ def deconnexion():
 # Bouteilles : fiche + avis
 # ---------------------------------------------------------------------
 @app.route("/bouteilles/<int:bid>", methods=["GET", "POST"])
+@conditional(lambda bid: [f"bouteille:{bid}"])
 def bouteille_detail(bid: int):
     """
     Affiche la fiche bouteille et ses avis.
@@ -261,21 +449,83 @@ def bouteille_detail(bid: int):
 # ---------------------------------------------------------------------
 # Page “Avis de la communauté”
 # ---------------------------------------------------------------------
+AVIS_PAGE_SIZE = 200
+
 @app.route("/avis")
+@conditional(lambda: ["revues"])
 def avis():
     """
-    Liste les avis (tous utilisateurs) avec recherche ?q=... (nom/domaine/région).
+    Liste les avis (tous utilisateurs) avec recherche ?q=... (nom/domaine/région/commentaire).
+    Pagination par curseur : ?after=<curseur de la dernière carte>.
     """
     q = (request.args.get("q") or "").strip()
-    rows = Revue.community_reviews(q)
-    return render_template("avis.html", q=q, rows=rows)
+    after = request.args.get("after") or None
+    rows = Revue.community_reviews(q, after=after, limit=AVIS_PAGE_SIZE)
+    next_after = rows[-1]["curseur"] if len(rows) == AVIS_PAGE_SIZE else None
+    return render_template("avis.html", q=q, rows=rows, after=after, next_after=next_after)
 
 
 # ---------------------------------------------------------------------
 # Ma cave (tri / filtre / opérations de stock)
 # ---------------------------------------------------------------------
+def shelf_grid(etageres, stock, sort: str = "slot") -> dict:
+    """
+    Grille prête à afficher, construite en une passe sur le stock :
+    {id_etagere: [lot ou None] * capacite}.
+    - sort == 'slot' : le lot est à l'index slot-1 (premier lot du slot s'il y en a plusieurs),
+    - sinon : lots dans l'ordre du tri, cases vides ensuite.
+    """
+    grid = {E.id_etagere: [None] * E.capacite for E in etageres}
+    filled = dict.fromkeys(grid, 0)
+    for r in stock:
+        row = grid.get(r["id_etagere"])
+        if row is None:
+            continue
+        if sort == "slot":
+            slot = r["slot"]
+            if r["id_stock"] and slot and 1 <= slot <= len(row) and row[slot - 1] is None:
+                row[slot - 1] = r
+        else:
+            i = filled[r["id_etagere"]]
+            if i < len(row):
+                row[i] = r if r["id_bouteille"] else None
+                filled[r["id_etagere"]] = i + 1
+    return grid
+
+
+# Fragments HTML des étagères : (id_etagere, version, capacite, vue) -> Markup
+SHELF_FRAGMENT_TTL = 3600
+fragment_cache = TTLCache(ttl=SHELF_FRAGMENT_TTL, maxsize=2048)
+metrics.watch_cache("fragments", fragment_cache)
+
+
+def render_shelves(etageres, view: tuple, load_stock) -> dict:
+    """
+    HTML des cases de chaque étagère ({id_etagere: Markup}).
+    Clé de cache : (id_etagere, version, capacite) + vue (tri, ordre, filtre) ;
+    la version est incrémentée par trigger à chaque écriture de stock sur l'étagère,
+    donc seules les étagères modifiées sont re-rendues et load_stock(ids) ne charge
+    que leur stock.
+    """
+    sort = view[0]
+    keys = {E.id_etagere: ("etagere", E.id_etagere, E.version, E.capacite) + view for E in etageres}
+    out = {eid: fragment_cache.get(key) for eid, key in keys.items()}
+    missing = [E for E in etageres if out[E.id_etagere] is None]
+    if missing:
+        grid = shelf_grid(missing, load_stock([E.id_etagere for E in missing]), sort)
+        tpl = app.jinja_env.get_template("_etagere_slots.html")
+        consume_url = url_for("stock_consommer")
+        for E in missing:
+            html = Markup(tpl.render(slots=grid[E.id_etagere], consume_url=consume_url,
+                                     show_slot=(sort == "slot")))
+            fragment_cache.set(keys[E.id_etagere], html)
+            out[E.id_etagere] = html
+    return out
+
+
 @app.route("/ma-cave")
 @login_required
+@conditional(lambda: [f"user:{current_uid()}", "catalogue"])
 def ma_cave():
     """
     Vue 'Ma cave' :
@@ -301,51 +551,20 @@ def ma_cave():
     filt_value = (request.args.get("value") or "").strip()
 
     etageres = Etagere.list_for_cave(cave.id_cave)
-    stock_all = Stock_bouteilles.list_for_user(uid)
-
-    # Options de filtre (valeurs distinctes existantes)
-    def distinct(rows, key):
-        return sorted({str(r[key]) for r in rows if r[key] is not None and str(r[key]).strip() != ""})
-
-    filter_values_map = {
-        "region":  distinct(stock_all, "region"),
-        "type":    distinct(stock_all, "type"),
-        "annee":   sorted({int(r["annee"]) for r in stock_all if r["annee"] is not None}),
-        "domaine": distinct(stock_all, "domaine"),
-        "nom":     distinct(stock_all, "nom"),
-    }
-    current_options = filter_values_map.get(filt_field, [])
 
-    # Filtrage
-    stock = stock_all
-    if filt_field in filter_values_map and filt_value:
-        if filt_field == "annee":
-            try:
-                v = int(filt_value)
-                stock = [r for r in stock_all if r["annee"] == v]
-            except ValueError:
-                stock = stock_all
-        else:
-            lv = filt_value.lower()
-            stock = [r for r in stock_all if (r[filt_field] or "").lower() == lv]
-
-    # Tri (clé serveur)
-    key_map = {
-        "slot":    lambda r: (r["id_etagere"], r["slot"] if r["slot"] is not None else 9999),
-        "nom":     lambda r: (r["id_etagere"], (r["nom"] or "").lower()),
-        "domaine": lambda r: (r["id_etagere"], (r["domaine"] or "").lower()),
-        "annee":   lambda r: (r["id_etagere"], r["annee"] or -9999),
-        "type":    lambda r: (r["id_etagere"], (r["type"] or "").lower()),
-        "region":  lambda r: (r["id_etagere"], (r["region"] or "").lower()),
-    }
-    key_fn = key_map.get(sort, key_map["slot"])
-    stock = sorted(stock, key=key_fn, reverse=(direction == "desc"))
+    # Filtre + tri faits en SQL ; options de filtre (valeurs distinctes) en cache ;
+    # stock chargé seulement pour les étagères dont le fragment n'est pas en cache
+    current_options = Stock_bouteilles.facets(uid).get(filt_field, [])
+    fragments = render_shelves(
+        etageres, (sort, direction, filt_field, filt_value),
+        lambda ids: Stock_bouteilles.list_for_user(uid, sort, direction, filt_field, filt_value, ids),
+    )
 
     bottles_all = Bouteille.list_all_light()
 
     return render_template(
         "ma_cave.html",
-        cave=cave, etageres=etageres, stock=stock, bottles_all=bottles_all,
+        cave=cave, etageres=etageres, fragments=fragments, bottles_all=bottles_all,
         sort=sort, direction=direction, filt_field=filt_field,
         filt_value=filt_value, current_options=current_options,
     )
@@ -366,8 +585,6 @@ def bouteille_nouvelle():
         flash("Cave créée. Ajoute des étagères puis des bouteilles.", "info")
         return redirect(url_for("ma_cave"))
 
-    shelves = Etagere.list_for_cave(cave.id_cave)
-
     if request.method == "POST":
         # Champs bouteille
         domaine = (request.form.get("domaine") or "").strip()
@@ -389,15 +606,17 @@ def bouteille_nouvelle():
         if not (id_etagere and quantite and quantite > 0):
             flash("Choisis une étagère et une quantité > 0.", "error")
             return redirect(url_for("bouteille_nouvelle"))
-        if Etagere.capacity_left(id_etagere) < quantite:
+        etagere = Etagere.get_owned(id_etagere, uid)
+        if not etagere:
+            flash("Étagère introuvable.", "error")
+            return redirect(url_for("bouteille_nouvelle"))
+        if etagere.capacite - etagere.occupe < quantite:
             flash("Capacité insuffisante sur l’étagère.", "error")
             return redirect(url_for("bouteille_nouvelle"))
 
-        # Choix du slot (auto si vide / hors bornes)
-        shelf_map = {e.id_etagere: e for e in shelves}
-        cap = shelf_map[id_etagere].capacite
-        if not slot or slot < 1 or slot > cap:
-            slot = Stock_bouteilles.next_free_slot(id_etagere, cap)
+        # Choix du slot (auto si vide / hors bornes : réservé à l'insertion du lot)
+        if not slot or slot < 1 or slot > etagere.capacite:
+            slot = None
 
         # Upload photo (facultatif)
         photo_path = None
@@ -406,26 +625,22 @@ def bouteille_nouvelle():
             if not allowed_file(file.filename):
                 flash("Format d'image non autorisé (png/jpg/jpeg/gif/webp).", "error")
                 return redirect(url_for("bouteille_nouvelle"))
-            filename = secure_filename(file.filename)
-            base, ext = os.path.splitext(filename)
-            unique = f"{base}_{uid}_{int(datetime.now().timestamp())}{ext}"
-            save_path = os.path.join(app.config["UPLOAD_FOLDER"], unique)
-            file.save(save_path)
-            photo_path = f"uploads/{unique}"
-
-        # Création bouteille + ajout de lot
-        with DB() as c:
-            cur = c.execute("""
-                INSERT INTO bouteille(domaine, nom, type, annee, region, prix, photo)
-                VALUES (?,?,?,?,?,?,?)
-            """, (domaine, nom, type_, annee, region, prix, photo_path))
-            id_bouteille = cur.lastrowid
-
-        Stock_bouteilles.add_or_increment(id_etagere, id_bouteille, quantite, slot)
-        flash("Bouteille ajoutée à ta cave ✅", "success")
+            photo_path = photos.save_upload(file)
+
+        # Fiche catalogue (réutilisée si même domaine/nom/millésime) + ajout de lot
+        id_bouteille, creee = Bouteille.upsert(domaine, nom, type_, annee, region, prix, photo_path)
+
+        try:
+            Stock_bouteilles.add_or_increment(id_etagere, id_bouteille, quantite, slot, uid=uid)
+        except ValueError as e:
+            g.db.rollback()  # bouteille + lot : tout ou rien
+            flash(str(e), "error")
+            return redirect(url_for("bouteille_nouvelle"))
+        flash("Bouteille ajoutée à ta cave ✅" if creee
+              else "Bouteille déjà au catalogue : lot ajouté à ta cave ✅", "success")
         return redirect(url_for("ma_cave"))
 
-    return render_template("bouteille_nouvelle.html", shelves=shelves)
+    return render_template("bouteille_nouvelle.html", shelves=Etagere.list_for_cave(cave.id_cave))
 
 
 @app.route("/stock/consommer", methods=["POST"], endpoint="stock_consommer")
@@ -446,17 +661,11 @@ def stock_consommer():
         flash("Quantité invalide.", "error")
         return redirect(url_for("ma_cave"))
 
-    lot = Stock_bouteilles.get_lot(id_stock)
+    lot = Stock_bouteilles.get_owned_lot(id_stock, uid)
     if not lot:
         flash("Lot introuvable.", "error")
         return redirect(url_for("ma_cave"))
 
-    cave = Cave.get_by_user(uid)
-    shelf_ids = {e.id_etagere for e in Etagere.list_for_cave(cave.id_cave)}
-    if lot.id_etagere not in shelf_ids:
-        flash("Accès refusé à ce lot.", "error")
-        return redirect(url_for("ma_cave"))
-
     try:
         SortieArchive.add(
             id_stock=lot.id_stock,
@@ -466,8 +675,9 @@ def stock_consommer():
             id_bouteille=lot.id_bouteille,
             id_etagere=lot.id_etagere,
         )
-        Stock_bouteilles.decrement(id_stock, q)
+        Stock_bouteilles.decrement(id_stock, q, uid=uid)
     except ValueError as e:
+        g.db.rollback()  # archive + décrément : tout ou rien
         flash(str(e), "error")
         return redirect(url_for("ma_cave"))
 
@@ -479,6 +689,49 @@ def stock_consommer():
     return redirect(url_for("ma_cave"))
 
 
+def read_csv_rows(text_stream):
+    """
+    Lit un CSV ligne à ligne (séparateur ',' ou ';' détecté sur l'en-tête),
+    en-têtes normalisés en minuscules. Renvoie un itérateur de dict.
+    """
+    header = text_stream.readline()
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    fields = [h.strip().lower() for h in next(csv.reader([header], delimiter=delimiter), [])]
+    return csv.DictReader(text_stream, fieldnames=fields, delimiter=delimiter)
+
+
+@app.route("/import", methods=["GET", "POST"])
+@login_required
+def import_csv():
+    """
+    Import en masse d'un CSV (domaine, nom, type, annee, region, prix, quantite
+    [, etagere, slot]) : simulation d'abord (rapport), puis import réel.
+    """
+    uid = current_uid()
+    cave = Cave.get_by_user(uid)
+    shelves = Etagere.list_for_cave(cave.id_cave) if cave else []
+    report = None
+
+    if request.method == "POST":
+        file = request.files.get("fichier")
+        if not file or not file.filename:
+            flash("Choisis un fichier CSV.", "error")
+            return redirect(url_for("import_csv"))
+        dry_run = request.form.get("simulation") == "1"
+        rows = read_csv_rows(io.TextIOWrapper(file.stream, encoding="utf-8-sig", newline=""))
+        try:
+            report = bulk_import(uid, rows, dry_run=dry_run,
+                                 id_etagere_defaut=request.form.get("id_etagere", type=int))
+        except (UnicodeDecodeError, csv.Error) as e:
+            flash(f"Fichier illisible : {e}", "error")
+            return redirect(url_for("import_csv"))
+        if not dry_run and report.ok:
+            flash(f"Import terminé ✅ {report.bouteilles_placees} bouteille(s) en {report.lots} lot(s).", "success")
+            return redirect(url_for("ma_cave"))
+
+    return render_template("import.html", shelves=shelves, report=report, columns=IMPORT_COLUMNS)
+
+
 @app.post("/stock/affecter")
 @login_required
 def stock_affecter():
@@ -490,39 +743,108 @@ def stock_affecter():
     id_stock = request.form.get("id_stock", type=int)
     slot = request.form.get("slot", type=int)
 
-    lot = Stock_bouteilles.get_lot(id_stock)
+    lot = Stock_bouteilles.get_owned_lot(id_stock, uid) if id_stock else None
     if not lot:
         flash("Lot introuvable.", "error")
         return redirect(url_for("ma_cave"))
 
-    cave = Cave.get_by_user(uid)
-    shelf_ids = {e.id_etagere for e in Etagere.list_for_cave(cave.id_cave)}
-    if lot.id_etagere not in shelf_ids:
-        flash("Accès refusé à ce lot.", "error")
-        return redirect(url_for("ma_cave"))
-
     if not slot or slot < 1:
-        E = [e for e in Etagere.list_for_cave(cave.id_cave) if e.id_etagere == lot.id_etagere][0]
-        slot = Stock_bouteilles.next_free_slot(lot.id_etagere, E.capacite)
+        slot = None  # premier slot libre, réservé dans la transaction
 
-    Stock_bouteilles.set_slot(id_stock, slot)
+    try:
+        slot = Stock_bouteilles.set_slot(id_stock, slot, id_etagere=lot.id_etagere)
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for("ma_cave"))
     flash(f"Lot affecté au slot #{slot} ✅", "success")
     return redirect(url_for("ma_cave"))
 
 
+# ---------------------------------------------------------------------
+# Opérations groupées sur plusieurs lots (sélection de Ma cave)
+# ---------------------------------------------------------------------
+LOT_BATCH_MAX = 200
+
+
+def batch_form(*fields: str) -> list:
+    """
+    Lit un formulaire groupé : `id_stock` répété, et pour chaque champ de `fields`
+    soit une valeur par lot (même ordre), soit une seule valeur pour tous.
+    Renvoie [(id_stock, valeur, ...)] (valeur vide -> None) ; ValueError sinon.
+    """
+    def number(name: str, raw: str) -> Optional[int]:
+        raw = raw.strip()
+        try:
+            return int(raw) if raw else None
+        except ValueError:
+            raise ValueError(f"« {name} » invalide : {raw!r}") from None
+
+    ids = [number("id_stock", v) for v in request.form.getlist("id_stock")]
+    ids = [i for i in ids if i is not None]
+    if not ids:
+        raise ValueError("Aucun lot sélectionné.")
+    if len(ids) > LOT_BATCH_MAX:
+        raise ValueError(f"Trop de lots à la fois (max {LOT_BATCH_MAX}).")
+    columns = []
+    for name in fields:
+        values = request.form.getlist(name)
+        if len(values) <= 1:
+            values = (values or [""]) * len(ids)
+        if len(values) != len(ids):
+            raise ValueError(f"« {name} » : {len(values)} valeur(s) pour {len(ids)} lot(s).")
+        columns.append([number(name, v) for v in values])
+    return list(zip(ids, *columns))
+
+
+@app.post("/stock/consommer/groupe")
+@login_required
+def stock_consommer_groupe():
+    """
+    Consomme plusieurs lots en une requête : id_stock répété + quantite
+    (une par lot ou une pour tous, 1 par défaut). Tout ou rien : propriété et
+    quantités vérifiées d'un coup, archivage groupé dans une seule transaction.
+    """
+    uid = current_uid()
+    try:
+        ops = batch_form("quantite")
+        n = Stock_bouteilles.consume_many(uid, [(i, 1 if q is None else q) for i, q in ops])
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for("ma_cave"))
+    flash(f"Santé ! 🍷 {n} bouteille(s) sortie(s) de {len(ops)} lot(s).", "success")
+    return redirect(url_for("ma_cave"))
+
+
+@app.post("/stock/affecter/groupe")
+@login_required
+def stock_affecter_groupe():
+    """
+    Range / déplace plusieurs lots en une requête : id_stock répété + id_etagere
+    (vide = étagère actuelle) + slot (vide = premier libre). Propriété, capacité
+    des étagères et slots vérifiés d'un coup, une seule transaction.
+    """
+    uid = current_uid()
+    try:
+        ops = batch_form("id_etagere", "slot")
+        moved = Stock_bouteilles.move_many(
+            uid, [(i, eid, slot if slot and slot > 0 else None) for i, eid, slot in ops]
+        )
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for("ma_cave"))
+    flash(f"{len(moved)} lot(s) rangé(s) ✅" if moved else "Rien à déplacer : les lots sont déjà à leur place.",
+          "success")
+    return redirect(url_for("ma_cave"))
+
+
 @app.route("/stock/ajouter-catalogue", methods=["POST"])
 @login_required
 def stock_add_from_catalog():
     """
     Ajoute (ou incrémente) un lot à partir d'une bouteille existante du catalogue.
-    - calcule un slot libre si slot non renseigné.
+    - réserve le premier slot libre si slot non renseigné.
     """
     uid = current_uid()
-    cave = Cave.get_by_user(uid)
-    if not cave:
-        flash("Cave introuvable.", "error")
-        return redirect(url_for("ma_cave"))
-
     id_bouteille = request.form.get("id_bouteille", type=int)
     id_etagere   = request.form.get("id_etagere", type=int)
     quantite     = request.form.get("quantite", type=int)
@@ -534,21 +856,15 @@ def stock_add_from_catalog():
         flash("Champs invalides.", "error")
         return redirect(url_for("ma_cave"))
 
-    shelves = {e.id_etagere: e for e in Etagere.list_for_cave(cave.id_cave)}
-    E = shelves.get(id_etagere)
-    if not E:
+    if not Etagere.get_owned(id_etagere, uid):
         flash("Étagère invalide.", "error")
         return redirect(url_for("ma_cave"))
 
-    left = Etagere.capacity_left(id_etagere)
-    if left < quantite:
-        flash(f"Capacité insuffisante : {left} place(s) restante(s).", "error")
+    try:  # capacité + slot vérifiés dans la transaction d'écriture
+        Stock_bouteilles.add_or_increment(id_etagere, id_bouteille, quantite, slot, uid=uid)
+    except ValueError as e:
+        flash(str(e), "error")
         return redirect(url_for("ma_cave"))
-
-    if slot is None:
-        slot = Stock_bouteilles.next_free_slot(id_etagere, E.capacite)
-
-    Stock_bouteilles.add_or_increment(id_etagere, id_bouteille, quantite, slot)
     flash("Bouteille ajoutée à ta cave ✅", "success")
     return redirect(url_for("ma_cave"))
 
@@ -614,25 +930,96 @@ def etagere_supprimer():
 # ---------------------------------------------------------------------
 # Historique & export
 # ---------------------------------------------------------------------
+HISTORIQUE_PAGE_SIZE = 100
+HISTORIQUE_PAGE_MAX = 1000
+
 @app.route("/historique")
 @login_required
+@conditional(lambda: [f"user:{current_uid()}"])
 def historique():
     """
     Liste l'historique des sorties (archives), rejoint avec bouteille/étagère.
+    - pagination par curseur (date, id_archive) : ?before=<curseur>&n=<taille>,
+    - réponse streamée : la page est lue par blocs courts (SortieArchive.iter_for_user),
+      aucune lecture SQLite ne reste ouverte pendant l'envoi.
     """
-    uid = current_uid()
-    with DB() as c:
-        moves = c.execute("""
-            SELECT a.date, a.quantite, a.motif,
-                   b.domaine, b.nom, b.annee, b.type, b.region,
-                   COALESCE(e.nom, '(Étagère supprimée)') AS etagere_nom
-            FROM sortie_archive a
-            LEFT JOIN bouteille b ON b.id_bouteille = a.id_bouteille
-            LEFT JOIN etagere  e  ON e.id_etagere   = a.id_etagere
-            WHERE a.id_utilisateur = ?
-            ORDER BY a.date DESC
-        """, (uid,)).fetchall()
-    return render_template("historique.html", moves=moves)
+    size = min(max(request.args.get("n", type=int) or HISTORIQUE_PAGE_SIZE, 1), HISTORIQUE_PAGE_MAX)
+    before = request.args.get("before") or None
+    rows = SortieArchive.iter_for_user(current_uid(), before=before, limit=size + 1)
+    return stream_page("historique.html", moves=CursorPage(rows, size), before=before, n=size)
+
+
+EXPORT_MIMETYPES = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+EXPORT_BATCH = 500  # lignes sérialisées par morceau envoyé
+
+
+def _serialize_rows(rows, columns: list, fmt: str):
+    """Génère le fichier d'export par morceaux de EXPORT_BATCH lignes (mémoire constante)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf) if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+    n = 0
+    for row in rows:
+        if writer:
+            writer.writerow([row[k] for k in columns])
+        else:
+            buf.write(json.dumps({k: row[k] for k in columns}, ensure_ascii=False) + "\n")
+        n += 1
+        if n % EXPORT_BATCH == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def _gzip_chunks(chunks):
+    """Compresse un flux d'octets à la volée (format gzip)."""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def export_response(rows, columns: list, basename: str) -> Response:
+    """
+    Réponse d'export streamée (?format=csv|jsonl), compressée en gzip si le
+    client l'accepte. `rows` doit lire la base par blocs courts (iter_for_user
+    des modèles) et non itérer un curseur ouvert : sans WAL, la lecture en cours
+    (verrou SHARED) bloquerait les écritures pendant tout le téléchargement.
+    """
+    fmt = (request.args.get("format") or "csv").lower()
+    if fmt not in EXPORT_MIMETYPES:
+        fmt = "csv"
+    body = _serialize_rows(rows, columns, fmt)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{basename}_{datetime.now():%Y%m%d}.{fmt}"',
+        "Vary": "Accept-Encoding",
+    }
+    if request.accept_encodings["gzip"]:
+        body = _gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return Response(stream_with_context(body), content_type=EXPORT_MIMETYPES[fmt], headers=headers)
+
+
+@app.get("/export/stock")
+@login_required
+def export_stock():
+    """Exporte le stock (un lot par ligne) en CSV ou JSONL."""
+    columns = ["id_stock", "etagere_nom", "slot", "quantite", "id_bouteille",
+               "domaine", "nom", "type", "annee", "region", "prix"]
+    return export_response(Stock_bouteilles.iter_for_user(current_uid()), columns, "cave_stock")
+
+
+@app.get("/export/historique")
+@login_required
+def export_historique():
+    """Exporte tout l'historique des sorties en CSV ou JSONL."""
+    columns = ["date", "quantite", "motif", "domaine", "nom", "annee", "type", "region", "etagere_nom"]
+    return export_response(SortieArchive.iter_for_user(current_uid()), columns, "cave_historique")
 
 
 # ---------------------------------------------------------------------
@@ -647,8 +1034,158 @@ def _routes():
     ) + "</pre>"
 
 
+@app.get("/_sql")
+def _sql():
+    """Profils SQL des dernières requêtes, instructions les plus coûteuses d'abord (debug)."""
+    if not SQL_PROFILE:
+        abort(404)
+    lines = []
+    for p in reversed(sqlprof.recent):
+        lines.append(
+            f"{p.label}  [{p.status}]  {(p.total_s or 0) * 1000:.1f}ms  —  {len(p.queries)} requête(s) SQL "
+            f"{p.sql_s * 1000:.2f}ms, attente connexion {p.waits['connexion'] * 1000:.2f}ms, "
+            f"file d'écriture {p.waits['file_ecriture'] * 1000:.2f}ms, {p.commits} commit(s) {p.commit_s * 1000:.2f}ms"
+        )
+        for sql, n, sec, rows in p.by_statement():
+            lines.append(f"  {n:4d}×  {sec * 1000:8.2f}ms  {rows:6d} ligne(s)  {sql[:240]}")
+        lines.append("")
+    return "<pre>" + str(escape("\n".join(lines) or "Aucune requête profilée.")) + "</pre>"
+
+
+@app.get("/metrics")
+def metrics_page():
+    """Métriques au format texte Prometheus (tous les processus si CAVE_METRICS_DIR)."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.get("/_jobs")
+def _jobs():
+    """File de tâches de fond : profondeur par état et latences (JSON). Diagnostic, comme /_sql."""
+    if not SQL_PROFILE:
+        abort(404)
+    return jobs.stats()
+
+
+# ---------------------------------------------------------------------
+# Tâches de fond (gestionnaires ; miniatures : voir photos.py)
+# ---------------------------------------------------------------------
+@jobs.handler("notes", lease=600.0)  # recalcul complet : long sur une grosse base
+def _ratings_job(payload: dict) -> None:
+    Revue.rebuild_ratings()
+
+
+# ---------------------------------------------------------------------
+# Commandes d'administration (flask --app app <commande>)
+# ---------------------------------------------------------------------
+@app.cli.command("rebuild-ratings")
+@click.option("--en-fond", is_flag=True, help="Confie le recalcul à un worker (tâche 'notes')")
+def rebuild_ratings_command(en_fond):
+    """Recalcule la table bouteille_rating depuis les avis."""
+    if en_fond:
+        print(f"✅ Tâche 'notes' n°{jobs.enqueue('notes')} en file")
+        return
+    n = Revue.rebuild_ratings()
+    print(f"✅ Agrégats de notes recalculés : {n} bouteille(s)")
+
+
+@app.cli.command("merge-bottles")
+@click.option("--simulation", is_flag=True, help="Compte seulement, ne fusionne rien")
+@click.option("--lot", type=int, default=200, show_default=True, help="Fiches traitées par transaction")
+def merge_bottles_command(simulation, lot):
+    """Fusionne les fiches bouteille en double (même domaine/nom/millésime)."""
+    st = Bouteille.merge_duplicates(batch=lot, dry_run=simulation)
+    print(f"{'Simulation' if simulation else 'Fusion'} : {st['fusionnees']} doublon(s) "
+          f"({st['lots']} lot(s), {st['archives']} archive(s), {st['avis']} avis repointés), "
+          f"{st['cles_attribuees']} clé(s) attribuée(s)")
+
+
+@app.cli.command("dedupe-uploads")
+@click.option("--simulation", is_flag=True, help="Compte seulement, ne touche à rien")
+def dedupe_uploads_command(simulation):
+    """Range les anciens uploads dans le stockage par contenu (doublons fusionnés)."""
+    st = photos.import_uploads(dry_run=simulation)
+    print(f"{st['fichiers']} fichier(s) à ranger -> {st['uniques']} photo(s) distincte(s)"
+          + ("" if simulation else f", {st['references']} bouteille(s) mises à jour"))
+
+
+@app.cli.command("gc-photos")
+@click.option("--simulation", is_flag=True, help="Compte seulement, ne supprime rien")
+@click.option("--delai", type=float, default=photos.GC_GRACE, show_default=True,
+              help="Âge minimal (s) d'un fichier non référencé avant suppression")
+def gc_photos_command(simulation, delai):
+    """Supprime les photos qu'aucune bouteille n'utilise (et leurs miniatures)."""
+    st = photos.gc_photos(dry_run=simulation, grace=delai)
+    print(f"{'À supprimer' if simulation else 'Supprimé'} : {st['non_referencees']} photo(s) sans bouteille, "
+          f"{st['orphelins']} fichier(s) orphelin(s), {st['miniatures']} miniature(s)")
+
+
+@app.cli.command("repair-counters")
+def repair_counters_command():
+    """Recalcule etagere.occupe depuis stock_bouteilles (compteurs de remplissage)."""
+    fixed = Etagere.repair_counters()
+    print(f"✅ {fixed} étagère(s) corrigée(s)" if fixed else "✅ Compteurs cohérents")
+
+
+@app.cli.command("import-csv")
+@click.argument("fichier", type=click.Path(exists=True, dir_okay=False))
+@click.option("--email", required=True, help="Propriétaire de la cave")
+@click.option("--simulation", is_flag=True, help="Rapport seulement, rien n'est écrit")
+def import_csv_command(fichier, email, simulation):
+    """Importe un CSV de bouteilles/lots dans la cave d'un utilisateur."""
+    u = Utilisateur.get_by_email(email.strip().lower())
+    if not u:
+        raise click.ClickException(f"Utilisateur inconnu : {email}")
+    with open(fichier, encoding="utf-8-sig", newline="") as f:
+        report = bulk_import(u.id_utilisateur, read_csv_rows(f), dry_run=simulation)
+    for n, msg in report.erreurs[:50]:
+        print(f"❌ ligne {n} : {msg}")
+    print(f"{'Simulation' if simulation else 'Import'} : {report.lignes} ligne(s), "
+          f"{report.bouteilles_creees} nouvelle(s) bouteille(s), {report.bouteilles_existantes} déjà au catalogue, "
+          f"{report.bouteilles_placees} bouteille(s) en {report.lots} lot(s)")
+    if not report.ok:
+        raise SystemExit(1)
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Applique les migrations en attente (aussi fait au démarrage de l'app)."""
+    applied = migrate()
+    print("✅ Migrations appliquées : " + (", ".join(applied) if applied else "aucune (à jour)"))
+
+
+@app.cli.command("worker")
+@click.option("--processus", type=int, default=1, show_default=True, help="Nb de processus workers")
+@click.option("--burst", is_flag=True, help="S'arrête quand la file est vide")
+def worker_command(processus, burst):
+    """Vide la file de tâches de fond (miniatures, recalculs...)."""
+    if processus <= 1:
+        n = jobs.run_worker(burst=burst)
+        print(f"✅ {n} tâche(s) traitée(s)")
+        return
+    procs = [multiprocessing.Process(target=jobs.run_worker, kwargs={"burst": burst}) for _ in range(processus)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    print(f"✅ {processus} worker(s) terminé(s)")
+
+
+@app.cli.command("check-indexes")
+def check_indexes_command():
+    """Échoue (code 1) si une requête chaude parcourt une table entière."""
+    offenders = check_query_plans()
+    for sql, detail in offenders:
+        print(f"❌ {detail}\n   {sql[:160]}")
+    if offenders:
+        raise SystemExit(1)
+    print("✅ Toutes les requêtes chaudes passent par un index")
+
+
 # ---------------------------------------------------------------------
 # Entrée
 # ---------------------------------------------------------------------
 if __name__ == "__main__":
+    SQL_PROFILE = True   # app.run(debug=True) : profil SQL comme sous `flask --debug run`
+    SLOW_SQL_MS = SLOW_SQL_MS if SLOW_SQL_MS is not None else 100.0
+    enable_sql_instrumentation()
     app.run(debug=True)
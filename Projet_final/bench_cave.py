@@ -0,0 +1,762 @@
+# bench_cave.py
+"""
+Mesures de performance : couche SQLite, rendu, et pages HTTP sur données synthétiques.
+
+    python bench_cave.py mixed [--readers 4] [--writers 2] [--duration 5]
+    python bench_cave.py slots [--workers 8] [--capacity 200]
+    python bench_cave.py cave [--lots 1000,10000,100000]
+    python bench_cave.py render [--shelves 50] [--capacity 200]
+    python bench_cave.py generate --out gros.db [--users 200] [--bottles 5000] [--reviews 50000]
+    python bench_cave.py http [--duration 10] [--threads 1] [--compare bench_results/ref.json]
+    python bench_cave.py budget
+
+Scénario "mixed" : des processus lecteurs (page Ma cave, avis) tournent en
+même temps que des processus écrivains (ajout/consommation/avis), d'abord en
+mode journal par défaut puis avec le profil WAL (models.configure_engine).
+On compare la latence des lectures (p50/p95/p99) et les erreurs "locked".
+Scénario "slots" : des processus ajoutent des lots en concurrence sur la
+même étagère sans choisir de slot ; on vérifie qu'aucun slot n'est attribué
+deux fois et que la liste des slots libres reste cohérente.
+Scénario "cave" : données de la page Ma cave (tri/filtre + options de
+filtre) calculées en Python sur tout le stock (ancien chemin) ou en SQL
+avec options en cache (Stock_bouteilles.list_for_user / facets).
+Scénario "render" : temps de rendu de ma_cave.html (grille shelf_grid +
+fragments d'étagères) pour une grande cave, en vue "slot" et en vue triée :
+à froid, fragments en cache, puis une seule étagère modifiée.
+"generate" : base synthétique (N utilisateurs avec cave et étagères remplies,
+M bouteilles, avis et historique de sorties suivant une loi de Zipf : quelques
+bouteilles concentrent l'essentiel de l'activité, comme en vrai).
+Scénario "http" : client de test Flask connecté comme plusieurs utilisateurs
+de cette base, mélange de pages (/ma-cave, /avis, /historique,
+/bouteilles/<bid>) et de POST de stock ; latence p50/p95/p99, requêtes SQL par
+requête HTTP et débit par route. Résultats en JSON (bench_results/) ;
+--compare signale les régressions par rapport à une mesure précédente.
+"budget" : nb de requêtes SQL de chaque route qui modifie des lots, comparé à
+QUERY_BUDGET (code 1 si une route le dépasse ou n'a pas l'effet attendu).
+Tout se passe dans un dossier temporaire : cave.db n'est jamais modifiée.
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import random
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+
+import init_db
+import models
+import sqlprof
+
+
+# ---------------------------------------------------------------------
+# Données de test
+# ---------------------------------------------------------------------
+def prepare_db(workdir: str, shelves: int = 20, lots_per_shelf: int = 40) -> int:
+    """Crée cave.db dans `workdir` (seed + une cave remplie) et renvoie l'uid du testeur."""
+    os.chdir(workdir)
+    init_db.init_db()
+    models.close_pools()
+    uid = models.Utilisateur.create("Bench", "bench@example.org", "x")
+    cave_id = models.Cave.create_for_user(uid, "Cave bench")
+    with models.Database(write=True) as c:
+        bids = [
+            c.execute(
+                "INSERT INTO bouteille(domaine, nom, type, annee, region, prix) VALUES (?,?,?,?,?,?)",
+                (f"Domaine {i}", f"Cuvée {i}", "Rouge", 2000 + i % 25, f"Région {i % 12}", 10.0 + i),
+            ).lastrowid
+            for i in range(200)
+        ]
+        for s in range(shelves):
+            eid = c.execute(
+                "INSERT INTO etagere(id_cave, nom, capacite) VALUES (?,?,?)",
+                (cave_id, f"Étagère {s + 1}", lots_per_shelf * 8),
+            ).lastrowid
+            c.executemany(
+                "INSERT INTO stock_bouteilles(id_etagere, id_bouteille, quantite, slot) VALUES (?,?,?,?)",
+                [(eid, random.choice(bids), 6, slot + 1) for slot in range(lots_per_shelf)],
+            )
+        for i in range(2000):
+            c.execute(
+                "INSERT INTO revue(bouteille_id, auteur_id, score, commentaire, date) "
+                "VALUES (?,?,?,?, DATETIME('now'))",
+                (random.choice(bids), uid, random.randint(8, 20), f"avis {i}"),
+            )
+    models.close_pools()
+    return uid
+
+
+# ---------------------------------------------------------------------
+# Données synthétiques (generate / http)
+# ---------------------------------------------------------------------
+BENCH_PASSWORD = "bench"
+RESULTS_DIR = "bench_results"
+TYPES = ("Rouge", "Blanc", "Rosé", "Effervescent")
+REGIONS = ("Bordeaux", "Bourgogne", "Loire", "Rhône", "Alsace", "Champagne",
+           "Languedoc", "Provence", "Jura", "Savoie", "Sud-Ouest", "Beaujolais")
+WORDS = ("tanins", "fruité", "boisé", "minéral", "frais", "long", "épicé", "rond",
+         "acidulé", "floral", "puissant", "souple", "salin", "complexe", "léger")
+
+
+# Tirages Zipf : le rang k (0 = plus populaire) a un poids 1/(k+1)^s
+def _zipf_picker(rnd: random.Random, population: list, s: float):
+    cum = list(itertools.accumulate(1.0 / (k + 1) ** s for k in range(len(population))))
+    return lambda k=1: rnd.choices(population, cum_weights=cum, k=k)
+
+
+def generate(path: str, users: int = 200, shelves: int = 4, capacity: int = 50, fill: float = 0.6,
+             bottles: int = 5000, reviews: int = 50000, archives: int = 100,
+             zipf: float = 1.1, seed: int = 1) -> dict:
+    """
+    Crée une base synthétique à `path` (init_db + migrations, puis insertions en
+    masse ; les triggers tiennent à jour slots libres, compteurs et notes).
+    Renvoie {"users": [(uid, email)], "shelves": {uid: [id_etagere]},
+    "lots": {uid: [id_stock]}, "bottles": [id_bouteille par popularité]}.
+    Tous les comptes ont le mot de passe BENCH_PASSWORD.
+    """
+    from werkzeug.security import generate_password_hash
+
+    rnd = random.Random(seed)
+    init_db.init_db(path)
+    models.close_pools()
+    pwd = generate_password_hash(BENCH_PASSWORD)   # un seul hash : c'est volontairement lent
+    out = {"users": [], "shelves": {}, "lots": {}, "bottles": []}
+    with models.Database(path, write=True) as c:
+        first = c.execute("SELECT COALESCE(MAX(id_bouteille), 0) FROM bouteille").fetchone()[0] + 1
+        rows = []
+        for i in range(bottles):
+            domaine, nom, annee = f"Domaine {i % 400}", f"Cuvée {i}", 1990 + rnd.randrange(34)
+            rows.append((domaine, nom, rnd.choice(TYPES), annee, rnd.choice(REGIONS),
+                         round(rnd.uniform(6, 150), 2), models.bottle_key(domaine, nom, annee)))
+        c.executemany(
+            "INSERT INTO bouteille(domaine, nom, type, annee, region, prix, cle) VALUES (?,?,?,?,?,?,?)", rows
+        )
+        out["bottles"] = list(range(first, first + bottles))
+        rnd.shuffle(out["bottles"])      # popularité indépendante de l'id
+        pick_bottle = _zipf_picker(rnd, out["bottles"], zipf)
+
+        for u in range(users):
+            email = f"bench{u}@example.org"
+            uid = c.execute(
+                "INSERT INTO utilisateur(nom, email, mot_de_passe, droits) VALUES (?,?,?,'standard')",
+                (f"Bench {u}", email, pwd),
+            ).lastrowid
+            cave_id = c.execute("INSERT INTO cave(nom, id_utilisateur) VALUES (?,?)",
+                                (f"Cave bench {u}", uid)).lastrowid
+            out["users"].append((uid, email))
+            out["shelves"][uid], lots = [], []
+            for s in range(shelves):
+                eid = c.execute("INSERT INTO etagere(id_cave, nom, capacite) VALUES (?,?,?)",
+                                (cave_id, f"Étagère {s + 1}", capacity)).lastrowid
+                out["shelves"][uid].append(eid)
+                slots, placed = rnd.sample(range(1, capacity + 1), capacity), 0
+                for slot in slots:
+                    q = rnd.randint(1, 3)
+                    if placed + q > fill * capacity:
+                        break
+                    placed += q
+                    lots.append((eid, pick_bottle()[0], q, slot))
+            c.executemany(
+                "INSERT INTO stock_bouteilles(id_etagere, id_bouteille, quantite, slot) VALUES (?,?,?,?)", lots
+            )
+            mine = c.execute(
+                "SELECT s.id_stock, s.id_bouteille, s.id_etagere FROM stock_bouteilles s "
+                "JOIN etagere e ON e.id_etagere = s.id_etagere WHERE e.id_cave = ?", (cave_id,)
+            ).fetchall()
+            out["lots"][uid] = [r["id_stock"] for r in mine]
+            if mine:
+                c.executemany(
+                    "INSERT INTO sortie_archive(id_stock, id_utilisateur, date, quantite, motif, id_bouteille, id_etagere) "
+                    "VALUES (?,?, DATETIME('now', ?), 1, ?,?,?)",
+                    [(r["id_stock"], uid, f"-{rnd.randrange(3 * 365 * 24)} hours",
+                      rnd.choices(("BUE", "OFFERTE", "CASSEE"), (90, 8, 2))[0], r["id_bouteille"], r["id_etagere"])
+                     for r in rnd.choices(mine, k=archives)],
+                )
+
+        uids = [u for u, _ in out["users"]] or [1]
+        c.executemany(
+            'INSERT INTO revue(bouteille_id, auteur_id, score, commentaire, "date") '
+            "VALUES (?,?,?,?, DATETIME('now', ?))",
+            [(b, rnd.choice(uids), None if rnd.random() < 0.1 else rnd.randint(8, 20),
+              " ".join(rnd.sample(WORDS, 3)), f"-{rnd.randrange(3 * 365 * 24)} hours")
+             for b in pick_bottle(reviews)],
+        )
+    models.close_pools()
+    return out
+
+
+# ---------------------------------------------------------------------
+# Processus de charge
+# ---------------------------------------------------------------------
+def _reader(uid: int, wal: bool, until: float, out: "mp.Queue") -> None:
+    if wal:
+        models.configure_engine()
+    lat, errors = [], 0
+    while time.time() < until:
+        t0 = time.perf_counter()
+        try:
+            models.Stock_bouteilles.list_for_user(uid)
+            models.Revue.community_reviews("")
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        lat.append(time.perf_counter() - t0)
+    out.put(("read", lat, errors))
+
+
+def _writer(uid: int, wal: bool, until: float, out: "mp.Queue") -> None:
+    if wal:
+        models.configure_engine()
+    cave = models.Cave.get_by_user(uid)
+    shelf = models.Etagere.list_for_cave(cave.id_cave)[0]
+    lat, errors = [], 0
+    while time.time() < until:
+        t0 = time.perf_counter()
+        try:
+            models.Stock_bouteilles.add_or_increment(shelf.id_etagere, 1, 1, shelf.capacite)
+            lot = [r for r in models.Stock_bouteilles.list_for_user(uid)
+                   if r["id_etagere"] == shelf.id_etagere and r["slot"] == shelf.capacite][0]
+            models.SortieArchive.add(lot["id_stock"], uid, 1, "BUE", 1, shelf.id_etagere)
+            models.Stock_bouteilles.decrement(lot["id_stock"], 1)
+            models.Revue.add(1, uid, 15, "bench")
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        lat.append(time.perf_counter() - t0)
+    out.put(("write", lat, errors))
+
+
+def _pct(values, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] * 1000
+
+
+def run_mixed(uid: int, wal: bool, readers: int, writers: int, duration: float) -> dict:
+    ctx = mp.get_context("fork")
+    out = ctx.Queue()
+    until = time.time() + duration
+    procs = [ctx.Process(target=_reader, args=(uid, wal, until, out)) for _ in range(readers)]
+    procs += [ctx.Process(target=_writer, args=(uid, wal, until, out)) for _ in range(writers)]
+    for p in procs:
+        p.start()
+    res = {"read": ([], 0), "write": ([], 0)}
+    for _ in procs:
+        kind, lat, err = out.get()
+        res[kind] = (res[kind][0] + lat, res[kind][1] + err)
+    for p in procs:
+        p.join()
+    return res
+
+
+def report(label: str, res: dict, duration: float) -> None:
+    r_lat, r_err = res["read"]
+    w_lat, w_err = res["write"]
+    print(f"{label:8s} lectures: {len(r_lat) / duration:7.1f}/s  "
+          f"p50={_pct(r_lat, 50):6.2f}ms p95={_pct(r_lat, 95):6.2f}ms p99={_pct(r_lat, 99):7.2f}ms  "
+          f"erreurs={r_err}")
+    print(f"{'':8s} écritures: {len(w_lat) / duration:6.1f}/s  "
+          f"p99={_pct(w_lat, 99):7.2f}ms  erreurs={w_err}")
+
+
+def _slot_taker(shelf_id: int, bottles: list, wal: bool, out: "mp.Queue") -> None:
+    if wal:
+        models.configure_engine()
+    got, errors, lat = [], 0, []
+    for bid in bottles:
+        t0 = time.perf_counter()
+        try:
+            got.append(models.Stock_bouteilles.add_or_increment(shelf_id, bid, 1))
+        except (sqlite3.OperationalError, ValueError):
+            errors += 1
+            continue
+        lat.append(time.perf_counter() - t0)
+    out.put((got, errors, lat))
+
+
+def run_slots(workers: int, capacity: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        uid = prepare_db(tmp, shelves=1, lots_per_shelf=0)
+        models.configure_engine()
+        cave = models.Cave.get_by_user(uid)
+        shelf_id = models.Etagere.create(cave.id_cave, "Stress", capacity)
+        per_worker = capacity // workers + 2   # un peu plus que la capacité au total
+        ctx = mp.get_context("fork")
+        out = ctx.Queue()
+        procs = [ctx.Process(target=_slot_taker,
+                             args=(shelf_id, [1 + (w * per_worker + i) % 200 for i in range(per_worker)], True, out))
+                 for w in range(workers)]
+        t0 = time.perf_counter()
+        for p in procs:
+            p.start()
+        slots, errors, lat = [], 0, []
+        for _ in procs:
+            g, e, l = out.get()
+            slots += g
+            errors += e
+            lat += l
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - t0
+
+        with models.Database() as c:
+            rows = c.execute("SELECT slot FROM stock_bouteilles WHERE id_etagere=? AND slot IS NOT NULL",
+                             (shelf_id,)).fetchall()
+            free = {r[0] for r in c.execute("SELECT slot FROM etagere_slot_libre WHERE id_etagere=?", (shelf_id,))}
+        taken = [r[0] for r in rows]
+        assigned = [s for s in slots if s is not None]
+        doublons = len(assigned) - len(set(assigned))
+        coherent = not (set(taken) & free) and set(taken) | free == set(range(1, capacity + 1))
+        print(f"{len(slots)} ajouts en {elapsed:.2f}s ({len(slots) / elapsed:.0f}/s), "
+              f"p99={_pct(lat, 99):.2f}ms, erreurs={errors}")
+        print(f"slots attribués={len(assigned)} / capacité={capacity}, sans slot={len(slots) - len(assigned)}, "
+              f"doublons={doublons}, liste libre cohérente={coherent}")
+        models.configure_pool(pragmas={})
+        if doublons or not coherent or len(set(taken)) != capacity:
+            raise SystemExit(1)
+
+
+# Ancienne vue Ma cave : tout le stock chargé puis distinct/filtre/tri en Python
+def _ma_cave_python(uid: int, sort: str, direction: str, field: str, value: str):
+    stock_all = models.Stock_bouteilles.list_for_user(uid)
+
+    def distinct(rows, key):
+        return sorted({str(r[key]) for r in rows if r[key] is not None and str(r[key]).strip() != ""})
+
+    options = {k: distinct(stock_all, k) for k in ("region", "type", "domaine", "nom")}
+    options["annee"] = sorted({int(r["annee"]) for r in stock_all if r["annee"] is not None})
+    stock = stock_all
+    if field in options and value:
+        if field == "annee":
+            stock = [r for r in stock_all if r["annee"] == int(value)]
+        else:
+            stock = [r for r in stock_all if (r[field] or "").lower() == value.lower()]
+    key = {
+        "slot": lambda r: (r["id_etagere"], r["slot"] if r["slot"] is not None else 9999),
+        "nom":  lambda r: (r["id_etagere"], (r["nom"] or "").lower()),
+    }[sort]
+    return options.get(field, []), sorted(stock, key=key, reverse=(direction == "desc"))
+
+
+def _ma_cave_sql(uid: int, sort: str, direction: str, field: str, value: str):
+    options = models.Stock_bouteilles.facets(uid).get(field, [])
+    return options, models.Stock_bouteilles.list_for_user(uid, sort, direction, field, value)
+
+
+def _median_ms(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def run_cave(sizes: list, repeat: int) -> None:
+    cases = [
+        ("slot asc", ("slot", "asc", "", "")),
+        ("nom desc", ("nom", "desc", "", "")),
+        ("région=…", ("slot", "asc", "region", "Région 3")),
+        ("année=…", ("nom", "asc", "annee", "2010")),
+    ]
+    print(f"{'lots':>7s}  {'cas':10s} {'Python':>10s} {'SQL':>10s}")
+    for n in sizes:
+        per_shelf = 200
+        with tempfile.TemporaryDirectory() as tmp:
+            uid = prepare_db(tmp, shelves=max(1, n // per_shelf), lots_per_shelf=min(n, per_shelf))
+            for label, args in cases:
+                old = _median_ms(lambda: _ma_cave_python(uid, *args), repeat)
+                new = _median_ms(lambda: _ma_cave_sql(uid, *args), repeat)
+                assert len(_ma_cave_python(uid, *args)[1]) == len(_ma_cave_sql(uid, *args)[1])
+                print(f"{n:7d}  {label:10s} {old:8.1f}ms {new:8.1f}ms")
+            models.stats_cache.invalidate()
+            models.close_pools()
+
+
+def run_render(shelves: int, capacity: int, fill: float, repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare_db(tmp, shelves=1, lots_per_shelf=0)
+        import app as webapp   # après prepare_db : l'app migre la base du dossier courant
+        from flask import render_template
+
+        rnd = random.Random(1)
+        etageres = [models.Etagere(i, 1, f"Étagère {i}", capacity, 0) for i in range(1, shelves + 1)]
+        stock = []
+        for e in etageres:
+            for slot in range(1, capacity + 1):
+                if rnd.random() < fill:
+                    e.occupe += 3
+                    stock.append(dict(
+                        id_stock=len(stock) + 1, id_etagere=e.id_etagere, etagere_nom=e.nom,
+                        capacite=capacity, slot=slot, quantite=3, id_bouteille=rnd.randint(1, 200),
+                        domaine=f"Domaine {slot}", nom=f"Cuvée {slot}", type="Rouge", annee=2010,
+                        region="Loire", prix=12.0, photo=None,
+                    ))
+        for sort in ("slot", "nom"):
+            rows = stock if sort == "slot" else sorted(stock, key=lambda r: (r["id_etagere"], r["nom"]))
+            view = (sort, "asc", "", "")
+            with webapp.app.test_request_context("/ma-cave"):
+                def render():
+                    fragments = webapp.render_shelves(
+                        etageres, view, lambda ids: [r for r in rows if r["id_etagere"] in set(ids)])
+                    return render_template(
+                        "ma_cave.html", cave=models.Cave(1, "Cave bench", 1), etageres=etageres,
+                        fragments=fragments, bottles_all=[],
+                        sort=sort, direction="asc", filt_field="", filt_value="", current_options=[],
+                    )
+
+                def cold():
+                    webapp.fragment_cache.invalidate()
+                    return render()
+
+                def one_shelf():
+                    etageres[0].version += 1
+                    return render()
+
+                size = len(cold())
+                print(f"{shelves} étagères × {capacity} slots, {len(stock)} lots, vue {sort:4s}: "
+                      f"froid {_median_ms(cold, repeat):7.1f}ms  en cache {_median_ms(render, repeat):6.1f}ms  "
+                      f"1 étagère modifiée {_median_ms(one_shelf, repeat):6.1f}ms  ({size / 1e6:.1f} Mo de HTML)")
+
+
+# ---------------------------------------------------------------------
+# Charge HTTP (client de test Flask) sur base synthétique
+# ---------------------------------------------------------------------
+_sql = threading.local()   # compteur de requêtes SQL du thread courant
+
+
+def _count_sql(verb: str, seconds: float, executions: int) -> None:
+    # sqlprof.STATEMENT_HOOKS : un execute() de l'app = 1, sans les programmes de triggers
+    if executions and verb in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE"):
+        _sql.n = getattr(_sql, "n", 0) + executions
+
+
+# (poids, nom affiché, fabrique de requête) ; la fabrique reçoit (rnd, uid, data, pick_bottle)
+HTTP_MIX = [
+    (30, "GET /ma-cave", lambda rnd, uid, d, pb: ("GET", "/ma-cave", None)),
+    (15, "GET /avis", lambda rnd, uid, d, pb: (
+        "GET", "/avis" + (f"?q={rnd.choice(WORDS)}" if rnd.random() < 0.3 else ""), None)),
+    (15, "GET /historique", lambda rnd, uid, d, pb: ("GET", "/historique", None)),
+    (25, "GET /bouteilles/<bid>", lambda rnd, uid, d, pb: ("GET", f"/bouteilles/{pb()[0]}", None)),
+    (8, "POST /stock/ajouter-catalogue", lambda rnd, uid, d, pb: (
+        "POST", "/stock/ajouter-catalogue",
+        {"id_bouteille": pb()[0], "id_etagere": rnd.choice(d["shelves"][uid]), "quantite": 1})),
+    (7, "POST /stock/consommer", lambda rnd, uid, d, pb: (
+        "POST", "/stock/consommer", {"id_stock": rnd.choice(d["lots"][uid] or [0]), "quantite": 1})),
+]
+
+
+def _http_worker(webapp, data: dict, accounts: list, duration: float, warmup: int, zipf: float,
+                 seed: int, out: dict, lock: threading.Lock, start: threading.Barrier) -> None:
+    rnd = random.Random(seed)
+    pick_bottle = _zipf_picker(rnd, data["bottles"], zipf)
+    clients = []
+    for uid, email in accounts:
+        cl = webapp.app.test_client()
+        r = cl.post("/connexion", data={"email": email, "mot_de_passe": BENCH_PASSWORD})
+        assert r.status_code == 302, f"connexion {email} : {r.status_code}"
+        clients.append((uid, cl))
+    weights = [w for w, _, _ in HTTP_MIX]
+
+    def one() -> tuple:
+        uid, cl = rnd.choice(clients)
+        _, name, make = rnd.choices(HTTP_MIX, weights)[0]
+        method, url, form = make(rnd, uid, data, pick_bottle)
+        _sql.n = 0
+        t0 = time.perf_counter()
+        r = cl.open(url, method=method, data=form)
+        r.get_data()   # /historique est streamé : le corps fait partie du coût
+        r.close()
+        return name, time.perf_counter() - t0, _sql.n, r.status_code >= 400
+
+    for _ in range(warmup):   # caches, templates compilés, pages SQLite chaudes
+        one()
+    local = {name: ([], [], 0) for _, name, _ in HTTP_MIX}
+    start.wait()
+    until = time.time() + duration
+    while time.time() < until:
+        name, dt, n, failed = one()
+        lat, queries, errors = local[name]
+        lat.append(dt)
+        queries.append(n)
+        local[name] = (lat, queries, errors + failed)
+    with lock:
+        for name, (lat, queries, errors) in local.items():
+            a, b, e = out.get(name, ([], [], 0))
+            out[name] = (a + lat, b + queries, e + errors)
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "?"
+    except OSError:
+        return "?"
+
+
+def run_http(gen: dict, duration: float, threads: int, accounts: int, warmup: int, zipf: float) -> dict:
+    here = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            t0 = time.perf_counter()
+            data = generate(os.path.join(tmp, "cave.db"), zipf=zipf, **gen)
+            print(f"Base synthétique : {gen} en {time.perf_counter() - t0:.1f}s")
+            os.environ["CAVE_JOBS_INPROCESS"] = "0"    # pas de worker de fond dans les mesures
+            # connexions instrumentées par sqlprof (sans profil par requête) : instructions
+            # comptées dans le thread du client de test, corps streamés compris
+            os.environ["CAVE_METRICS_SQL"] = "1"
+            sqlprof.STATEMENT_HOOKS.append(_count_sql)
+            import app as webapp   # après generate : l'app migre la base du dossier courant
+
+            rnd = random.Random(7)
+            out: dict = {}
+            lock = threading.Lock()
+            start = threading.Barrier(threads)   # fenêtre mesurée commune, après connexions + chauffe
+            workers = [
+                threading.Thread(target=_http_worker, args=(
+                    webapp, data, rnd.sample(data["users"], min(accounts, len(data["users"]))),
+                    duration, warmup, zipf, 100 + i, out, lock, start))
+                for i in range(threads)
+            ]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+        finally:
+            os.chdir(here)
+            models.close_pools()
+
+    endpoints = {}
+    for _, name, _ in HTTP_MIX:
+        lat, queries, errors = out.get(name, ([], [], 0))
+        endpoints[name] = {
+            "n": len(lat), "erreurs": errors, "req_s": round(len(lat) / duration, 1),
+            "p50_ms": round(_pct(lat, 50), 2), "p95_ms": round(_pct(lat, 95), 2),
+            "p99_ms": round(_pct(lat, 99), 2),
+            "sql_moy": round(sum(queries) / len(queries), 1) if queries else None,
+            "sql_max": max(queries) if queries else None,
+        }
+    total = sum(e["n"] for e in endpoints.values())
+    return {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"), "git": _git_rev(),
+        "parametres": dict(gen, duration=duration, threads=threads, accounts=accounts, zipf=zipf),
+        "total_req_s": round(total / duration, 1), "routes": endpoints,
+    }
+
+
+def print_http(res: dict) -> None:
+    print(f"{'route':32s} {'n':>6s} {'req/s':>7s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'SQL/req':>8s} {'err':>4s}")
+    for name, e in res["routes"].items():
+        sql = f"{e['sql_moy']:.1f}" if e["sql_moy"] is not None else "-"
+        print(f"{name:32s} {e['n']:6d} {e['req_s']:7.1f} {e['p50_ms']:6.1f}ms {e['p95_ms']:6.1f}ms "
+              f"{e['p99_ms']:6.1f}ms {sql:>8s} {e['erreurs']:4d}")
+    print(f"débit total : {res['total_req_s']} req/s")
+
+
+def compare_http(res: dict, ref: dict, tolerance: float) -> list:
+    """Compare à une mesure de référence ; renvoie les régressions (p95 ou nb de requêtes SQL)."""
+    regressions = []
+    print(f"\ncomparaison avec {ref.get('git', '?')} du {ref.get('date', '?')} (tolérance p95 {tolerance:.0%})")
+    if ref.get("parametres") != res["parametres"]:
+        print(f"⚠ paramètres différents : {ref.get('parametres')}")
+    for name, e in res["routes"].items():
+        b = ref.get("routes", {}).get(name)
+        if not b or not b["n"] or not e["n"]:
+            continue
+        delta = (e["p95_ms"] - b["p95_ms"]) / b["p95_ms"] if b["p95_ms"] else 0.0
+        flags = []
+        if delta > tolerance:
+            flags.append("p95")
+        if (e["sql_moy"] or 0) > (b["sql_moy"] or 0) + 0.5:
+            flags.append("SQL")
+        if flags:
+            regressions.append((name, flags))
+        print(f"{name:32s} p95 {b['p95_ms']:6.1f} -> {e['p95_ms']:6.1f}ms ({delta:+.0%})  "
+              f"SQL/req {b['sql_moy']} -> {e['sql_moy']}" + ("  ⚠ " + ",".join(flags) if flags else ""))
+    return regressions
+
+
+# ---------------------------------------------------------------------
+# Budget de requêtes SQL des routes qui modifient des lots
+# ---------------------------------------------------------------------
+# Lots pris en fin de liste (consommés / déplacés) ; l'étagère cible tourne
+def _batch_consume(uid: int, d: dict, other: int) -> tuple:
+    ids = [d["lots"][uid].pop() for _ in range(BATCH_LOTS)]
+    return "/stock/consommer/groupe", {"id_stock": ids, "quantite": 1}
+
+
+def _batch_move(uid: int, d: dict, other: int) -> tuple:
+    d["shelves"][uid].append(d["shelves"][uid].pop(0))
+    return "/stock/affecter/groupe", {"id_stock": d["lots"][uid][:BATCH_LOTS], "id_etagere": d["shelves"][uid][0]}
+
+
+BATCH_LOTS = 10
+NEW_BOTTLE = {"domaine": "Domaine du Bench", "nom": "Cuvée budget", "type": "Rouge", "annee": 2020,
+              "region": "Savoie", "prix": 12.5, "quantite": 1}
+
+# nom -> (max de requêtes SQL, catégorie de flash attendue, fabrique (uid, data, autre uid) -> (url, form))
+QUERY_BUDGET = {
+    "POST /stock/consommer": (5, "success", lambda uid, d, other: (
+        "/stock/consommer", {"id_stock": d["lots"][uid].pop(), "quantite": 1})),
+    "POST /stock/consommer (lot d'un autre)": (2, "error", lambda uid, d, other: (
+        "/stock/consommer", {"id_stock": d["lots"][other][0], "quantite": 1})),
+    "POST /stock/affecter": (4, "success", lambda uid, d, other: (
+        "/stock/affecter", {"id_stock": d["lots"][uid].pop(), "slot": ""})),
+    "POST /stock/affecter (lot d'un autre)": (2, "error", lambda uid, d, other: (
+        "/stock/affecter", {"id_stock": d["lots"][other][0], "slot": ""})),
+    "POST /stock/ajouter-catalogue": (6, "success", lambda uid, d, other: (
+        "/stock/ajouter-catalogue", {"id_bouteille": d["bottles"][0], "id_etagere": d["shelves"][uid][0],
+                                     "quantite": 1})),
+    "POST /bouteilles/nouvelle": (9, "success", lambda uid, d, other: (
+        "/bouteilles/nouvelle", dict(NEW_BOTTLE, id_etagere=d["shelves"][uid][0]))),
+    "POST /bouteilles/nouvelle (étagère d'un autre)": (3, "error", lambda uid, d, other: (
+        "/bouteilles/nouvelle", dict(NEW_BOTTLE, id_etagere=d["shelves"][other][0]))),
+    # groupées : le nb de requêtes ne dépend pas du nb de lots
+    f"POST /stock/consommer/groupe ({BATCH_LOTS} lots)": (5, "success", _batch_consume),
+    f"POST /stock/affecter/groupe ({BATCH_LOTS} lots)": (6, "success", _batch_move),
+}
+
+
+def run_budget(repeat: int) -> list:
+    """Joue chaque route `repeat` fois ; renvoie les dépassements [(route, max constaté, budget)]."""
+    here = os.getcwd()
+    over = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            # étagères peu remplies : assez de lots à consommer, de la place pour ajouter / déplacer
+            data = generate(os.path.join(tmp, "cave.db"), users=4, shelves=4, capacity=120, fill=0.3,
+                            bottles=200, reviews=500, archives=10)
+            os.environ["CAVE_JOBS_INPROCESS"] = "0"
+            # instructions comptées par l'app elle-même (en-tête X-SQL-Requetes, sqlprof) :
+            # un execute() = 1, quels que soient les triggers qu'il déclenche
+            os.environ["CAVE_SQL_PROFILE"] = "1"
+            import app as webapp
+
+            (uid, email), (other, _) = data["users"][:2]
+            cl = webapp.app.test_client()
+            assert cl.post("/connexion", data={"email": email, "mot_de_passe": BENCH_PASSWORD}).status_code == 302
+            print(f"{'route':48s} {'SQL max':>8s} {'budget':>7s}")
+            for name, (budget, expected, make) in QUERY_BUDGET.items():
+                counts = []
+                for _ in range(repeat):
+                    url, form = make(uid, data, other)
+                    with cl.session_transaction() as sess:
+                        sess.pop("_flashes", None)
+                    r = cl.post(url, data=form)
+                    counts.append(int(r.headers["X-SQL-Requetes"]))
+                    with cl.session_transaction() as sess:
+                        flashes = sess.pop("_flashes", [])
+                    if r.status_code != 302 or [cat for cat, _ in flashes] != [expected]:
+                        over.append((name, f"réponse inattendue {r.status_code} {flashes}", budget))
+                        break
+                worst = max(counts)
+                if worst > budget:
+                    over.append((name, worst, budget))
+                print(f"{name:48s} {worst:8d} {budget:7d}" + ("  ⚠" if worst > budget else ""))
+        finally:
+            os.chdir(here)
+            models.close_pools()
+    return over
+
+
+# ---------------------------------------------------------------------
+# Entrée
+# ---------------------------------------------------------------------
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("mixed", help="lectures p99 sous charge lecture/écriture mixte")
+    m.add_argument("--readers", type=int, default=4)
+    m.add_argument("--writers", type=int, default=2)
+    m.add_argument("--duration", type=float, default=5.0)
+    s = sub.add_parser("slots", help="réservation concurrente des slots d'une étagère")
+    s.add_argument("--workers", type=int, default=8)
+    s.add_argument("--capacity", type=int, default=200)
+    k = sub.add_parser("cave", help="tri/filtre de Ma cave : Python vs SQL")
+    k.add_argument("--lots", default="1000,10000,100000", help="tailles de cave (nb de lots)")
+    k.add_argument("--repeat", type=int, default=5)
+    r = sub.add_parser("render", help="temps de rendu de ma_cave.html pour une grande cave")
+    r.add_argument("--shelves", type=int, default=50)
+    r.add_argument("--capacity", type=int, default=200)
+    r.add_argument("--fill", type=float, default=0.75, help="proportion de slots occupés")
+    r.add_argument("--repeat", type=int, default=5)
+    for name, help_ in (("generate", "base synthétique (utilisateurs, caves, avis Zipf, historique)"),
+                        ("http", "latence/débit des pages via le client de test Flask")):
+        g = sub.add_parser(name, help=help_)
+        g.add_argument("--users", type=int, default=200)
+        g.add_argument("--shelves", type=int, default=4, help="étagères par utilisateur")
+        g.add_argument("--capacity", type=int, default=50)
+        g.add_argument("--fill", type=float, default=0.6, help="remplissage des étagères")
+        g.add_argument("--bottles", type=int, default=5000)
+        g.add_argument("--reviews", type=int, default=50000)
+        g.add_argument("--archives", type=int, default=100, help="sorties d'historique par utilisateur")
+        g.add_argument("--zipf", type=float, default=1.1, help="exposant de Zipf (popularité des bouteilles)")
+    sub.choices["generate"].add_argument("--out", required=True, help="fichier SQLite à créer")
+    h = sub.choices["http"]
+    h.add_argument("--duration", type=float, default=10.0)
+    h.add_argument("--threads", type=int, default=1)
+    h.add_argument("--accounts", type=int, default=20, help="utilisateurs connectés par thread")
+    h.add_argument("--warmup", type=int, default=50, help="requêtes non mesurées par thread")
+    h.add_argument("--save", default=None, help=f"fichier JSON (défaut : {RESULTS_DIR}/http-<date>.json)")
+    h.add_argument("--compare", default=None, help="JSON de référence : code 1 en cas de régression")
+    h.add_argument("--tolerance", type=float, default=0.2, help="hausse de p95 tolérée (0.2 = +20 %%)")
+    b = sub.add_parser("budget", help="nb de requêtes SQL des routes qui modifient des lots")
+    b.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    if args.cmd == "mixed":
+        for label, wal in (("défaut", False), ("WAL", True)):
+            with tempfile.TemporaryDirectory() as tmp:
+                uid = prepare_db(tmp)
+                if wal:
+                    models.configure_engine()
+                    with models.Database() as c:   # bascule le fichier en WAL une fois
+                        c.execute("SELECT 1")
+                    models.close_pools()
+                res = run_mixed(uid, wal, args.readers, args.writers, args.duration)
+                report(label, res, args.duration)
+                models.configure_pool(pragmas={})
+    elif args.cmd == "slots":
+        run_slots(args.workers, args.capacity)
+    elif args.cmd == "cave":
+        run_cave([int(x) for x in args.lots.split(",")], args.repeat)
+    elif args.cmd == "render":
+        run_render(args.shelves, args.capacity, args.fill, args.repeat)
+    elif args.cmd == "budget":
+        over = run_budget(args.repeat)
+        for name, worst, budget in over:
+            print(f"❌ {name} : {worst} (budget {budget})")
+        if over:
+            raise SystemExit(1)
+        print("✅ Toutes les routes restent dans leur budget de requêtes SQL")
+    elif args.cmd in ("generate", "http"):
+        gen = dict(users=args.users, shelves=args.shelves, capacity=args.capacity, fill=args.fill,
+                   bottles=args.bottles, reviews=args.reviews, archives=args.archives)
+        if args.cmd == "generate":
+            data = generate(os.path.abspath(args.out), zipf=args.zipf, **gen)
+            print(f"✅ {args.out} : {len(data['users'])} utilisateur(s), {len(data['bottles'])} bouteille(s), "
+                  f"{sum(map(len, data['lots'].values()))} lot(s) ; mot de passe « {BENCH_PASSWORD} »")
+            return
+        res = run_http(gen, args.duration, args.threads, args.accounts, args.warmup, args.zipf)
+        print_http(res)
+        save = args.save or os.path.join(RESULTS_DIR, f"http-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(save)), exist_ok=True)
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+        print(f"résultats : {save}")
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                if compare_http(res, json.load(f), args.tolerance):
+                    raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
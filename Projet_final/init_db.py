@@ -1,19 +1,28 @@
 # init_db.py
 import sqlite3
 
+from models import migrate, bottle_key
+
 DB_FILE = "cave.db"
 
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
+def init_db(path: str = DB_FILE):
+    conn = sqlite3.connect(path)
     cur = conn.cursor()
 
     # Activer les clés étrangères
     cur.execute("PRAGMA foreign_keys = ON;")
 
     # ========================
-    # Schéma (DROP + CREATE)
+    # Schéma (DROP puis migrations)
     # ========================
     cur.executescript("""
+    DROP TABLE IF EXISTS schema_version;
+    DROP TABLE IF EXISTS bouteille_rating;
+    DROP TABLE IF EXISTS etagere_slot_libre;
+    DROP TABLE IF EXISTS version_ressource;
+    DROP TABLE IF EXISTS photo;
+    DROP TABLE IF EXISTS job;
+    DROP VIEW IF EXISTS v_numero_slot;
     DROP TABLE IF EXISTS revue;
     DROP TABLE IF EXISTS sortie_archive;
     DROP TABLE IF EXISTS stock_bouteilles;
@@ -21,72 +30,11 @@ def init_db():
     DROP TABLE IF EXISTS etagere;
     DROP TABLE IF EXISTS cave;
     DROP TABLE IF EXISTS utilisateur;
-
-    CREATE TABLE utilisateur (
-        id_utilisateur INTEGER PRIMARY KEY AUTOINCREMENT,
-        nom   TEXT NOT NULL,
-        email TEXT NOT NULL
-    );
-
-    CREATE TABLE cave (
-        id_cave INTEGER PRIMARY KEY AUTOINCREMENT,
-        nom TEXT NOT NULL,
-        id_utilisateur INTEGER NOT NULL,
-        FOREIGN KEY (id_utilisateur) REFERENCES utilisateur(id_utilisateur) ON DELETE CASCADE
-    );
-
-    CREATE TABLE etagere (
-        id_etagere INTEGER PRIMARY KEY AUTOINCREMENT,
-        id_cave  INTEGER NOT NULL,
-        nom      TEXT NOT NULL,
-        capacite INTEGER NOT NULL,
-        FOREIGN KEY (id_cave) REFERENCES cave(id_cave) ON DELETE CASCADE
-    );
-
-    CREATE TABLE bouteille (
-        id_bouteille INTEGER PRIMARY KEY AUTOINCREMENT,
-        domaine TEXT NOT NULL,
-        nom     TEXT NOT NULL,
-        type    TEXT NOT NULL,
-        annee   INTEGER NOT NULL,
-        region  TEXT NOT NULL,
-        prix    REAL NOT NULL,
-        photo   TEXT
-    );
-
-    CREATE TABLE stock_bouteilles (
-        id_stock     INTEGER PRIMARY KEY AUTOINCREMENT,
-        id_etagere   INTEGER NOT NULL,
-        id_bouteille INTEGER NOT NULL,
-        quantite     INTEGER NOT NULL,
-        slot         INTEGER,
-        FOREIGN KEY (id_etagere)   REFERENCES etagere(id_etagere)     ON DELETE CASCADE,
-        FOREIGN KEY (id_bouteille) REFERENCES bouteille(id_bouteille) ON DELETE RESTRICT
-    );
-
-    CREATE TABLE sortie_archive (
-        id_archive     INTEGER PRIMARY KEY AUTOINCREMENT,
-        id_stock       INTEGER NOT NULL,
-        id_utilisateur INTEGER NOT NULL,
-        "date"         TEXT NOT NULL,
-        quantite       INTEGER NOT NULL,
-        motif          TEXT NOT NULL,  -- ex: BUE/OFFERTE/CASSEE
-        FOREIGN KEY (id_stock)       REFERENCES stock_bouteilles(id_stock) ON DELETE CASCADE,
-        FOREIGN KEY (id_utilisateur) REFERENCES utilisateur(id_utilisateur) ON DELETE CASCADE
-    );
-
-    -- IMPORTANT : colonnes conformes à app.py (bouteille_id, auteur_id, "date")
-    CREATE TABLE revue (
-        id_revue     INTEGER PRIMARY KEY AUTOINCREMENT,
-        bouteille_id INTEGER NOT NULL,
-        auteur_id    INTEGER NOT NULL,
-        score        REAL,            -- 0..20 (ou NULL si commentaire seul)
-        commentaire  TEXT,
-        "date"       TEXT NOT NULL,
-        FOREIGN KEY (bouteille_id) REFERENCES bouteille(id_bouteille) ON DELETE CASCADE,
-        FOREIGN KEY (auteur_id)    REFERENCES utilisateur(id_utilisateur) ON DELETE CASCADE
-    );
     """)
+    conn.commit()
+
+    # Le schéma vient des migrations versionnées (migrations/*), comme au démarrage de l'app
+    migrate(path)
 
     # ========================
     # Données de départ (seed)
@@ -105,12 +53,14 @@ def init_db():
     cur.execute("INSERT INTO etagere (id_cave, nom, capacite) VALUES (?,?,?)", (2, "Étagère A", 12))
 
     # Bouteilles
-    cur.execute("""INSERT INTO bouteille (domaine, nom, type, annee, region, prix, photo)
-                   VALUES (?,?,?,?,?,?,?)""",
-                ("Château Margaux", "Margaux", "Rouge", 2015, "Bordeaux", 120.0, None))
-    cur.execute("""INSERT INTO bouteille (domaine, nom, type, annee, region, prix, photo)
-                   VALUES (?,?,?,?,?,?,?)""",
-                ("Domaine Laroche", "Chablis", "Blanc", 2020, "Bourgogne", 22.5, None))
+    cur.execute("""INSERT INTO bouteille (domaine, nom, type, annee, region, prix, photo, cle)
+                   VALUES (?,?,?,?,?,?,?,?)""",
+                ("Château Margaux", "Margaux", "Rouge", 2015, "Bordeaux", 120.0, None,
+                 bottle_key("Château Margaux", "Margaux", 2015)))
+    cur.execute("""INSERT INTO bouteille (domaine, nom, type, annee, region, prix, photo, cle)
+                   VALUES (?,?,?,?,?,?,?,?)""",
+                ("Domaine Laroche", "Chablis", "Blanc", 2020, "Bourgogne", 22.5, None,
+                 bottle_key("Domaine Laroche", "Chablis", 2020)))
 
     # Stocks : 3 Margaux en slot 4 (cave Alice / étagère A)
     cur.execute("""INSERT INTO stock_bouteilles (id_etagere, id_bouteille, quantite, slot)
@@ -131,7 +81,7 @@ def init_db():
 
     conn.commit()
     conn.close()
-    print("✅ Base de données initialisée avec succès :", DB_FILE)
+    print("✅ Base de données initialisée avec succès :", path)
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,249 @@
+# jobs.py
+"""
+File de tâches de fond adossée à SQLite (table `job`, migration 0012), sans broker :
+- enqueue() insère la tâche dans la transaction courante : si la requête échoue,
+  la tâche disparaît avec le reste ; sinon un worker la voit dès le commit,
+- un worker "prend" une tâche par un seul UPDATE ... RETURNING (BEGIN IMMEDIATE :
+  deux workers, même dans deux processus, ne prennent jamais la même) et pose un
+  bail (LEASE, ou celui du type) renouvelé tant que le gestionnaire tourne : si le
+  worker meurt, la tâche redevient prenable à l'expiration du bail,
+- échec : nouvel essai après un backoff exponentiel, 'echec' au-delà de max_tentatives,
+- workers : thread dans le processus web (start_thread, par défaut) et/ou
+  processus dédiés `flask --app app worker --processus N`,
+- stats() : profondeur de la file par état et latences (attente, exécution).
+Les gestionnaires se déclarent par type avec @handler("type"), ou
+@handler("type", lease=...) pour une tâche longue.
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Optional
+
+import metrics
+from models import Database, after_commit
+
+LEASE = 60.0             # s : bail d'un worker sur la tâche qu'il exécute
+POLL = 0.5               # s : attente entre deux scrutations d'une file vide
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2.0       # s : 2, 4, 8, 16... entre deux essais
+BACKOFF_MAX = 600.0
+RETENTION = 7 * 86400    # s : tâches terminées gardées pour les métriques
+
+HANDLERS: Dict[str, Callable[[dict], None]] = {}
+LEASES: Dict[str, float] = {}   # bail propre à un type (sinon celui du worker)
+
+JOBS_DONE = metrics.Counter("cave_jobs_total", "Essais de tâches de fond terminés", ("type", "resultat"))
+JOB_DURATION = metrics.Histogram("cave_jobs_duree_secondes", "Durée d'exécution d'une tâche de fond", ("type",))
+
+_wake = threading.Event()
+_thread: Optional[threading.Thread] = None
+_thread_lock = threading.Lock()
+
+
+def handler(type_: str, lease: Optional[float] = None):
+    """Décorateur : `fn(payload)` exécute les tâches de ce type (lease : bail en s, si plus long)."""
+    def register(fn):
+        HANDLERS[type_] = fn
+        if lease is not None:
+            LEASES[type_] = lease
+        return fn
+    return register
+
+
+def enqueue(type_: str, payload: Optional[dict] = None, delay: float = 0.0,
+            max_attempts: int = MAX_ATTEMPTS) -> int:
+    """Ajoute une tâche (dans la transaction courante s'il y en a une) ; renvoie son id."""
+    now = time.time()
+    with Database(write=True) as c:
+        job_id = c.execute(
+            "INSERT INTO job(type, payload, max_tentatives, visible_le, cree_le) VALUES (?,?,?,?,?)",
+            (type_, json.dumps(payload or {}), max_attempts, now + delay, now),
+        ).lastrowid
+    after_commit(_wake.set)
+    return job_id
+
+
+def backoff(attempt: int) -> float:
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+
+
+# ---------------------------------------------------------------------
+# Worker
+# ---------------------------------------------------------------------
+def _claim(worker: str, lease: float) -> Optional[dict]:
+    now = time.time()
+    # lecture seule d'abord : une file vide ne prend pas le verrou d'écriture
+    with Database() as c:
+        if c.execute(
+            "SELECT 1 FROM job WHERE etat IN ('attente', 'en_cours') AND visible_le <= ? LIMIT 1", (now,)
+        ).fetchone() is None:
+            return None
+    with Database(write=True) as c:
+        r = c.execute(
+            """
+            UPDATE job SET etat='en_cours', tentatives=tentatives+1, debut=?, visible_le=?, worker=?
+            WHERE id = (SELECT id FROM job WHERE etat IN ('attente', 'en_cours') AND visible_le <= ?
+                        ORDER BY visible_le LIMIT 1)
+            RETURNING id, type, payload, tentatives, max_tentatives
+            """,
+            (now, now + lease, worker, now),
+        ).fetchone()
+        return dict(r) if r else None
+
+
+# Prolonge le bail si c'est toujours le nôtre ; False s'il a été repris entre-temps
+def _renew(job: dict, lease: float) -> bool:
+    with Database(write=True) as c:
+        return c.execute(
+            "UPDATE job SET visible_le=? WHERE id=? AND tentatives=? AND etat='en_cours'",
+            (time.time() + lease, job["id"], job["tentatives"]),
+        ).rowcount > 0
+
+
+# Renouvelle le bail toutes les lease/3 s tant que le gestionnaire tourne : une tâche plus
+# longue que son bail n'est pas reprise (et exécutée une 2e fois) par un autre worker
+def _heartbeat(job: dict, lease: float, done: threading.Event) -> None:
+    while not done.wait(lease / 3):
+        try:
+            if not _renew(job, lease):
+                return
+        except sqlite3.Error:   # base occupée : nouvel essai au prochain battement
+            pass
+
+
+# Termine la tâche si le bail est toujours le nôtre (tentatives sert de jeton)
+def _finish(job: dict, error: Optional[str] = None) -> None:
+    now = time.time()
+    with Database(write=True) as c:
+        if error is None:
+            c.execute("UPDATE job SET etat='fait', fin=?, erreur=NULL WHERE id=? AND tentatives=?",
+                      (now, job["id"], job["tentatives"]))
+        elif job["tentatives"] >= job["max_tentatives"]:
+            c.execute("UPDATE job SET etat='echec', fin=?, erreur=? WHERE id=? AND tentatives=?",
+                      (now, error, job["id"], job["tentatives"]))
+        else:
+            c.execute("UPDATE job SET etat='attente', visible_le=?, erreur=? WHERE id=? AND tentatives=?",
+                      (now + backoff(job["tentatives"]), error, job["id"], job["tentatives"]))
+
+
+def work_one(worker: Optional[str] = None, lease: float = LEASE) -> bool:
+    """Prend et exécute une tâche ; False si aucune n'est prête."""
+    job = _claim(worker or f"{socket.gethostname()}:{os.getpid()}", lease)
+    if job is None:
+        return False
+    fn = HANDLERS.get(job["type"])
+    if job["tentatives"] > job["max_tentatives"]:   # bail expiré sur le dernier essai
+        _finish(job, "bail expiré")
+    elif fn is None:
+        _finish(dict(job, max_tentatives=0), f"type inconnu : {job['type']}")
+    else:
+        job_lease = LEASES.get(job["type"], lease)
+        if job_lease != lease:
+            _renew(job, job_lease)
+        done = threading.Event()
+        threading.Thread(target=_heartbeat, args=(job, job_lease, done), name="jobs-bail", daemon=True).start()
+        t0 = time.perf_counter()
+        try:
+            fn(json.loads(job["payload"]))
+        except Exception:
+            done.set()
+            _finish(job, traceback.format_exc(limit=5))
+            JOBS_DONE.inc(job["type"], "erreur")
+        else:
+            done.set()
+            _finish(job)
+            JOBS_DONE.inc(job["type"], "ok")
+        JOB_DURATION.observe(time.perf_counter() - t0, job["type"])
+    return True
+
+
+def run_worker(burst: bool = False, poll: float = POLL, lease: float = LEASE,
+               stop: Optional[threading.Event] = None) -> int:
+    """
+    Boucle de worker ; renvoie le nb de tâches traitées.
+    burst=True : s'arrête dès que la file ne contient plus rien de prêt.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    done, last_purge = 0, 0.0
+    while stop is None or not stop.is_set():
+        try:
+            if time.time() - last_purge > 3600:
+                purge()
+                last_purge = time.time()
+            if work_one(worker, lease):
+                done += 1
+                metrics.maybe_flush()
+                continue
+        except sqlite3.Error:   # base verrouillée / pas encore migrée : on réessaie plus tard
+            if burst:
+                raise
+        if burst:
+            break
+        metrics.maybe_flush()
+        _wake.wait(poll)
+        _wake.clear()
+    metrics.flush()
+    return done
+
+
+def start_thread() -> None:
+    """Démarre (une fois par processus) un worker en thread démon."""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=run_worker, name="jobs-worker", daemon=True)
+            _thread.start()
+
+
+def purge(older_than: float = RETENTION) -> int:
+    """Supprime les tâches terminées depuis plus de `older_than` secondes."""
+    with Database(write=True) as c:
+        return c.execute(
+            "DELETE FROM job WHERE etat IN ('fait', 'echec') AND fin < ?", (time.time() - older_than,)
+        ).rowcount
+
+
+# ---------------------------------------------------------------------
+# Métriques
+# ---------------------------------------------------------------------
+def _pct(values: list, p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p * len(values)))], 3)
+
+
+def stats(window: float = 3600.0) -> dict:
+    """
+    Profondeur par état, âge de la plus vieille tâche prête, et latences (s)
+    des tâches terminées dans la dernière `window` : attente (création -> début
+    du dernier essai) et exécution (début -> fin), p50 / p95.
+    """
+    now = time.time()
+    with Database() as c:
+        depth = {r["etat"]: r["n"] for r in c.execute("SELECT etat, COUNT(*) AS n FROM job GROUP BY etat")}
+        oldest = c.execute(
+            "SELECT MIN(visible_le) FROM job WHERE etat IN ('attente', 'en_cours') AND visible_le <= ?", (now,)
+        ).fetchone()[0]
+        rows = [r for r in c.execute(
+            "SELECT type, etat, cree_le, debut, fin FROM job WHERE etat IN ('fait', 'echec') AND fin >= ?",
+            (now - window,),
+        ) if r["etat"] == "fait"]
+    wait = [r["debut"] - r["cree_le"] for r in rows]
+    run = [r["fin"] - r["debut"] for r in rows]
+    return {
+        "profondeur": {e: depth.get(e, 0) for e in ("attente", "en_cours", "fait", "echec")},
+        "plus_ancienne_prete_s": round(now - oldest, 3) if oldest is not None else 0.0,
+        "terminees_fenetre": len(rows),
+        "attente_s": {"p50": _pct(wait, 0.5), "p95": _pct(wait, 0.95)},
+        "execution_s": {"p50": _pct(run, 0.5), "p95": _pct(run, 0.95)},
+        "par_type": {t: sum(1 for r in rows if r["type"] == t) for t in sorted({r["type"] for r in rows})},
+    }
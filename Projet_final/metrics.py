@@ -0,0 +1,226 @@
+# metrics.py
+"""
+Métriques au format texte Prometheus (page /metrics), sans dépendance :
+- compteurs et histogrammes en mémoire, par processus (un dict + un verrou :
+  quelques centaines de ns par observation),
+- multi-processus (gunicorn -w N, `flask worker`) : avec CAVE_METRICS_DIR, chaque
+  processus écrit son état dans <dossier>/<pid>.json (au plus toutes les FLUSH
+  secondes, à la lecture de /metrics et à l'arrêt) ; /metrics additionne tous
+  les fichiers. Vider le dossier au (re)démarrage du service,
+- collectors : fonctions appelées juste avant un instantané, pour recopier des
+  compteurs tenus ailleurs (ex: hits / misses d'un TTLCache).
+Les métriques de l'application sont déclarées en bas de ce module.
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+DIR: Optional[str] = os.environ.get("CAVE_METRICS_DIR") or None
+FLUSH = 5.0          # s : écriture max du fichier de ce processus (mode multi-processus)
+
+REGISTRY: Dict[str, "Metric"] = {}
+COLLECTORS: List[Callable[[], None]] = []
+
+_lock = threading.Lock()
+_last_flush = 0.0
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (16 << 10, 64 << 10, 256 << 10, 512 << 10, 1 << 20, 2 << 20, 4 << 20)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help_, tuple(labels)
+        self.values: Dict[tuple, object] = {}
+        REGISTRY[name] = self
+
+    def _merge(self, a, b):
+        return a + b
+
+    def _lines(self, key: tuple, value) -> List[str]:
+        return [f"{self.name}{_labels(self.labels, key)} {_num(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    # Recopie un total tenu ailleurs (collector)
+    def set_total(self, *labels, value: float) -> None:
+        with _lock:
+            self.values[labels] = float(value)
+
+
+class Histogram(Metric):
+    """Valeur stockée : [compte par seau (non cumulé) ..., +Inf, somme, nb]."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect_left(self.buckets, value)
+        with _lock:
+            v = self.values.get(labels)
+            if v is None:
+                v = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def _merge(self, a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def _lines(self, key: tuple, value) -> List[str]:
+        out, acc = [], 0
+        for le, n in zip(self.buckets + (float("inf"),), value):
+            acc += n
+            le_s = "+Inf" if le == float("inf") else _num(le)
+            out.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + (le_s,))} {acc}")
+        out.append(f"{self.name}_sum{_labels(self.labels, key)} {_num(value[-2])}")
+        out.append(f"{self.name}_count{_labels(self.labels, key)} {value[-1]}")
+        return out
+
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, esc)) + "}"
+
+
+# ---------------------------------------------------------------------
+# Instantanés, agrégation multi-processus, exposition
+# ---------------------------------------------------------------------
+def snapshot() -> Dict[str, list]:
+    """État de ce processus : {nom: [[labels, valeur], ...]} (JSON-sérialisable)."""
+    for collect in COLLECTORS:
+        collect()
+    with _lock:
+        return {name: [[list(k), (list(v) if isinstance(v, list) else v)] for k, v in m.values.items()]
+                for name, m in REGISTRY.items()}
+
+
+def flush() -> None:
+    """Écrit l'état de ce processus dans DIR (écriture atomique)."""
+    global _last_flush
+    if DIR is None:
+        return
+    _last_flush = time.monotonic()
+    os.makedirs(DIR, exist_ok=True)
+    path = os.path.join(DIR, f"{os.getpid()}.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+
+def maybe_flush() -> None:
+    """flush() si le dernier date de plus de FLUSH secondes (appelé à chaque requête)."""
+    if DIR is not None and time.monotonic() - _last_flush >= FLUSH:
+        flush()
+
+
+def collect() -> Dict[str, Dict[tuple, object]]:
+    """Somme des états de tous les processus (ce processus : état en mémoire)."""
+    states = [snapshot()]
+    if DIR is not None and os.path.isdir(DIR):
+        own = f"{os.getpid()}.json"
+        for name in os.listdir(DIR):
+            if name.endswith(".json") and name != own:
+                try:
+                    with open(os.path.join(DIR, name), encoding="utf-8") as f:
+                        states.append(json.load(f))
+                except (OSError, ValueError):   # fichier d'un processus en cours d'écriture / tronqué
+                    continue
+    total: Dict[str, Dict[tuple, object]] = {name: {} for name in REGISTRY}
+    for state in states:
+        for name, series in state.items():
+            metric = REGISTRY.get(name)
+            if metric is None:
+                continue
+            acc = total[name]
+            for key, value in series:
+                key = tuple(key)
+                acc[key] = metric._merge(acc[key], value) if key in acc else value
+    return total
+
+
+def render() -> str:
+    """Exposition texte Prometheus (version 0.0.4)."""
+    if DIR is not None:
+        flush()
+    out = []
+    for name, series in collect().items():
+        metric = REGISTRY[name]
+        out.append(f"# HELP {name} {metric.help}")
+        out.append(f"# TYPE {name} {metric.kind}")
+        for key in sorted(series):
+            out.extend(metric._lines(key, series[key]))
+    return "\n".join(out) + "\n"
+
+
+atexit.register(flush)
+
+
+# ---------------------------------------------------------------------
+# Métriques de l'application
+# ---------------------------------------------------------------------
+HTTP_REQUESTS = Counter("cave_http_requetes_total", "Requêtes HTTP traitées",
+                        ("endpoint", "methode", "statut"))
+HTTP_DURATION = Histogram("cave_http_duree_secondes", "Durée de traitement d'une requête (hors envoi d'un corps streamé)",
+                          ("endpoint",))
+SQL_STATEMENTS = Counter("cave_sql_instructions_total", "Instructions SQLite exécutées", ("verbe",))
+SQL_SECONDS = Counter("cave_sql_secondes_total", "Temps passé dans SQLite (exécution + lecture des lignes)", ("verbe",))
+DB_CONNECTIONS = Counter("cave_sqlite_connexions_ouvertes_total", "Connexions SQLite ouvertes par les pools")
+DB_WAIT = Histogram("cave_sqlite_attente_secondes",
+                    "Attente d'une connexion du pool / de la file des écrivains", ("file",),
+                    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+CACHE_LOOKUPS = Counter("cave_cache_requetes_total", "Lectures des caches en mémoire", ("cache", "resultat"))
+UPLOAD_BYTES = Histogram("cave_upload_octets", "Taille des photos reçues", buckets=SIZE_BUCKETS)
+
+# Verbes gardés tels quels (les autres sont comptés en "AUTRE" : étiquettes bornées)
+SQL_VERBS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE",
+             "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA"}
+
+
+def on_statement(verb: str, seconds: float, executions: int) -> None:
+    """sqlprof.STATEMENT_HOOKS : nb d'instructions et temps SQL par verbe."""
+    verb = verb if verb in SQL_VERBS else "AUTRE"
+    if executions:
+        SQL_STATEMENTS.inc(verb, amount=executions)
+    if seconds:
+        SQL_SECONDS.inc(verb, amount=seconds)
+
+
+def on_connect(conn) -> None:
+    """models.CONNECT_HOOKS."""
+    DB_CONNECTIONS.inc()
+
+
+def on_engine_wait(name: str, seconds: float) -> None:
+    """models.ENGINE_HOOKS."""
+    DB_WAIT.observe(seconds, name)
+
+
+def watch_cache(name: str, cache) -> None:
+    """Exporte les hits / misses d'un TTLCache (compteurs du cache recopiés à l'instantané)."""
+    def collect_cache():
+        CACHE_LOOKUPS.set_total(name, "hit", value=cache.hits)
+        CACHE_LOOKUPS.set_total(name, "miss", value=cache.misses)
+    COLLECTORS.append(collect_cache)
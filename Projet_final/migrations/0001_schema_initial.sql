@@ -0,0 +1,70 @@
+-- 0001 : schéma de base (les 7 classes du diagramme)
+-- IF NOT EXISTS : sans effet sur une base déjà créée par l'ancien init_db.py
+
+CREATE TABLE IF NOT EXISTS utilisateur (
+    id_utilisateur INTEGER PRIMARY KEY AUTOINCREMENT,
+    nom   TEXT NOT NULL,
+    email TEXT NOT NULL,
+    mot_de_passe TEXT,
+    droits TEXT DEFAULT 'standard'
+);
+
+CREATE TABLE IF NOT EXISTS cave (
+    id_cave INTEGER PRIMARY KEY AUTOINCREMENT,
+    nom TEXT NOT NULL,
+    id_utilisateur INTEGER NOT NULL,
+    FOREIGN KEY (id_utilisateur) REFERENCES utilisateur(id_utilisateur) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS etagere (
+    id_etagere INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_cave  INTEGER NOT NULL,
+    nom      TEXT NOT NULL,
+    capacite INTEGER NOT NULL,
+    FOREIGN KEY (id_cave) REFERENCES cave(id_cave) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS bouteille (
+    id_bouteille INTEGER PRIMARY KEY AUTOINCREMENT,
+    domaine TEXT NOT NULL,
+    nom     TEXT NOT NULL,
+    type    TEXT NOT NULL,
+    annee   INTEGER NOT NULL,
+    region  TEXT NOT NULL,
+    prix    REAL NOT NULL,
+    photo   TEXT
+);
+
+CREATE TABLE IF NOT EXISTS stock_bouteilles (
+    id_stock     INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_etagere   INTEGER NOT NULL,
+    id_bouteille INTEGER NOT NULL,
+    quantite     INTEGER NOT NULL,
+    slot         INTEGER,
+    FOREIGN KEY (id_etagere)   REFERENCES etagere(id_etagere)     ON DELETE CASCADE,
+    FOREIGN KEY (id_bouteille) REFERENCES bouteille(id_bouteille) ON DELETE RESTRICT
+);
+
+CREATE TABLE IF NOT EXISTS sortie_archive (
+    id_archive     INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_stock       INTEGER NOT NULL,
+    id_utilisateur INTEGER NOT NULL,
+    "date"         TEXT NOT NULL,
+    quantite       INTEGER NOT NULL,
+    motif          TEXT NOT NULL,  -- ex: BUE/OFFERTE/CASSEE
+    id_bouteille   INTEGER,        -- snapshot : le lot peut disparaître
+    id_etagere     INTEGER,
+    FOREIGN KEY (id_stock)       REFERENCES stock_bouteilles(id_stock) ON DELETE CASCADE,
+    FOREIGN KEY (id_utilisateur) REFERENCES utilisateur(id_utilisateur) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS revue (
+    id_revue     INTEGER PRIMARY KEY AUTOINCREMENT,
+    bouteille_id INTEGER NOT NULL,
+    auteur_id    INTEGER NOT NULL,
+    score        REAL,            -- 0..20 (ou NULL si commentaire seul)
+    commentaire  TEXT,
+    "date"       TEXT NOT NULL,
+    FOREIGN KEY (bouteille_id) REFERENCES bouteille(id_bouteille) ON DELETE CASCADE,
+    FOREIGN KEY (auteur_id)    REFERENCES utilisateur(id_utilisateur) ON DELETE CASCADE
+);
@@ -0,0 +1,19 @@
+"""
+0002 : colonnes ajoutées après coup (ex-ensure_schema).
+Les bases créées par l'ancien init_db.py ne les ont pas ; SQLite n'a pas de
+ADD COLUMN IF NOT EXISTS, d'où une migration Python.
+"""
+
+COLUMNS = [
+    ("utilisateur", "mot_de_passe", "TEXT"),
+    ("utilisateur", "droits", "TEXT DEFAULT 'standard'"),
+    ("sortie_archive", "id_bouteille", "INTEGER"),
+    ("sortie_archive", "id_etagere", "INTEGER"),
+]
+
+
+def upgrade(c):
+    for table, column, decl in COLUMNS:
+        existing = {r[1] for r in c.execute(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
@@ -0,0 +1,67 @@
+-- 0003 : agrégats de notes par bouteille, tenus à jour par triggers sur `revue`
+CREATE TABLE IF NOT EXISTS bouteille_rating (
+    id_bouteille   INTEGER PRIMARY KEY,
+    n              INTEGER NOT NULL DEFAULT 0,   -- nb d'avis (notés ou non)
+    n_notes        INTEGER NOT NULL DEFAULT 0,   -- nb d'avis avec une note
+    somme          REAL    NOT NULL DEFAULT 0,   -- somme des notes
+    moyenne        REAL,                         -- ROUND(somme / n_notes, 2), NULL sans note
+    derniere_revue TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_bouteille_rating_top ON bouteille_rating(moyenne DESC, n DESC);
+
+CREATE TRIGGER IF NOT EXISTS trg_revue_rating_ins AFTER INSERT ON revue BEGIN
+    INSERT OR IGNORE INTO bouteille_rating(id_bouteille) VALUES (NEW.bouteille_id);
+    UPDATE bouteille_rating SET
+        n       = n + 1,
+        n_notes = n_notes + (NEW.score IS NOT NULL),
+        somme   = somme + COALESCE(NEW.score, 0),
+        moyenne = CASE WHEN n_notes + (NEW.score IS NOT NULL) > 0
+                       THEN ROUND((somme + COALESCE(NEW.score, 0)) / (n_notes + (NEW.score IS NOT NULL)), 2)
+                  END,
+        derniere_revue = MAX(COALESCE(derniere_revue, ''), NEW."date")
+    WHERE id_bouteille = NEW.bouteille_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_revue_rating_del AFTER DELETE ON revue BEGIN
+    UPDATE bouteille_rating SET
+        n       = n - 1,
+        n_notes = n_notes - (OLD.score IS NOT NULL),
+        somme   = somme - COALESCE(OLD.score, 0),
+        moyenne = CASE WHEN n_notes - (OLD.score IS NOT NULL) > 0
+                       THEN ROUND((somme - COALESCE(OLD.score, 0)) / (n_notes - (OLD.score IS NOT NULL)), 2)
+                  END,
+        derniere_revue = (SELECT MAX("date") FROM revue WHERE bouteille_id = OLD.bouteille_id)
+    WHERE id_bouteille = OLD.bouteille_id;
+    DELETE FROM bouteille_rating WHERE id_bouteille = OLD.bouteille_id AND n <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_revue_rating_upd
+AFTER UPDATE OF bouteille_id, score, "date" ON revue BEGIN
+    UPDATE bouteille_rating SET
+        n       = n - 1,
+        n_notes = n_notes - (OLD.score IS NOT NULL),
+        somme   = somme - COALESCE(OLD.score, 0),
+        moyenne = CASE WHEN n_notes - (OLD.score IS NOT NULL) > 0
+                       THEN ROUND((somme - COALESCE(OLD.score, 0)) / (n_notes - (OLD.score IS NOT NULL)), 2)
+                  END,
+        derniere_revue = (SELECT MAX("date") FROM revue WHERE bouteille_id = OLD.bouteille_id)
+    WHERE id_bouteille = OLD.bouteille_id;
+    DELETE FROM bouteille_rating WHERE id_bouteille = OLD.bouteille_id AND n <= 0;
+    INSERT OR IGNORE INTO bouteille_rating(id_bouteille) VALUES (NEW.bouteille_id);
+    UPDATE bouteille_rating SET
+        n       = n + 1,
+        n_notes = n_notes + (NEW.score IS NOT NULL),
+        somme   = somme + COALESCE(NEW.score, 0),
+        moyenne = CASE WHEN n_notes + (NEW.score IS NOT NULL) > 0
+                       THEN ROUND((somme + COALESCE(NEW.score, 0)) / (n_notes + (NEW.score IS NOT NULL)), 2)
+                  END,
+        derniere_revue = MAX(COALESCE(derniere_revue, ''), NEW."date")
+    WHERE id_bouteille = NEW.bouteille_id;
+END;
+
+-- remplissage initial (ou resynchronisation si la table existait déjà)
+DELETE FROM bouteille_rating;
+INSERT INTO bouteille_rating(id_bouteille, n, n_notes, somme, moyenne, derniere_revue)
+SELECT bouteille_id, COUNT(*), COUNT(score), COALESCE(SUM(score), 0), ROUND(AVG(score), 2), MAX("date")
+FROM revue
+GROUP BY bouteille_id;
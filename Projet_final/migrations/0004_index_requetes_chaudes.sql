@@ -0,0 +1,26 @@
+-- 0004 : index secondaires des requêtes chaudes (models.py)
+-- vérifiés par `flask --app app check-indexes` (EXPLAIN QUERY PLAN)
+
+-- connexion / inscription : Utilisateur.get_by_email
+CREATE INDEX IF NOT EXISTS ix_utilisateur_email ON utilisateur(email);
+
+-- Cave.get_by_user + toutes les jointures "cave de l'utilisateur"
+CREATE INDEX IF NOT EXISTS ix_cave_utilisateur ON cave(id_utilisateur);
+
+-- Etagere.list_for_cave (ORDER BY id_etagere servi par le rowid de l'index)
+CREATE INDEX IF NOT EXISTS ix_etagere_cave ON etagere(id_cave);
+
+-- stock d'une étagère : list_for_user, capacity_left, next_free_slot, add_or_increment
+CREATE INDEX IF NOT EXISTS ix_stock_etagere_slot ON stock_bouteilles(id_etagere, slot);
+
+-- Revue.list_for_bottle (ORDER BY date DESC) + MAX(date) des triggers de notes
+CREATE INDEX IF NOT EXISTS ix_revue_bouteille_date ON revue(bouteille_id, "date");
+
+-- KPI "avis rédigés"
+CREATE INDEX IF NOT EXISTS ix_revue_auteur ON revue(auteur_id);
+
+-- Revue.community_reviews sans recherche (ORDER BY date DESC LIMIT 200)
+CREATE INDEX IF NOT EXISTS ix_revue_date ON revue("date");
+
+-- historique (ORDER BY date DESC) + KPI "bouteilles bues"
+CREATE INDEX IF NOT EXISTS ix_archive_utilisateur_date ON sortie_archive(id_utilisateur, "date");
@@ -0,0 +1,40 @@
+-- 0005 : index plein texte des avis (page "Avis de la communauté")
+-- une ligne par avis (rowid = id_revue) : nom/domaine/région de la bouteille + commentaire
+-- remove_diacritics 2 : "Chateau" trouve "Château" ; prefix : recherche "chat*" rapide
+
+CREATE VIRTUAL TABLE IF NOT EXISTS revue_fts USING fts5(
+    nom, domaine, region, commentaire,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+-- classement bm25 : le nom pèse plus que le domaine, la région puis le commentaire
+INSERT INTO revue_fts(revue_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 2.0, 1.0)');
+
+CREATE TRIGGER IF NOT EXISTS trg_revue_fts_ins AFTER INSERT ON revue BEGIN
+    INSERT INTO revue_fts(rowid, nom, domaine, region, commentaire)
+    SELECT NEW.id_revue, b.nom, b.domaine, b.region, NEW.commentaire
+    FROM bouteille b WHERE b.id_bouteille = NEW.bouteille_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_revue_fts_del AFTER DELETE ON revue BEGIN
+    DELETE FROM revue_fts WHERE rowid = OLD.id_revue;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_revue_fts_upd AFTER UPDATE OF bouteille_id, commentaire ON revue BEGIN
+    DELETE FROM revue_fts WHERE rowid = OLD.id_revue;
+    INSERT INTO revue_fts(rowid, nom, domaine, region, commentaire)
+    SELECT NEW.id_revue, b.nom, b.domaine, b.region, NEW.commentaire
+    FROM bouteille b WHERE b.id_bouteille = NEW.bouteille_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_bouteille_fts_upd AFTER UPDATE OF nom, domaine, region ON bouteille BEGIN
+    UPDATE revue_fts SET nom = NEW.nom, domaine = NEW.domaine, region = NEW.region
+    WHERE rowid IN (SELECT id_revue FROM revue WHERE bouteille_id = NEW.id_bouteille);
+END;
+
+-- remplissage initial
+DELETE FROM revue_fts;
+INSERT INTO revue_fts(rowid, nom, domaine, region, commentaire)
+SELECT r.id_revue, b.nom, b.domaine, b.region, r.commentaire
+FROM revue r JOIN bouteille b ON b.id_bouteille = r.bouteille_id;
@@ -0,0 +1,90 @@
+-- 0006 : occupation des emplacements (slots) par étagère
+-- * un slot ne peut porter qu'un seul lot : index UNIQUE (id_etagere, slot)
+--   (les slots NULL = lots "à ranger" restent autorisés en nombre)
+-- * etagere_slot_libre = liste des slots libres, tenue à jour par triggers :
+--   le plus petit slot libre est un MIN() sur la clé primaire (O(log n)),
+--   lu et consommé dans la même transaction d'écriture que l'INSERT du lot.
+
+-- Doublons historiques : on garde le lot le plus ancien sur le slot, les
+-- autres passent "à ranger" (slot NULL) et apparaissent dans la liste dédiée.
+UPDATE stock_bouteilles SET slot = NULL
+WHERE slot IS NOT NULL
+  AND id_stock NOT IN (
+      SELECT MIN(id_stock) FROM stock_bouteilles
+      WHERE slot IS NOT NULL
+      GROUP BY id_etagere, slot
+  );
+
+DROP INDEX IF EXISTS ix_stock_etagere_slot;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_stock_etagere_slot ON stock_bouteilles(id_etagere, slot);
+
+-- 1..MAX(capacite) : les CTE sont interdites dans le corps d'un trigger, pas les vues
+CREATE VIEW IF NOT EXISTS v_numero_slot(n) AS
+    WITH RECURSIVE s(n) AS (
+        SELECT 1
+        UNION ALL
+        SELECT n + 1 FROM s WHERE n < (SELECT MAX(capacite) FROM etagere)
+    )
+    SELECT n FROM s;
+
+CREATE TABLE IF NOT EXISTS etagere_slot_libre (
+    id_etagere INTEGER NOT NULL,
+    slot       INTEGER NOT NULL,
+    PRIMARY KEY (id_etagere, slot)
+) WITHOUT ROWID;
+
+DELETE FROM etagere_slot_libre;
+INSERT INTO etagere_slot_libre(id_etagere, slot)
+SELECT e.id_etagere, v.n
+FROM etagere e
+JOIN v_numero_slot v ON v.n <= e.capacite
+WHERE NOT EXISTS (
+    SELECT 1 FROM stock_bouteilles s WHERE s.id_etagere = e.id_etagere AND s.slot = v.n
+);
+
+-- Étagères : création / redimensionnement / suppression
+CREATE TRIGGER IF NOT EXISTS trg_etagere_slots_ins AFTER INSERT ON etagere
+BEGIN
+    INSERT INTO etagere_slot_libre(id_etagere, slot)
+    SELECT NEW.id_etagere, n FROM v_numero_slot WHERE n <= NEW.capacite;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_etagere_slots_cap AFTER UPDATE OF capacite ON etagere
+BEGIN
+    DELETE FROM etagere_slot_libre WHERE id_etagere = NEW.id_etagere AND slot > NEW.capacite;
+    INSERT OR IGNORE INTO etagere_slot_libre(id_etagere, slot)
+    SELECT NEW.id_etagere, n FROM v_numero_slot
+    WHERE n <= NEW.capacite
+      AND NOT EXISTS (
+          SELECT 1 FROM stock_bouteilles s WHERE s.id_etagere = NEW.id_etagere AND s.slot = n
+      );
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_etagere_slots_del AFTER DELETE ON etagere
+BEGIN
+    DELETE FROM etagere_slot_libre WHERE id_etagere = OLD.id_etagere;
+END;
+
+-- Lots : un slot pris sort de la liste, un slot rendu y revient (s'il est dans la capacité)
+CREATE TRIGGER IF NOT EXISTS trg_stock_slot_ins AFTER INSERT ON stock_bouteilles
+WHEN NEW.slot IS NOT NULL
+BEGIN
+    DELETE FROM etagere_slot_libre WHERE id_etagere = NEW.id_etagere AND slot = NEW.slot;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stock_slot_del AFTER DELETE ON stock_bouteilles
+WHEN OLD.slot IS NOT NULL
+BEGIN
+    INSERT OR IGNORE INTO etagere_slot_libre(id_etagere, slot)
+    SELECT OLD.id_etagere, OLD.slot FROM etagere
+    WHERE id_etagere = OLD.id_etagere AND OLD.slot BETWEEN 1 AND capacite;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stock_slot_upd AFTER UPDATE OF slot, id_etagere ON stock_bouteilles
+WHEN OLD.slot IS NOT NEW.slot OR OLD.id_etagere <> NEW.id_etagere
+BEGIN
+    INSERT OR IGNORE INTO etagere_slot_libre(id_etagere, slot)
+    SELECT OLD.id_etagere, OLD.slot FROM etagere
+    WHERE id_etagere = OLD.id_etagere AND OLD.slot BETWEEN 1 AND capacite;
+    DELETE FROM etagere_slot_libre WHERE id_etagere = NEW.id_etagere AND slot = NEW.slot;
+END;
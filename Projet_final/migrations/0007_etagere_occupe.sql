@@ -0,0 +1,23 @@
+-- 0007 : compteur de remplissage par étagère (etagere.occupe = SUM(stock.quantite)),
+-- tenu à jour par triggers ; capacity_left / delete_if_empty lisent une seule ligne.
+-- Réparation : `flask --app app repair-counters` (Etagere.repair_counters)
+ALTER TABLE etagere ADD COLUMN occupe INTEGER NOT NULL DEFAULT 0;
+
+UPDATE etagere SET occupe = (
+    SELECT COALESCE(SUM(s.quantite), 0) FROM stock_bouteilles s WHERE s.id_etagere = etagere.id_etagere
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_stock_occupe_ins AFTER INSERT ON stock_bouteilles BEGIN
+    UPDATE etagere SET occupe = occupe + NEW.quantite WHERE id_etagere = NEW.id_etagere;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stock_occupe_del AFTER DELETE ON stock_bouteilles BEGIN
+    UPDATE etagere SET occupe = occupe - OLD.quantite WHERE id_etagere = OLD.id_etagere;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stock_occupe_upd AFTER UPDATE OF quantite, id_etagere ON stock_bouteilles
+WHEN OLD.quantite <> NEW.quantite OR OLD.id_etagere <> NEW.id_etagere
+BEGIN
+    UPDATE etagere SET occupe = occupe - OLD.quantite WHERE id_etagere = OLD.id_etagere;
+    UPDATE etagere SET occupe = occupe + NEW.quantite WHERE id_etagere = NEW.id_etagere;
+END;
@@ -0,0 +1,12 @@
+-- 0008 : index des filtres de Ma cave (Stock_bouteilles.list_for_user, filtre SQL)
+-- un filtre sélectif part de la bouteille puis remonte aux lots de l'utilisateur
+
+-- bouteille -> lots (sert aussi la vérification ON DELETE RESTRICT de la clé étrangère)
+CREATE INDEX IF NOT EXISTS ix_stock_bouteille ON stock_bouteilles(id_bouteille);
+
+-- filtres texte comparés en COLLATE NOCASE
+CREATE INDEX IF NOT EXISTS ix_bouteille_region  ON bouteille(region  COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS ix_bouteille_type    ON bouteille(type    COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS ix_bouteille_domaine ON bouteille(domaine COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS ix_bouteille_nom     ON bouteille(nom     COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS ix_bouteille_annee   ON bouteille(annee);
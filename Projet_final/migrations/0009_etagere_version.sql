@@ -0,0 +1,22 @@
+-- 0009 : version d'étagère pour le cache de fragments HTML de Ma cave (app.render_shelves)
+-- incrémentée à chaque écriture de stock sur l'étagère : un fragment en cache sous
+-- (id_etagere, version) n'est jamais servi après une modification
+ALTER TABLE etagere ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+
+CREATE TRIGGER IF NOT EXISTS trg_stock_version_ins AFTER INSERT ON stock_bouteilles BEGIN
+    UPDATE etagere SET version = version + 1 WHERE id_etagere = NEW.id_etagere;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stock_version_del AFTER DELETE ON stock_bouteilles BEGIN
+    UPDATE etagere SET version = version + 1 WHERE id_etagere = OLD.id_etagere;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stock_version_upd AFTER UPDATE ON stock_bouteilles BEGIN
+    UPDATE etagere SET version = version + 1 WHERE id_etagere IN (OLD.id_etagere, NEW.id_etagere);
+END;
+
+-- une fiche bouteille modifiée change l'affichage de toutes les étagères qui la portent
+CREATE TRIGGER IF NOT EXISTS trg_bouteille_version_upd AFTER UPDATE ON bouteille BEGIN
+    UPDATE etagere SET version = version + 1
+    WHERE id_etagere IN (SELECT id_etagere FROM stock_bouteilles WHERE id_bouteille = NEW.id_bouteille);
+END;
@@ -0,0 +1,93 @@
+-- 0010 : compteurs de version par ressource, exposés en ETag (app.conditional)
+-- clés : 'user:<uid>'     stock, étagères, historique et avis de l'utilisateur (Ma cave, historique)
+--        'bouteille:<id>' fiche + avis d'une bouteille
+--        'revues'         tous les avis (page Avis de la communauté)
+--        'catalogue'      liste des bouteilles (sélecteur "ajouter depuis le catalogue")
+CREATE TABLE IF NOT EXISTS version_ressource (
+    cle     TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+-- Stock : propriétaire retrouvé par étagère -> cave
+CREATE TRIGGER IF NOT EXISTS trg_version_stock_ins AFTER INSERT ON stock_bouteilles BEGIN
+    INSERT INTO version_ressource(cle, version)
+    SELECT 'user:' || cv.id_utilisateur, 1
+    FROM etagere e JOIN cave cv ON cv.id_cave = e.id_cave WHERE e.id_etagere = NEW.id_etagere
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_stock_upd AFTER UPDATE ON stock_bouteilles BEGIN
+    INSERT INTO version_ressource(cle, version)
+    SELECT DISTINCT 'user:' || cv.id_utilisateur, 1
+    FROM etagere e JOIN cave cv ON cv.id_cave = e.id_cave WHERE e.id_etagere IN (OLD.id_etagere, NEW.id_etagere)
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_stock_del AFTER DELETE ON stock_bouteilles BEGIN
+    INSERT INTO version_ressource(cle, version)
+    SELECT 'user:' || cv.id_utilisateur, 1
+    FROM etagere e JOIN cave cv ON cv.id_cave = e.id_cave WHERE e.id_etagere = OLD.id_etagere
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+-- Étagères (les compteurs occupe/version, tenus par triggers, ne comptent pas)
+CREATE TRIGGER IF NOT EXISTS trg_version_etagere_ins AFTER INSERT ON etagere BEGIN
+    INSERT INTO version_ressource(cle, version)
+    SELECT 'user:' || id_utilisateur, 1 FROM cave WHERE id_cave = NEW.id_cave
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_etagere_upd AFTER UPDATE OF nom, capacite, id_cave ON etagere BEGIN
+    INSERT INTO version_ressource(cle, version)
+    SELECT DISTINCT 'user:' || id_utilisateur, 1 FROM cave WHERE id_cave IN (OLD.id_cave, NEW.id_cave)
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_etagere_del AFTER DELETE ON etagere BEGIN
+    INSERT INTO version_ressource(cle, version)
+    SELECT 'user:' || id_utilisateur, 1 FROM cave WHERE id_cave = OLD.id_cave
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+-- Historique des sorties
+CREATE TRIGGER IF NOT EXISTS trg_version_archive_ins AFTER INSERT ON sortie_archive BEGIN
+    INSERT INTO version_ressource(cle, version) VALUES ('user:' || NEW.id_utilisateur, 1)
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_archive_del AFTER DELETE ON sortie_archive BEGIN
+    INSERT INTO version_ressource(cle, version) VALUES ('user:' || OLD.id_utilisateur, 1)
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+-- Avis : fiche de la bouteille, page communauté, compteur de l'auteur
+CREATE TRIGGER IF NOT EXISTS trg_version_revue_ins AFTER INSERT ON revue BEGIN
+    INSERT INTO version_ressource(cle, version)
+    VALUES ('bouteille:' || NEW.bouteille_id, 1), ('revues', 1), ('user:' || NEW.auteur_id, 1)
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_revue_upd AFTER UPDATE ON revue BEGIN
+    INSERT INTO version_ressource(cle, version)
+    VALUES ('bouteille:' || OLD.bouteille_id, 1), ('bouteille:' || NEW.bouteille_id, 1), ('revues', 1),
+           ('user:' || OLD.auteur_id, 1), ('user:' || NEW.auteur_id, 1)
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_revue_del AFTER DELETE ON revue BEGIN
+    INSERT INTO version_ressource(cle, version)
+    VALUES ('bouteille:' || OLD.bouteille_id, 1), ('revues', 1), ('user:' || OLD.auteur_id, 1)
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+-- Catalogue des bouteilles
+CREATE TRIGGER IF NOT EXISTS trg_version_bouteille_ins AFTER INSERT ON bouteille BEGIN
+    INSERT INTO version_ressource(cle, version) VALUES ('catalogue', 1)
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_bouteille_upd AFTER UPDATE ON bouteille BEGIN
+    INSERT INTO version_ressource(cle, version)
+    VALUES ('catalogue', 1), ('bouteille:' || NEW.id_bouteille, 1), ('revues', 1)
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
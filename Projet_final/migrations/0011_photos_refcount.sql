@@ -0,0 +1,36 @@
+-- 0011 : photos stockées par contenu (photos.py, static/uploads/sha256/<aa>/<sha256>.ext)
+-- une ligne par fichier ; refs = nb de bouteilles qui l'utilisent (tenu par triggers).
+-- `flask --app app gc-photos` supprime les fichiers à refs = 0.
+CREATE TABLE IF NOT EXISTS photo (
+    chemin TEXT PRIMARY KEY,                 -- valeur de bouteille.photo (relatif à static/)
+    sha256 TEXT,                             -- NULL pour un ancien upload pas encore importé
+    taille INTEGER,
+    refs   INTEGER NOT NULL DEFAULT 0,
+    cree_le TEXT NOT NULL DEFAULT (DATETIME('now'))
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_photo_refs ON photo(refs) WHERE refs = 0;
+
+-- anciens uploads déjà référencés
+INSERT OR IGNORE INTO photo(chemin, refs)
+SELECT photo, COUNT(*) FROM bouteille WHERE photo IS NOT NULL GROUP BY photo;
+
+CREATE TRIGGER IF NOT EXISTS trg_photo_refs_ins AFTER INSERT ON bouteille
+WHEN NEW.photo IS NOT NULL
+BEGIN
+    INSERT INTO photo(chemin, refs) VALUES (NEW.photo, 1)
+    ON CONFLICT(chemin) DO UPDATE SET refs = refs + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_photo_refs_upd AFTER UPDATE OF photo ON bouteille
+WHEN OLD.photo IS NOT NEW.photo
+BEGIN
+    UPDATE photo SET refs = refs - 1 WHERE chemin = OLD.photo;
+    INSERT INTO photo(chemin, refs) SELECT NEW.photo, 1 WHERE NEW.photo IS NOT NULL
+    ON CONFLICT(chemin) DO UPDATE SET refs = refs + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_photo_refs_del AFTER DELETE ON bouteille
+WHEN OLD.photo IS NOT NULL
+BEGIN
+    UPDATE photo SET refs = refs - 1 WHERE chemin = OLD.photo;
+END;
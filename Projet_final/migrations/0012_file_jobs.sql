@@ -0,0 +1,26 @@
+-- 0012 : file de tâches de fond (jobs.py), sans broker : une ligne par tâche.
+-- visible_le = instant à partir duquel un worker peut la prendre :
+--   * 'attente'  : création, ou nouvel essai après échec (backoff exponentiel),
+--   * 'en_cours' : fin du bail du worker ; passé ce délai (worker mort),
+--                  la tâche redevient prenable par un autre.
+-- Instants en secondes epoch (REAL) : comparaisons et latences sans conversion.
+CREATE TABLE IF NOT EXISTS job (
+    id             INTEGER PRIMARY KEY,
+    type           TEXT    NOT NULL,
+    payload        TEXT    NOT NULL DEFAULT '{}',          -- JSON
+    etat           TEXT    NOT NULL DEFAULT 'attente'
+                   CHECK (etat IN ('attente', 'en_cours', 'fait', 'echec')),
+    tentatives     INTEGER NOT NULL DEFAULT 0,
+    max_tentatives INTEGER NOT NULL DEFAULT 5,
+    visible_le     REAL    NOT NULL,
+    cree_le        REAL    NOT NULL,
+    debut          REAL,
+    fin            REAL,
+    worker         TEXT,
+    erreur         TEXT
+);
+
+-- prochaine tâche prenable : MIN(visible_le) sur les seules tâches vivantes
+CREATE INDEX IF NOT EXISTS ix_job_file ON job(visible_le) WHERE etat IN ('attente', 'en_cours');
+-- métriques (latences récentes) et purge : les seules tâches terminées, par date de fin
+CREATE INDEX IF NOT EXISTS ix_job_fin ON job(fin) WHERE etat IN ('fait', 'echec');
@@ -0,0 +1,32 @@
+"""
+0013 : identité canonique des bouteilles (bouteille.cle + index UNIQUE).
+cle = "domaine|nom|millésime" normalisés (casse, accents, espaces), calculée en
+Python (copie figée de models.bottle_key : lower() de SQLite ignore les accents).
+Doublons existants : la plus ancienne fiche porte la clé, les autres gardent
+cle NULL jusqu'à `flask --app app merge-bottles`, qui les fusionne (lots,
+archives, avis repointés) par lots de transactions.
+"""
+import unicodedata
+
+
+def _key(domaine, nom, annee):
+    def norm(s):
+        s = unicodedata.normalize("NFKD", s or "")
+        s = "".join(ch for ch in s if not unicodedata.combining(ch))
+        return " ".join(s.split()).casefold()
+    return f"{norm(domaine)}|{norm(nom)}|{int(annee)}"
+
+
+def upgrade(c):
+    existing = {r[1] for r in c.execute("PRAGMA table_info(bouteille)")}
+    if "cle" not in existing:
+        c.execute("ALTER TABLE bouteille ADD COLUMN cle TEXT")
+    seen, keys = set(), []
+    for r in c.execute("SELECT id_bouteille, domaine, nom, annee FROM bouteille ORDER BY id_bouteille"):
+        k = _key(r[1], r[2], r[3])
+        if k not in seen:
+            seen.add(k)
+            keys.append((k, r[0]))
+    c.execute("UPDATE bouteille SET cle = NULL")
+    c.executemany("UPDATE bouteille SET cle = ? WHERE id_bouteille = ?", keys)
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_bouteille_cle ON bouteille(cle)")
@@ -0,0 +1,8 @@
+-- 0014 : une bouteille supprimée (ex: doublon fusionné par Bouteille.merge_duplicates)
+-- change aussi les versions : sélecteur du catalogue, sa fiche et la page des avis
+-- ne doivent plus répondre 304 avec l'ancienne liste / une fiche disparue
+CREATE TRIGGER IF NOT EXISTS trg_version_bouteille_del AFTER DELETE ON bouteille BEGIN
+    INSERT INTO version_ressource(cle, version)
+    VALUES ('catalogue', 1), ('bouteille:' || OLD.id_bouteille, 1), ('revues', 1)
+    ON CONFLICT(cle) DO UPDATE SET version = version + 1;
+END;
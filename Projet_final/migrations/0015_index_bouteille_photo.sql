@@ -0,0 +1,3 @@
+-- 0015 : bouteilles qui utilisent une photo (miniatures prêtes -> versions des pages
+-- qui l'affichent, photos._photo_changed ; import_uploads)
+CREATE INDEX IF NOT EXISTS ix_bouteille_photo ON bouteille(photo) WHERE photo IS NOT NULL;
@@ -0,0 +1,4 @@
+-- 0016 : l'index partiel de 0011 (WHERE refs = 0) ne sert jamais : gc_photos et
+-- import_uploads filtrent sur refs <= 0. Même prédicat ici, trié par date (délai de grâce).
+DROP INDEX IF EXISTS ix_photo_refs;
+CREATE INDEX IF NOT EXISTS ix_photo_refs_nulles ON photo(cree_le) WHERE refs <= 0;
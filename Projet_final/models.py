@@ -1,55 +1,604 @@
 # models.py
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Optional, List
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Iterable
 from contextlib import contextmanager
+from contextvars import ContextVar
+import importlib.util
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+import unicodedata
 
 DB_PATH = "cave.db"
 
+# Réglages du pool de connexions (modifiables via configure_pool avant usage)
+POOL_SIZE = 8            # connexions ouvertes max par fichier et par processus
+POOL_TIMEOUT = 5.0       # attente max (s) quand toutes les connexions sont prises
+WRITE_TIMEOUT = 30.0     # attente max (s) dans la file des écrivains
+READ_BATCH = 500         # lignes lues par requête dans les parcours longs (exports, historique)
+DB_PRAGMAS: Dict[str, object] = {}   # ex: {"cache_size": -8000}, appliqués 1 fois à la connexion
+CONNECT_HOOKS: list = []             # fn(conn) appelées sur chaque nouvelle connexion (instrumentation)
+ENGINE_HOOKS: list = []              # fn(événement, secondes) : attente 'connexion' (pool) / 'file_ecriture'
+CONNECTION_FACTORY = sqlite3.Connection   # sous-classe possible (ex: sqlprof.TracedConnection)
+
+# Profil "production" (opt-in via configure_engine) : WAL + réglages de cache/attente
+WAL_PRAGMAS: Dict[str, object] = {
+    "journal_mode": "WAL",        # lecteurs et écrivain ne se bloquent plus
+    "synchronous": "NORMAL",      # fsync au checkpoint seulement (sûr en WAL)
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -16000,         # ~16 Mo de cache de pages par connexion
+    "busy_timeout": 5000,         # ms d'attente sur verrou avant "database is locked"
+    "temp_store": "MEMORY",
+}
+
+
+# ---------------------------------------------------------------------
+# Pool de connexions
+# ---------------------------------------------------------------------
+# Signale une attente (depuis t0) aux ENGINE_HOOKS ; quasi gratuit s'il n'y en a pas
+def _engine_event(name: str, t0: float) -> None:
+    if ENGINE_HOOKS:
+        dt = time.perf_counter() - t0
+        for hook in ENGINE_HOOKS:
+            hook(name, dt)
+
+
+class WriterQueue:
+    """
+    File d'attente FIFO des transactions d'écriture (un seul écrivain à la fois).
+    Les lecteurs ne passent jamais par ici : en WAL ils lisent pendant l'écriture.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._abandoned: set = set()
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        t0 = time.perf_counter()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            if not self._cond.wait_for(lambda: self._serving == ticket, timeout):
+                # on cède notre tour pour ne pas bloquer les suivants
+                self._abandoned.add(ticket)
+                raise sqlite3.OperationalError("Écriture en attente trop longue (file des écrivains)")
+        _engine_event("file_ecriture", t0)
+
+    def release(self) -> None:
+        with self._cond:
+            self._serving += 1
+            while self._serving in self._abandoned:
+                self._abandoned.discard(self._serving)
+                self._serving += 1
+            self._cond.notify_all()
+
+
+class ConnectionPool:
+    """
+    Pool borné de connexions SQLite réutilisables (thread-safe).
+    - les PRAGMAs sont appliqués une seule fois, à l'ouverture,
+    - une connexion rendue est réutilisée (LIFO : la plus "chaude" d'abord),
+    - une connexion inutilisable est détectée au prêt (SELECT 1) et remplacée.
+    """
+
+    def __init__(self, path: str, size: int = POOL_SIZE,
+                 pragmas: Optional[Dict[str, object]] = None, timeout: float = POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.pragmas = dict(DB_PRAGMAS if pragmas is None else pragmas)
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.writer = WriterQueue()
+
+    # Ouvre une nouvelle connexion configurée
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=CONNECTION_FACTORY)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        for hook in CONNECT_HOOKS:
+            hook(conn)
+        return conn
+
+    # Vérifie qu'une connexion inactive est encore utilisable
+    @staticmethod
+    def _healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    # Emprunte une connexion (bloque au plus `timeout` secondes si le pool est plein)
+    def acquire(self) -> sqlite3.Connection:
+        t0 = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError(f"Pool SQLite épuisé ({self.size} connexions)")
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._connect()
+                    break
+                if self._healthy(conn):
+                    break
+                conn.close()
+        except Exception:
+            self._slots.release()
+            raise
+        _engine_event("connexion", t0)
+        return conn
+
+    # Rend une connexion au pool (annule une éventuelle transaction restée ouverte)
+    def release(self, conn: sqlite3.Connection, discard: bool = False) -> None:
+        try:
+            if not discard and conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            discard = True
+        if discard:
+            conn.close()
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    # Ferme toutes les connexions inactives
+    def close_all(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_POOLS: Dict[str, ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+_POOLS_PID = os.getpid()
+
+
+def get_pool(path: str = DB_PATH) -> ConnectionPool:
+    """Renvoie le pool associé au fichier `path` (un jeu de pools par processus)."""
+    global _POOLS_PID
+    with _POOLS_LOCK:
+        if _POOLS_PID != os.getpid():
+            # processus forké (ex: workers gunicorn) : ne jamais partager les connexions du parent
+            _POOLS.clear()
+            _POOLS_PID = os.getpid()
+        pool = _POOLS.get(path)
+        if pool is None:
+            pool = _POOLS[path] = ConnectionPool(path)
+        return pool
+
+
+def configure_pool(size: Optional[int] = None, timeout: Optional[float] = None,
+                   pragmas: Optional[Dict[str, object]] = None, factory=None) -> None:
+    """Modifie les réglages du pool ; les pools existants sont fermés puis recréés à la demande."""
+    global POOL_SIZE, POOL_TIMEOUT, CONNECTION_FACTORY
+    if size is not None:
+        POOL_SIZE = size
+    if timeout is not None:
+        POOL_TIMEOUT = timeout
+    if factory is not None:
+        CONNECTION_FACTORY = factory
+    if pragmas is not None:
+        DB_PRAGMAS.clear()
+        DB_PRAGMAS.update(pragmas)
+    close_pools()
+
+
+def configure_engine(wal: bool = True, **overrides) -> None:
+    """
+    Active (ou non) le profil WAL + PRAGMAs réglés pour toutes les connexions.
+    `overrides` permet d'ajuster une valeur, ex: configure_engine(mmap_size=0).
+    """
+    pragmas = dict(WAL_PRAGMAS) if wal else {}
+    pragmas.update(overrides)
+    configure_pool(pragmas=pragmas)
+
+
+def close_pools() -> None:
+    """Ferme toutes les connexions inactives et oublie les pools (arrêt, tests)."""
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close_all()
+        _POOLS.clear()
+
+
+# ---------------------------------------------------------------------
+# Unité de travail (session partagée, ex: le temps d'une requête HTTP)
+# ---------------------------------------------------------------------
+class Session:
+    """
+    Une connexion du pool + au plus une transaction, partagées par tous les
+    appels `Database()` faits pendant que la session est active.
+    - lectures : autocommit, aucune transaction ouverte,
+    - 1re écriture : file des écrivains + BEGIN IMMEDIATE, gardés jusqu'au commit,
+    - chaque bloc d'écriture est un SAVEPOINT : un appel modèle qui échoue
+      n'a aucun effet, sans annuler le reste de la transaction.
+    Un seul commit (donc un seul fsync) en fin d'unité de travail.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self.pool = get_pool(path)
+        self.conn: Optional[sqlite3.Connection] = None
+        self.writing = False
+        self._depth = 0
+        self._token = None
+        self.callbacks: list = []
+
+    # Connexion de la session (empruntée au pool au premier besoin)
+    def connection(self, write: bool = False) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = self.pool.acquire()
+        if write and not self.writing:
+            self.pool.writer.acquire(WRITE_TIMEOUT)
+            self.writing = True
+            try:
+                if not self.conn.in_transaction:
+                    self.conn.execute("BEGIN IMMEDIATE")
+            except Exception:
+                self._end_write()
+                raise
+        return self.conn
+
+    @contextmanager
+    def block(self, write: bool = False):
+        conn = self.connection(write)
+        if not write:
+            yield conn
+            return
+        self._depth += 1
+        name = f"sp_{self._depth}"
+        conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield conn
+        except Exception:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            raise
+        else:
+            conn.execute(f"RELEASE {name}")
+        finally:
+            self._depth -= 1
+
+    def _end_write(self) -> None:
+        if self.writing:
+            self.writing = False
+            self.pool.writer.release()
+
+    # Valide la transaction en cours (no-op si rien n'a été écrit)
+    def commit(self) -> None:
+        try:
+            if self.conn is not None and self.conn.in_transaction:
+                self.conn.commit()
+        finally:
+            self._end_write()
+        callbacks, self.callbacks = self.callbacks, []
+        _run_callbacks(callbacks)
+
+    # Annule la transaction en cours
+    def rollback(self) -> None:
+        self.callbacks = []
+        try:
+            if self.conn is not None and self.conn.in_transaction:
+                self.conn.rollback()
+        finally:
+            self._end_write()
+
+    # Termine la session : rollback si rien n'a validé, puis rend la connexion
+    def close(self) -> None:
+        broken = False
+        try:
+            self.rollback()
+        except sqlite3.Error:
+            broken = True
+        if self.conn is not None:
+            self.pool.release(self.conn, discard=broken)
+            self.conn = None
+
+
+_SESSION: ContextVar[Optional[Session]] = ContextVar("cave_session", default=None)
+_PENDING: ContextVar[Optional[list]] = ContextVar("cave_after_commit", default=None)
+
+
+def after_commit(fn) -> None:
+    """
+    Exécute `fn()` une fois la transaction courante validée (jamais si elle est
+    annulée). Sert aux invalidations de caches : un autre thread ne peut pas
+    recalculer une valeur à partir de données pas encore commitées.
+    """
+    sess = _SESSION.get()
+    if sess is not None:
+        sess.callbacks.append(fn)
+        return
+    pending = _PENDING.get()
+    if pending is not None:
+        pending.append(fn)
+    else:
+        fn()
+
+
+def _run_callbacks(callbacks: list) -> None:
+    for fn in callbacks:
+        fn()
+
+
+def begin_session(path: str = DB_PATH) -> Session:
+    """Démarre une unité de travail que les appels `Database()` rejoignent d'eux-mêmes."""
+    sess = Session(path)
+    sess._token = _SESSION.set(sess)
+    return sess
+
+
+def end_session(sess: Session, commit: bool = True) -> None:
+    """Valide (ou annule) puis ferme la session démarrée par begin_session."""
+    try:
+        if commit:
+            sess.commit()
+    finally:
+        sess.close()
+        _SESSION.reset(sess._token)
+
+
 # ---------------------------------------------------------------------
 # Accès base (fonction contexte au lieu d'une classe)
 # ---------------------------------------------------------------------
 @contextmanager
-def Database(path: str = DB_PATH):
+def Database(path: str = DB_PATH, write: bool = False):
     """
     Contexte SQLite avec row_factory=Row + commit/rollback auto.
+    La connexion est empruntée au pool puis rendue à la sortie (pas de close).
+    write=True : passe par la file des écrivains puis ouvre BEGIN IMMEDIATE,
+    ce qui sérialise les écritures (aussi entre processus) sans gêner les lectures.
+    Ordre des verrous, le même que Session : connexion du pool, puis file des
+    écrivains (l'ordre inverse peut bloquer face à des sessions qui tiennent
+    toutes les connexions en attendant la file).
+    Si une Session est active (voir begin_session), le bloc la rejoint : même
+    connexion, même transaction, commit différé à la fin de la session.
     Compatible avec: `from models import Database as DB` puis `with DB() as c:`
     """
-    conn: Optional[sqlite3.Connection] = None
+    sess = _SESSION.get()
+    if sess is not None and sess.path == path:
+        with sess.block(write) as conn:
+            yield conn
+        return
+
+    pool = get_pool(path)
+    conn = None
+    writing = broken = False
+    pending: list = []
+    token = _PENDING.set(pending)
     try:
-        conn = sqlite3.connect(path)
-        conn.row_factory = sqlite3.Row
+        conn = pool.acquire()
+        if write:
+            pool.writer.acquire(WRITE_TIMEOUT)
+            writing = True
+            conn.execute("BEGIN IMMEDIATE")
         yield conn
         conn.commit()
+        _run_callbacks(pending)
     except Exception:
-        if conn:
-            conn.rollback()
+        if conn is not None:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
         raise
     finally:
-        if conn:
-            conn.close()
+        _PENDING.reset(token)
+        if writing:
+            pool.writer.release()
+        if conn is not None:
+            pool.release(conn, discard=broken)
 
 
-def ensure_schema():
-    """ ajoute des colonnes si manquantes (idempotent)."""
-    with Database() as c:
-        try:
-            c.execute("ALTER TABLE utilisateur ADD COLUMN mot_de_passe TEXT")
-        except Exception:
-            pass
-        try:
-            c.execute("ALTER TABLE utilisateur ADD COLUMN droits TEXT DEFAULT 'standard'")
-        except Exception:
-            pass
-        try:
-            c.execute("ALTER TABLE sortie_archive ADD COLUMN id_bouteille INTEGER")
-        except Exception:
-            pass
-        try:
-            c.execute("ALTER TABLE sortie_archive ADD COLUMN id_etagere INTEGER")
-        except Exception:
-            pass
+# ---------------------------------------------------------------------
+# Caches applicatifs (mémoire, par processus)
+# ---------------------------------------------------------------------
+_MISS = object()
+
+
+class TTLCache:
+    """
+    Petit cache clé -> valeur à expiration (thread-safe).
+    Les écritures invalident les clés concernées (voir _touch_*) ; le TTL borne
+    la durée pendant laquelle un autre processus peut servir une valeur périmée.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: Dict[object, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            if len(self._data) >= self.maxsize:
+                self._data.clear()
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    # Renvoie la valeur en cache ou la calcule via compute() puis la mémorise
+    def get_or_set(self, key, compute, ttl: Optional[float] = None):
+        value = self.get(key, _MISS)
+        if value is _MISS:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    # Invalide une clé (ou tout le cache si key est None)
+    def invalidate(self, key=None) -> None:
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+
+# KPIs du tableau de bord : ("top_rated",) global (TTL), ("user", uid) par utilisateur ;
+# ("facets", uid) : valeurs de filtre de Ma cave. Les entrées par utilisateur portent la
+# version 'user:<uid>' (user_cached) : une écriture validée par un autre processus les périme aussi
+stats_cache = TTLCache(ttl=300)
+TOP_RATED_TTL = 60
+
+
+# Propriétaire (uid) d'une étagère, pour savoir quel cache invalider
+def _shelf_owner(c: sqlite3.Connection, id_etagere: int) -> Optional[int]:
+    r = c.execute(
+        """
+        SELECT cv.id_utilisateur FROM etagere e JOIN cave cv ON cv.id_cave = e.id_cave
+        WHERE e.id_etagere = ?
+        """,
+        (id_etagere,),
+    ).fetchone()
+    return r["id_utilisateur"] if r else None
+
+
+# Le stock (ou l'historique) d'un utilisateur a changé : KPIs + valeurs de filtre
+def _touch_user(uid: Optional[int]) -> None:
+    if uid is not None:
+        after_commit(lambda: (stats_cache.invalidate(("user", uid)),
+                              stats_cache.invalidate(("facets", uid))))
+
+
+# Les avis ont changé : classement global + compteur de l'auteur
+def _touch_reviews(auteur_id: Optional[int] = None) -> None:
+    after_commit(lambda: stats_cache.invalidate(("top_rated",)))
+    _touch_user(auteur_id)
+
+
+# Versions des ressources affichées ('user:<uid>', 'bouteille:<id>', 'revues', 'catalogue'),
+# incrémentées par triggers (migration 0010) ; 0 pour une clé jamais écrite
+def resource_versions(keys: Iterable[str]) -> Dict[str, int]:
+    keys = list(keys)
+    out = dict.fromkeys(keys, 0)
+    if keys:
+        with Database() as c:
+            for r in c.execute(
+                f"SELECT cle, version FROM version_ressource WHERE cle IN ({','.join('?' * len(keys))})", keys
+            ):
+                out[r["cle"]] = r["version"]
+    return out
+
+
+# Valeur par utilisateur de stats_cache, recalculée dès que sa version 'user:<uid>' a bougé
+# (triggers : vu par tous les processus au commit, pas seulement par celui qui a écrit)
+def user_cached(kind: str, uid: int, compute):
+    version = resource_versions([f"user:{uid}"])[f"user:{uid}"]
+    hit = stats_cache.get((kind, uid))
+    if hit is not None and hit[0] == version:
+        return hit[1]
+    value = compute()
+    stats_cache.set((kind, uid), (version, value))
+    return value
+
+
+# Recalcule entièrement bouteille_rating depuis `revue` (resynchronisation)
+def _rebuild_ratings(c: sqlite3.Connection) -> int:
+    c.execute("DELETE FROM bouteille_rating")
+    c.execute(
+        """
+        INSERT INTO bouteille_rating(id_bouteille, n, n_notes, somme, moyenne, derniere_revue)
+        SELECT bouteille_id, COUNT(*), COUNT(score), COALESCE(SUM(score), 0),
+               ROUND(AVG(score), 2), MAX("date")
+        FROM revue
+        GROUP BY bouteille_id
+        """
+    )
+    return c.execute("SELECT COUNT(*) FROM bouteille_rating").fetchone()[0]
+
+
+# ---------------------------------------------------------------------
+# Migrations versionnées (migrations/NNNN_nom.sql ou .py)
+# ---------------------------------------------------------------------
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+# Découpe un script SQL en instructions (les corps de triggers restent entiers)
+def _split_sql(script: str) -> List[str]:
+    stmts, buf = [], ""
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            stmts.append(buf.strip())
+            buf = ""
+    return [x for x in stmts if x]
+
+
+# Liste ordonnée des migrations disponibles : [(version, nom, chemin)]
+def list_migrations(directory: str = MIGRATIONS_DIR) -> List[tuple]:
+    found = []
+    for fname in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(fname)
+        head = stem.split("_", 1)[0]
+        if ext in (".sql", ".py") and head.isdigit():
+            found.append((int(head), stem, os.path.join(directory, fname)))
+    versions = [v for v, _, _ in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Numéros de migration en double dans {directory}")
+    return found
+
+
+def _apply_migration(c: sqlite3.Connection, fpath: str) -> None:
+    if fpath.endswith(".sql"):
+        with open(fpath, encoding="utf-8") as f:
+            for stmt in _split_sql(f.read()):
+                c.execute(stmt)
+    else:
+        spec = importlib.util.spec_from_file_location(f"migration_{os.path.basename(fpath)[:-3]}", fpath)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.upgrade(c)
+
+
+def migrate(path: str = DB_PATH) -> List[str]:
+    """
+    Applique, dans l'ordre et une seule fois, les migrations pas encore passées
+    (table schema_version). Tout se fait dans une transaction d'écriture : deux
+    workers qui démarrent en même temps ne migrent pas deux fois.
+    Renvoie les noms des migrations appliquées.
+    """
+    applied = []
+    with Database(path, write=True) as c:
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version    INTEGER PRIMARY KEY,
+                nom        TEXT NOT NULL,
+                applique_le TEXT NOT NULL
+            )
+            """
+        )
+        done = {r["version"] for r in c.execute("SELECT version FROM schema_version")}
+        for version, name, fpath in list_migrations():
+            if version in done:
+                continue
+            _apply_migration(c, fpath)
+            c.execute(
+                "INSERT INTO schema_version(version, nom, applique_le) VALUES (?,?, DATETIME('now'))",
+                (version, name),
+            )
+            applied.append(name)
+    return applied
 
 
 # ---------------------------------------------------------------------
@@ -77,10 +626,50 @@ class Utilisateur:
             r = c.execute("SELECT * FROM utilisateur WHERE id_utilisateur=?", (uid,)).fetchone()
             return Utilisateur(**dict(r)) if r else None
 
+    # KPIs de l'utilisateur (stock, valeur, bouteilles bues, avis rédigés)
+    @staticmethod
+    def kpis(uid: int) -> dict:
+        with Database() as c:
+            row = c.execute(
+                """
+                SELECT
+                  COALESCE(SUM(s.quantite), 0) AS q_bottles,
+                  COALESCE(SUM(CASE WHEN s.quantite > 0 THEN 1 ELSE 0 END), 0) AS q_lots,
+                  COALESCE(SUM(s.quantite * b.prix), 0.0) AS v_value
+                FROM cave cv
+                JOIN etagere e              ON e.id_cave      = cv.id_cave
+                LEFT JOIN stock_bouteilles s ON s.id_etagere   = e.id_etagere
+                LEFT JOIN bouteille b        ON b.id_bouteille = s.id_bouteille
+                WHERE cv.id_utilisateur = ?
+                """,
+                (uid,),
+            ).fetchone()
+            row2 = c.execute(
+                """
+                SELECT COALESCE(SUM(a.quantite), 0) AS drunk
+                FROM sortie_archive a
+                JOIN stock_bouteilles s ON s.id_stock = a.id_stock
+                JOIN etagere e          ON e.id_etagere = s.id_etagere
+                JOIN cave cv            ON cv.id_cave   = e.id_cave
+                WHERE a.id_utilisateur = ?
+                  AND cv.id_utilisateur = ?
+                  AND UPPER(a.motif)='BUE'
+                """,
+                (uid, uid),
+            ).fetchone()
+            row3 = c.execute("SELECT COUNT(*) AS n FROM revue WHERE auteur_id=?", (uid,)).fetchone()
+        return {
+            "my_bottles": int(row["q_bottles"] or 0),
+            "my_lots": int(row["q_lots"] or 0),
+            "my_value": float(row["v_value"] or 0.0),
+            "my_drunk": int(row2["drunk"] or 0),
+            "my_reviews": int(row3["n"] or 0),
+        }
+
     # Crée un utilisateur et renvoie son id
     @staticmethod
     def create(nom: str, email: str, hash_pwd: str, droits: str = "standard") -> int:
-        with Database() as c:
+        with Database(write=True) as c:
             cur = c.execute(
                 "INSERT INTO utilisateur(nom, email, mot_de_passe, droits) VALUES (?,?,?,?)",
                 (nom, email, hash_pwd, droits),
@@ -107,7 +696,7 @@ class Cave:
     # Crée une cave pour un utilisateur et renvoie son id
     @staticmethod
     def create_for_user(uid: int, nom: str) -> int:
-        with Database() as c:
+        with Database(write=True) as c:
             cur = c.execute("INSERT INTO cave(nom, id_utilisateur) VALUES (?,?)", (nom, uid))
             return cur.lastrowid
 
@@ -121,6 +710,8 @@ class Etagere:
     id_cave: int
     nom: str
     capacite: int
+    occupe: int = 0   # nb de bouteilles rangées (compteur tenu par triggers, migration 0007)
+    version: int = 0  # +1 à chaque écriture de stock (clé du cache de fragments, migration 0009)
 
     # Liste toutes les étagères d'une cave
     @staticmethod
@@ -131,10 +722,24 @@ class Etagere:
             ).fetchall()
             return [Etagere(**dict(r)) for r in rows]
 
+    # Étagère de la cave de l'utilisateur (une jointure indexée) ; None si elle n'existe pas ou
+    # appartient à un autre
+    @staticmethod
+    def get_owned(id_etagere: int, uid: int) -> Optional["Etagere"]:
+        with Database() as c:
+            r = c.execute(
+                """
+                SELECT e.* FROM etagere e JOIN cave cv ON cv.id_cave = e.id_cave
+                WHERE e.id_etagere = ? AND cv.id_utilisateur = ?
+                """,
+                (id_etagere, uid),
+            ).fetchone()
+            return Etagere(**dict(r)) if r else None
+
     # Crée une étagère et renvoie son id
     @staticmethod
     def create(id_cave: int, nom: str, capacite: int) -> int:
-        with Database() as c:
+        with Database(write=True) as c:
             cur = c.execute(
                 "INSERT INTO etagere(id_cave, nom, capacite) VALUES (?,?,?)",
                 (id_cave, nom, capacite),
@@ -145,30 +750,57 @@ class Etagere:
     @staticmethod
     def capacity_left(id_etagere: int) -> int:
         with Database() as c:
-            cap = c.execute(
-                "SELECT capacite FROM etagere WHERE id_etagere=?", (id_etagere,)
-            ).fetchone()["capacite"]
-            used = c.execute(
-                "SELECT COALESCE(SUM(quantite),0) q FROM stock_bouteilles WHERE id_etagere=?",
-                (id_etagere,),
-            ).fetchone()["q"]
-            return int(cap - used)
+            return _capacity_left(c, id_etagere)
 
     # Supprime l'étagère si et seulement si elle est vide
     @staticmethod
     def delete_if_empty(id_etagere: int, id_cave: int) -> bool:
-        with Database() as c:
-            try:
-                q = c.execute(
-                    "SELECT COALESCE(SUM(quantite),0) q FROM stock_bouteilles WHERE id_etagere=?",
-                    (id_etagere,),
-                ).fetchone()["q"]
-            except sqlite3.OperationalError:
-                q = 0
-            if q != 0:
-                return False
-            c.execute("DELETE FROM etagere WHERE id_etagere=? AND id_cave=?", (id_etagere, id_cave))
-            return True
+        with Database(write=True) as c:
+            cur = c.execute(
+                "DELETE FROM etagere WHERE id_etagere=? AND id_cave=? AND occupe=0", (id_etagere, id_cave)
+            )
+            return cur.rowcount > 0
+
+    # Recalcule etagere.occupe depuis le stock ; renvoie le nb d'étagères corrigées
+    @staticmethod
+    def repair_counters() -> int:
+        with Database(write=True) as c:
+            return c.execute(
+                """
+                UPDATE etagere SET occupe = (
+                    SELECT COALESCE(SUM(s.quantite), 0) FROM stock_bouteilles s
+                    WHERE s.id_etagere = etagere.id_etagere
+                )
+                WHERE occupe <> (
+                    SELECT COALESCE(SUM(s.quantite), 0) FROM stock_bouteilles s
+                    WHERE s.id_etagere = etagere.id_etagere
+                )
+                """
+            ).rowcount
+
+
+# Places restantes d'une étagère : une ligne lue par clé primaire (0 si inconnue)
+def _capacity_left(c: sqlite3.Connection, id_etagere: int) -> int:
+    r = c.execute("SELECT capacite - occupe FROM etagere WHERE id_etagere=?", (id_etagere,)).fetchone()
+    return int(r[0]) if r else 0
+
+
+# Refuse un ajout qui dépasserait la capacité ; à appeler dans la transaction d'écriture
+# (le verrou d'écriture empêche deux ajouts concurrents de remplir la même place)
+def _check_capacity(c: sqlite3.Connection, id_etagere: int, quantite: int) -> None:
+    left = _capacity_left(c, id_etagere)
+    if quantite > left:
+        raise ValueError(f"Capacité insuffisante : {max(left, 0)} place(s) restante(s).")
+
+
+# Identité canonique d'une bouteille (bouteille.cle, index UNIQUE) :
+# "domaine|nom|millésime" sans casse, accents ni espaces superflus
+def bottle_key(domaine: str, nom: str, annee: int) -> str:
+    def norm(s: str) -> str:
+        s = unicodedata.normalize("NFKD", s or "")
+        s = "".join(ch for ch in s if not unicodedata.combining(ch))
+        return " ".join(s.split()).casefold()
+    return f"{norm(domaine)}|{norm(nom)}|{int(annee)}"
 
 
 # ---------------------------------------------------------------------
@@ -184,6 +816,7 @@ class Bouteille:
     region: str
     prix: float
     photo: Optional[str] = None
+    cle: Optional[str] = None      # identité canonique (bottle_key), NULL = doublon à fusionner
 
     # Récupère une bouteille par identifiant
     @staticmethod
@@ -201,14 +834,109 @@ class Bouteille:
                 """
                 SELECT id_bouteille, nom, annee, domaine
                 FROM bouteille
-                ORDER BY nom
+                ORDER BY nom COLLATE NOCASE
                 """
             ).fetchall()
 
+    # Crée la bouteille, ou renvoie la fiche existante de même identité (domaine/nom/millésime)
+    @staticmethod
+    def upsert(domaine: str, nom: str, type_: str, annee: int, region: str, prix: float,
+               photo: Optional[str] = None) -> tuple:
+        """
+        Renvoie (id_bouteille, créée). Une fiche existante n'est pas modifiée,
+        sauf pour recevoir la photo si elle n'en avait pas.
+        """
+        key = bottle_key(domaine, nom, annee)
+        with Database(write=True) as c:
+            r = c.execute("SELECT id_bouteille, photo FROM bouteille WHERE cle=?", (key,)).fetchone()
+            if r is not None:
+                if photo and not r["photo"]:
+                    c.execute("UPDATE bouteille SET photo=? WHERE id_bouteille=?", (photo, r["id_bouteille"]))
+                return r["id_bouteille"], False
+            cur = c.execute(
+                "INSERT INTO bouteille(domaine, nom, type, annee, region, prix, photo, cle) VALUES (?,?,?,?,?,?,?,?)",
+                (domaine, nom, type_, annee, region, prix, photo, key),
+            )
+            return cur.lastrowid, True
+
+    # Fusionne les doublons (cle NULL) dans leur fiche canonique, `batch` fiches par transaction
+    @staticmethod
+    def merge_duplicates(batch: int = 200, dry_run: bool = False) -> Dict[str, int]:
+        """
+        Pour chaque fiche sans clé : si sa clé est libre elle la prend, sinon ses
+        lots, archives et avis sont repointés vers la fiche qui la porte (les
+        triggers reportent notes, refs photo et versions), puis elle est supprimée.
+        Chaque lot de `batch` fiches est une transaction : l'outil peut tourner
+        pendant que l'application sert des requêtes, et reprendre s'il est interrompu.
+        """
+        stats = {"cles_attribuees": 0, "fusionnees": 0, "lots": 0, "archives": 0, "avis": 0}
+        last = 0
+        while True:
+            with Database(write=not dry_run) as c:
+                rows = c.execute(
+                    """
+                    SELECT id_bouteille, domaine, nom, annee, photo FROM bouteille
+                    WHERE cle IS NULL AND id_bouteille > ? ORDER BY id_bouteille LIMIT ?
+                    """,
+                    (last, batch),
+                ).fetchall()
+                if not rows:
+                    break
+                last = rows[-1]["id_bouteille"]
+                planned: Dict[str, int] = {}   # clés prises dans ce lot (simulation)
+                for r in rows:
+                    key = bottle_key(r["domaine"], r["nom"], r["annee"])
+                    holder = c.execute("SELECT id_bouteille, photo FROM bouteille WHERE cle=?", (key,)).fetchone()
+                    target = holder["id_bouteille"] if holder else planned.get(key)
+                    if target is None:
+                        planned[key] = r["id_bouteille"]
+                        stats["cles_attribuees"] += 1
+                        if not dry_run:
+                            c.execute("UPDATE bouteille SET cle=? WHERE id_bouteille=?", (key, r["id_bouteille"]))
+                        continue
+                    stats["fusionnees"] += 1
+                    dup = r["id_bouteille"]
+                    if dry_run:
+                        for k, sql in (("lots", "SELECT COUNT(*) FROM stock_bouteilles WHERE id_bouteille=?"),
+                                       ("archives", "SELECT COUNT(*) FROM sortie_archive WHERE id_bouteille=?"),
+                                       ("avis", "SELECT COUNT(*) FROM revue WHERE bouteille_id=?")):
+                            stats[k] += c.execute(sql, (dup,)).fetchone()[0]
+                        continue
+                    stats["lots"] += c.execute(
+                        "UPDATE stock_bouteilles SET id_bouteille=? WHERE id_bouteille=?", (target, dup)).rowcount
+                    stats["archives"] += c.execute(
+                        "UPDATE sortie_archive SET id_bouteille=? WHERE id_bouteille=?", (target, dup)).rowcount
+                    stats["avis"] += c.execute(
+                        "UPDATE revue SET bouteille_id=? WHERE bouteille_id=?", (target, dup)).rowcount
+                    if r["photo"] and not holder["photo"]:
+                        c.execute("UPDATE bouteille SET photo=? WHERE id_bouteille=?", (r["photo"], target))
+                    c.execute("DELETE FROM bouteille WHERE id_bouteille=?", (dup,))
+        if stats["fusionnees"] and not dry_run:
+            stats_cache.invalidate()
+        return stats
+
 
 # ---------------------------------------------------------------------
 # 5) Stock_bouteilles
 # ---------------------------------------------------------------------
+# Tri / filtre de Ma cave : paramètres GET -> expressions SQL (liste blanche)
+STOCK_SORTS = {
+    "slot":    "COALESCE(s.slot, 9999)",
+    "nom":     "b.nom COLLATE NOCASE",
+    "domaine": "b.domaine COLLATE NOCASE",
+    "annee":   "COALESCE(b.annee, -9999)",
+    "type":    "b.type COLLATE NOCASE",
+    "region":  "b.region COLLATE NOCASE",
+}
+STOCK_FILTERS = {
+    "region":  "b.region",
+    "type":    "b.type",
+    "annee":   "b.annee",
+    "domaine": "b.domaine",
+    "nom":     "b.nom",
+}
+
+
 @dataclass
 class Stock_bouteilles:
     id_stock: int
@@ -217,12 +945,34 @@ class Stock_bouteilles:
     quantite: int
     slot: Optional[int] = None
 
-    # Liste le stock (lots) pour l'utilisateur courant, avec jointures utiles
+    # Liste le stock (lots) pour l'utilisateur courant, avec jointures utiles.
+    # Tri/filtre optionnels traduits en SQL (colonnes en liste blanche, valeur paramétrée) ;
+    # sans filtre, les étagères vides ressortent avec une ligne NULL (LEFT JOIN).
+    # id_etageres : restreint à ces étagères.
     @staticmethod
-    def list_for_user(uid: int):
+    def list_for_user(uid: int, sort: str = "slot", direction: str = "asc",
+                      filt_field: Optional[str] = None, filt_value=None,
+                      id_etageres: Optional[List[int]] = None):
+        order = STOCK_SORTS.get(sort, STOCK_SORTS["slot"])
+        dir_sql = "DESC" if direction == "desc" else "ASC"
+        where, params = "", [uid]
+        if filt_field in STOCK_FILTERS and filt_value not in (None, ""):
+            column = STOCK_FILTERS[filt_field]
+            if filt_field == "annee":
+                try:
+                    params.append(int(filt_value))
+                    where = f"AND {column} = ?"
+                except ValueError:
+                    pass
+            else:
+                params.append(str(filt_value).strip())
+                where = f"AND {column} = ? COLLATE NOCASE"
+        if id_etageres is not None:   # seulement ces étagères (cache de fragments)
+            where += f" AND e.id_etagere IN ({','.join('?' * len(id_etageres)) or 'NULL'})"
+            params.extend(id_etageres)
         with Database() as c:
             return c.execute(
-                """
+                f"""
                 SELECT
                     s.id_stock,
                     e.id_etagere,
@@ -239,24 +989,89 @@ class Stock_bouteilles:
                 LEFT JOIN bouteille b        ON b.id_bouteille = s.id_bouteille
                 WHERE c.id_utilisateur = ?
                   AND (s.id_stock IS NULL OR s.quantite > 0)
-                ORDER BY e.id_etagere, COALESCE(s.slot, 9999)
+                  {where}
+                ORDER BY e.id_etagere {dir_sql}, {order} {dir_sql}
                 """,
-                (uid,),
+                params,
             ).fetchall()
 
-    # Ajoute un lot (sans fusion) dans l'étagère/slot choisis
+    # Valeurs distinctes (région, type, année, domaine, nom) du stock de l'utilisateur,
+    # pour les listes de filtre de Ma cave ; en cache jusqu'à la prochaine écriture de stock
     @staticmethod
-    def add_lot(id_etagere: int, id_bouteille: int, quantite: int, slot: Optional[int]) -> None:
-        with Database() as c:
-            c.execute(
-                "INSERT INTO stock_bouteilles(id_etagere, id_bouteille, quantite, slot) VALUES (?,?,?,?)",
-                (id_etagere, id_bouteille, quantite, slot),
-            )
+    def facets(uid: int) -> Dict[str, list]:
+        def compute():
+            with Database() as c:
+                rows = c.execute(
+                    """
+                    SELECT DISTINCT b.region, b.type, b.annee, b.domaine, b.nom
+                    FROM cave cv
+                    JOIN etagere e          ON e.id_cave      = cv.id_cave
+                    JOIN stock_bouteilles s ON s.id_etagere   = e.id_etagere
+                    JOIN bouteille b        ON b.id_bouteille = s.id_bouteille
+                    WHERE cv.id_utilisateur = ? AND s.quantite > 0
+                    """,
+                    (uid,),
+                ).fetchall()
+            out = {}
+            for key in STOCK_FILTERS:
+                values = {r[key] for r in rows if r[key] is not None and str(r[key]).strip() != ""}
+                out[key] = sorted(int(v) for v in values) if key == "annee" else sorted(str(v) for v in values)
+            return out
+
+        return user_cached("facets", uid, compute)
 
-    # Ajoute ou incrémente un lot existant si même étagère + bouteille + slot
+    # Parcourt les lots (quantité > 0) de l'utilisateur sans tout charger (exports).
+    # Lecture par blocs de `batch` lignes, pagination par clé (étagère, slot, id_stock) :
+    # chaque bloc est lu en entier puis la connexion rendue avant de le parcourir, donc
+    # aucune lecture SQLite (verrou SHARED hors WAL) ne reste ouverte pendant l'envoi.
     @staticmethod
-    def add_or_increment(id_etagere: int, id_bouteille: int, quantite: int, slot: int):
-        with Database() as c:
+    def iter_for_user(uid: int, batch: int = READ_BATCH):
+        after = (-1, -1, -1)
+        while True:
+            with Database() as c:
+                rows = c.execute(
+                    """
+                    SELECT s.id_stock, e.id_etagere, e.nom AS etagere_nom, s.slot, s.quantite,
+                           b.id_bouteille, b.domaine, b.nom, b.type, b.annee, b.region, b.prix
+                    FROM cave cv
+                    JOIN etagere e          ON e.id_cave      = cv.id_cave
+                    JOIN stock_bouteilles s ON s.id_etagere   = e.id_etagere
+                    JOIN bouteille b        ON b.id_bouteille = s.id_bouteille
+                    WHERE cv.id_utilisateur = ? AND s.quantite > 0
+                      AND (e.id_etagere, COALESCE(s.slot, 9999), s.id_stock) > (?, ?, ?)
+                    ORDER BY e.id_etagere, COALESCE(s.slot, 9999), s.id_stock
+                    LIMIT ?
+                    """,
+                    (uid, *after, batch),
+                ).fetchall()
+            yield from rows
+            if len(rows) < batch:
+                return
+            last = rows[-1]
+            after = (last["id_etagere"], 9999 if last["slot"] is None else last["slot"], last["id_stock"])
+
+    # Ajoute un lot (sans fusion) dans l'étagère/slot choisis ; slot None = premier libre
+    @staticmethod
+    def add_lot(id_etagere: int, id_bouteille: int, quantite: int, slot: Optional[int]) -> Optional[int]:
+        with Database(write=True) as c:
+            _check_capacity(c, id_etagere, quantite)
+            if slot is None:
+                slot = _first_free_slot(c, id_etagere)
+            _insert_lot(c, id_etagere, id_bouteille, quantite, slot)
+            _touch_user(_shelf_owner(c, id_etagere))
+            return slot
+
+    # Ajoute ou incrémente un lot existant si même étagère + bouteille + slot.
+    # slot None : réserve le premier slot libre dans la même transaction que l'INSERT
+    # (deux ajouts concurrents ne peuvent pas prendre le même). Renvoie le slot utilisé.
+    # uid : propriétaire de l'étagère s'il est déjà connu (évite de le relire)
+    @staticmethod
+    def add_or_increment(id_etagere: int, id_bouteille: int, quantite: int,
+                         slot: Optional[int] = None, uid: Optional[int] = None) -> Optional[int]:
+        with Database(write=True) as c:
+            _check_capacity(c, id_etagere, quantite)
+            if slot is None:
+                slot = _first_free_slot(c, id_etagere)
             r = c.execute(
                 """
                 SELECT id_stock, quantite FROM stock_bouteilles
@@ -270,23 +1085,16 @@ class Stock_bouteilles:
                     (quantite, r["id_stock"]),
                 )
             else:
-                c.execute(
-                    "INSERT INTO stock_bouteilles(id_etagere, id_bouteille, quantite, slot) VALUES (?,?,?,?)",
-                    (id_etagere, id_bouteille, quantite, slot),
-                )
+                _insert_lot(c, id_etagere, id_bouteille, quantite, slot)
+            _touch_user(uid if uid is not None else _shelf_owner(c, id_etagere))
+            return slot
 
-    # Donne le prochain slot libre (1..capacite) pour une étagère
+    # Donne le plus petit slot libre d'une étagère (None si elle est pleine).
+    # Lecture indicative : pour réserver, passer slot=None à add_or_increment/set_slot.
     @staticmethod
-    def next_free_slot(id_etagere: int, capacite: int) -> int:
+    def next_free_slot(id_etagere: int, capacite: Optional[int] = None) -> Optional[int]:
         with Database() as c:
-            rows = c.execute(
-                "SELECT slot FROM stock_bouteilles WHERE id_etagere=?", (id_etagere,)
-            ).fetchall()
-            taken = {r["slot"] for r in rows if r["slot"] is not None}
-        for i in range(1, capacite + 1):
-            if i not in taken:
-                return i
-        return capacite
+            return _first_free_slot(c, id_etagere)
 
     # Récupère un lot (stock) par identifiant
     @staticmethod
@@ -295,12 +1103,30 @@ class Stock_bouteilles:
             r = c.execute("SELECT * FROM stock_bouteilles WHERE id_stock=?", (id_stock,)).fetchone()
             return Stock_bouteilles(**dict(r)) if r else None
 
-    # Décrémente la quantité d'un lot, supprime si elle atteint 0
+    # Lot rangé dans la cave de l'utilisateur, en une jointure indexée (lot -> étagère -> cave,
+    # clés primaires) ; None si le lot n'existe pas ou appartient à un autre.
+    # À utiliser par toute route qui modifie un lot.
     @staticmethod
-    def decrement(id_stock: int, q: int) -> None:
+    def get_owned_lot(id_stock: int, uid: int) -> Optional["Stock_bouteilles"]:
         with Database() as c:
             r = c.execute(
-                "SELECT quantite FROM stock_bouteilles WHERE id_stock=?", (id_stock,)
+                """
+                SELECT s.* FROM stock_bouteilles s
+                JOIN etagere e ON e.id_etagere = s.id_etagere
+                JOIN cave cv   ON cv.id_cave   = e.id_cave
+                WHERE s.id_stock = ? AND cv.id_utilisateur = ?
+                """,
+                (id_stock, uid),
+            ).fetchone()
+            return Stock_bouteilles(**dict(r)) if r else None
+
+    # Décrémente la quantité d'un lot, supprime si elle atteint 0
+    # (uid : propriétaire déjà connu, sinon relu depuis l'étagère)
+    @staticmethod
+    def decrement(id_stock: int, q: int, uid: Optional[int] = None) -> None:
+        with Database(write=True) as c:
+            r = c.execute(
+                "SELECT quantite, id_etagere FROM stock_bouteilles WHERE id_stock=?", (id_stock,)
             ).fetchone()
             if not r:
                 raise ValueError("Lot introuvable")
@@ -314,6 +1140,118 @@ class Stock_bouteilles:
                 c.execute(
                     "UPDATE stock_bouteilles SET quantite=? WHERE id_stock=?", (rest, id_stock)
                 )
+            _touch_user(uid if uid is not None else _shelf_owner(c, r["id_etagere"]))
+
+    # Consomme plusieurs lots d'un coup : ops = [(id_stock, quantite)].
+    # Tout ou rien : propriété et quantités vérifiées sur une seule lecture, puis
+    # archivage et décréments en executemany ; renvoie le nb de bouteilles sorties.
+    @staticmethod
+    def consume_many(uid: int, ops: List[tuple], motif: str = "BUE") -> int:
+        wanted: Dict[int, int] = {}
+        for id_stock, q in ops:
+            if q is None or q < 1:
+                raise ValueError("Quantité invalide.")
+            wanted[id_stock] = wanted.get(id_stock, 0) + q
+        if not wanted:
+            return 0
+        with Database(write=True) as c:
+            lots = _owned_lots(c, uid, list(wanted))
+            for id_stock, q in wanted.items():
+                lot = lots.get(id_stock)
+                if lot is None:
+                    raise ValueError(f"Lot introuvable (#{id_stock}).")
+                if q > lot["quantite"]:
+                    raise ValueError(f"Quantité invalide pour le lot #{id_stock} ({lot['quantite']} en stock).")
+            c.executemany(
+                """
+                INSERT INTO sortie_archive(id_stock, id_utilisateur, date, quantite, motif, id_bouteille, id_etagere)
+                VALUES (?, ?, DATETIME('now'), ?, ?, ?, ?)
+                """,
+                [(i, uid, q, motif, lots[i]["id_bouteille"], lots[i]["id_etagere"]) for i, q in wanted.items()],
+            )
+            c.executemany("DELETE FROM stock_bouteilles WHERE id_stock=?",
+                          [(i,) for i, q in wanted.items() if q == lots[i]["quantite"]])
+            c.executemany("UPDATE stock_bouteilles SET quantite=quantite-? WHERE id_stock=?",
+                          [(q, i) for i, q in wanted.items() if q < lots[i]["quantite"]])
+            _touch_user(uid)
+            return sum(wanted.values())
+
+    # Range / déplace plusieurs lots d'un coup : ops = [(id_stock, id_etagere cible ou None
+    # = même étagère, slot ou None = premier libre)]. Un lot déjà placé qui reste sur son
+    # étagère sans slot demandé garde le sien. Tout ou rien ; renvoie {id_stock: slot}.
+    @staticmethod
+    def move_many(uid: int, ops: List[tuple]) -> Dict[int, int]:
+        if not ops:
+            return {}
+        with Database(write=True) as c:
+            lots = _owned_lots(c, uid, [op[0] for op in ops])
+            shelves = {r["id_etagere"]: r for r in c.execute(
+                """
+                SELECT e.id_etagere, e.capacite, e.occupe FROM cave cv
+                JOIN etagere e ON e.id_cave = cv.id_cave
+                WHERE cv.id_utilisateur = ?
+                """,
+                (uid,),
+            )}
+            plan: Dict[int, list] = {}          # id_stock -> [étagère cible, slot]
+            delta: Dict[int, int] = {}          # bouteilles gagnées (+) / perdues (-) par étagère
+            for id_stock, dest, slot in ops:
+                lot = lots.get(id_stock)
+                if lot is None:
+                    raise ValueError(f"Lot introuvable (#{id_stock}).")
+                if id_stock in plan:
+                    raise ValueError(f"Lot #{id_stock} présent deux fois.")
+                dest = dest or lot["id_etagere"]
+                if dest not in shelves:
+                    raise ValueError("Étagère invalide.")
+                if slot is not None and not 1 <= slot <= shelves[dest]["capacite"]:
+                    raise ValueError(f"Emplacement #{slot} hors de l'étagère.")
+                if dest == lot["id_etagere"] and (slot or lot["slot"]) == lot["slot"] and lot["slot"] is not None:
+                    continue   # déjà à sa place
+                if dest != lot["id_etagere"]:
+                    delta[dest] = delta.get(dest, 0) + lot["quantite"]
+                    delta[lot["id_etagere"]] = delta.get(lot["id_etagere"], 0) - lot["quantite"]
+                plan[id_stock] = [dest, slot]
+            for eid, d in delta.items():
+                left = shelves[eid]["capacite"] - shelves[eid]["occupe"]
+                if d > left:
+                    raise ValueError(f"Capacité insuffisante : {max(left, 0)} place(s) restante(s).")
+            asked = [(dest, slot) for dest, slot in plan.values() if slot is not None]
+            if len(set(asked)) < len(asked):
+                raise ValueError("Deux lots visent le même emplacement.")
+            if not plan:
+                return {}
+
+            # 1) lots sortis de leur slot et posés sur l'étagère cible : les échanges de
+            #    places ne se heurtent pas à l'index unique, les slots quittés redeviennent libres
+            c.executemany("UPDATE stock_bouteilles SET slot=NULL, id_etagere=? WHERE id_stock=?",
+                          [(dest, i) for i, (dest, _) in plan.items()])
+            # 2) slots libres des étagères concernées, moins ceux demandés explicitement
+            auto = [i for i, (_, slot) in plan.items() if slot is None]
+            if auto:
+                dests = sorted({plan[i][0] for i in auto})
+                free: Dict[int, List[int]] = {eid: [] for eid in dests}
+                for r in c.execute(
+                    f"SELECT id_etagere, slot FROM etagere_slot_libre WHERE id_etagere IN ({','.join('?' * len(dests))}) "
+                    "ORDER BY id_etagere, slot",
+                    dests,
+                ):
+                    if (r["id_etagere"], r["slot"]) not in asked:
+                        free[r["id_etagere"]].append(r["slot"])
+                for i in auto:
+                    slots = free[plan[i][0]]
+                    if not slots:
+                        raise ValueError("Plus aucun emplacement libre sur cette étagère.")
+                    plan[i][1] = slots.pop(0)
+            # 3) slots définitifs ; l'index unique refuse un slot tenu par un lot non déplacé
+            try:
+                c.executemany("UPDATE stock_bouteilles SET slot=? WHERE id_stock=?",
+                              [(slot, i) for i, (_, slot) in plan.items()])
+            except sqlite3.IntegrityError:
+                raise ValueError("Emplacement déjà occupé.") from None
+            if delta:
+                _touch_user(uid)
+            return {i: slot for i, (_, slot) in plan.items()}
 
     # Liste les lots sans slot (à ranger) pour l'utilisateur
     @staticmethod
@@ -333,11 +1271,223 @@ class Stock_bouteilles:
                 (uid,),
             ).fetchall()
 
-    # Affecte ou modifie le slot d'un lot
+    # Affecte ou modifie le slot d'un lot ; slot None = premier libre. Renvoie le slot.
+    # id_etagere : étagère du lot si déjà connue (évite de la relire)
     @staticmethod
-    def set_slot(id_stock: int, slot: int):
-        with Database() as c:
-            c.execute("UPDATE stock_bouteilles SET slot=? WHERE id_stock=?", (slot, id_stock))
+    def set_slot(id_stock: int, slot: Optional[int] = None, id_etagere: Optional[int] = None) -> Optional[int]:
+        with Database(write=True) as c:
+            if slot is None:
+                if id_etagere is None:
+                    r = c.execute("SELECT id_etagere FROM stock_bouteilles WHERE id_stock=?", (id_stock,)).fetchone()
+                    if not r:
+                        raise ValueError("Lot introuvable")
+                    id_etagere = r["id_etagere"]
+                slot = _first_free_slot(c, id_etagere)
+                if slot is None:
+                    raise ValueError("Plus aucun emplacement libre sur cette étagère.")
+            try:
+                c.execute("UPDATE stock_bouteilles SET slot=? WHERE id_stock=?", (slot, id_stock))
+            except sqlite3.IntegrityError:
+                raise ValueError("Emplacement déjà occupé.") from None
+            return slot
+
+
+# Lots de l'utilisateur parmi `ids`, en une requête : {id_stock: ligne}
+def _owned_lots(c: sqlite3.Connection, uid: int, ids: List[int]) -> Dict[int, sqlite3.Row]:
+    rows = c.execute(
+        f"""
+        SELECT s.* FROM stock_bouteilles s
+        JOIN etagere e ON e.id_etagere = s.id_etagere
+        JOIN cave cv   ON cv.id_cave   = e.id_cave
+        WHERE s.id_stock IN ({','.join('?' * len(ids))}) AND cv.id_utilisateur = ?
+        """,
+        (*ids, uid),
+    )
+    return {r["id_stock"]: r for r in rows}
+
+
+# Plus petit slot libre : MIN sur la clé primaire de etagere_slot_libre (triggers, migration 0006)
+def _first_free_slot(c: sqlite3.Connection, id_etagere: int) -> Optional[int]:
+    return c.execute(
+        "SELECT MIN(slot) FROM etagere_slot_libre WHERE id_etagere=?", (id_etagere,)
+    ).fetchone()[0]
+
+
+# INSERT d'un lot ; l'index unique (id_etagere, slot) refuse un slot déjà pris
+def _insert_lot(c: sqlite3.Connection, id_etagere: int, id_bouteille: int,
+                quantite: int, slot: Optional[int]) -> None:
+    try:
+        c.execute(
+            "INSERT INTO stock_bouteilles(id_etagere, id_bouteille, quantite, slot) VALUES (?,?,?,?)",
+            (id_etagere, id_bouteille, quantite, slot),
+        )
+    except sqlite3.IntegrityError:
+        raise ValueError("Emplacement déjà occupé.") from None
+
+
+# ---------------------------------------------------------------------
+# 5 bis) Import en masse (CSV -> bouteilles + lots)
+# ---------------------------------------------------------------------
+IMPORT_COLUMNS = ("domaine", "nom", "type", "annee", "region", "prix", "quantite")
+
+
+@dataclass
+class ImportReport:
+    dry_run: bool = True
+    lignes: int = 0
+    erreurs: List[tuple] = field(default_factory=list)       # (n° de ligne, message)
+    bouteilles_existantes: int = 0                           # lignes rattachées au catalogue
+    bouteilles_creees: int = 0                               # nouvelles fiches (dédoublonnées)
+    lots: int = 0
+    bouteilles_placees: int = 0
+    par_etagere: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return not self.erreurs
+
+
+# Valide/convertit une ligne CSV ; lève ValueError avec un message lisible
+def _parse_import_row(row: dict) -> dict:
+    def text(k):
+        v = (row.get(k) or "").strip()
+        if not v:
+            raise ValueError(f"champ « {k} » manquant")
+        return v
+
+    def number(k, cast):
+        raw = text(k).replace(",", ".").replace("€", "").strip()
+        try:
+            return cast(raw)
+        except ValueError:
+            raise ValueError(f"« {k} » invalide : {raw!r}") from None
+
+    out = {k: text(k) for k in ("domaine", "nom", "type", "region")}
+    out["annee"] = number("annee", int)
+    out["prix"] = number("prix", float)
+    out["quantite"] = number("quantite", int) if (row.get("quantite") or "").strip() else 1
+    if not 1800 <= out["annee"] <= 2100:
+        raise ValueError(f"« annee » hors bornes : {out['annee']}")
+    if out["prix"] < 0 or out["quantite"] < 1:
+        raise ValueError("prix négatif ou quantité < 1")
+    out["etagere"] = (row.get("etagere") or "").strip()
+    slot = (row.get("slot") or "").strip()
+    out["slot"] = int(slot) if slot.isdigit() else None
+    return out
+
+
+def bulk_import(uid: int, rows: Iterable[dict], dry_run: bool = True,
+                id_etagere_defaut: Optional[int] = None) -> ImportReport:
+    """
+    Importe des lignes CSV (dict par ligne, colonnes IMPORT_COLUMNS + etagere/slot
+    facultatives) dans la cave de `uid` :
+    validation -> dédoublonnage contre le catalogue (bouteille.cle, voir bottle_key)
+    et dans le fichier -> choix étagère/slot en mémoire -> executemany dans UNE transaction.
+    Tout ou rien : s'il y a une erreur, rien n'est écrit (le rapport la liste).
+    dry_run=True : même rapport, sans écrire.
+    """
+    rep = ImportReport(dry_run=dry_run)
+    with Database(write=not dry_run) as c:
+        shelves = c.execute(
+            """
+            SELECT e.id_etagere, e.nom, e.capacite, e.occupe
+            FROM cave cv
+            JOIN etagere e ON e.id_cave = cv.id_cave
+            WHERE cv.id_utilisateur = ?
+            ORDER BY e.id_etagere
+            """,
+            (uid,),
+        ).fetchall()
+        if not shelves:
+            rep.erreurs.append((0, "Aucune étagère dans la cave."))
+            return rep
+        cap = {e["id_etagere"]: e["capacite"] for e in shelves}
+        left = {e["id_etagere"]: e["capacite"] - e["occupe"] for e in shelves}
+        names = {e["id_etagere"]: e["nom"] for e in shelves}
+        lookup = {}
+        for e in shelves:
+            lookup[e["nom"].strip().lower()] = e["id_etagere"]
+            lookup[str(e["id_etagere"])] = e["id_etagere"]
+        free: Dict[int, List[int]] = {eid: [] for eid in cap}   # slots libres, croissants
+        for r in c.execute(
+            f"SELECT id_etagere, slot FROM etagere_slot_libre "
+            f"WHERE id_etagere IN ({','.join('?' * len(cap))}) ORDER BY id_etagere, slot",
+            list(cap),
+        ):
+            free[r["id_etagere"]].append(r["slot"])
+        available = {eid: set(v) for eid, v in free.items()}
+        cursor = {eid: 0 for eid in cap}   # position du plus petit slot potentiellement libre
+
+        def free_slot(eid: int) -> Optional[int]:
+            slots, i = free[eid], cursor[eid]
+            while i < len(slots) and slots[i] not in available[eid]:
+                i += 1
+            cursor[eid] = i
+            return slots[i] if i < len(slots) else None
+
+        catalog: Dict[str, int] = {}   # clé -> id, pour les seules clés du fichier (index ux_bouteille_cle)
+        new_bottles: Dict[tuple, tuple] = {}
+        lots: List[list] = []   # [clé bouteille, id_etagere, quantite, slot]
+
+        for n, raw in enumerate(rows, start=2):   # ligne 1 = en-tête
+            rep.lignes += 1
+            try:
+                row = _parse_import_row(raw)
+            except ValueError as e:
+                rep.erreurs.append((n, str(e)))
+                continue
+            q = row["quantite"]
+            if row["etagere"]:
+                eid = lookup.get(row["etagere"].lower())
+                if eid is None:
+                    rep.erreurs.append((n, f"étagère inconnue : {row['etagere']!r}"))
+                    continue
+            elif id_etagere_defaut in cap and left[id_etagere_defaut] >= q:
+                eid = id_etagere_defaut
+            else:
+                eid = next((i for i in cap if left[i] >= q), None)
+            if eid is None or left[eid] < q:
+                rep.erreurs.append((n, f"capacité insuffisante pour {q} bouteille(s)"))
+                continue
+            slot = row["slot"]
+            if slot not in available[eid]:
+                slot = free_slot(eid)
+            available[eid].discard(slot)
+            left[eid] -= q
+
+            key = bottle_key(row["domaine"], row["nom"], row["annee"])
+            if key not in catalog and key not in new_bottles:
+                r = c.execute("SELECT id_bouteille FROM bouteille WHERE cle=?", (key,)).fetchone()
+                if r is not None:
+                    catalog[key] = r["id_bouteille"]
+            if key in catalog:
+                rep.bouteilles_existantes += 1
+            elif key not in new_bottles:
+                new_bottles[key] = (row["domaine"], row["nom"], row["type"], row["annee"],
+                                    row["region"], row["prix"], key)
+            lots.append([key, eid, q, slot])
+            rep.par_etagere[names[eid]] = rep.par_etagere.get(names[eid], 0) + q
+
+        rep.bouteilles_creees = len(new_bottles)
+        rep.lots = len(lots)
+        rep.bouteilles_placees = sum(lot[2] for lot in lots)
+        if dry_run or rep.erreurs:
+            return rep
+
+        if new_bottles:
+            max_id = c.execute("SELECT COALESCE(MAX(id_bouteille), 0) FROM bouteille").fetchone()[0]
+            c.executemany(
+                "INSERT INTO bouteille(domaine, nom, type, annee, region, prix, cle) VALUES (?,?,?,?,?,?,?)",
+                new_bottles.values(),
+            )
+            for r in c.execute("SELECT id_bouteille, cle FROM bouteille WHERE id_bouteille > ?", (max_id,)):
+                catalog[r["cle"]] = r["id_bouteille"]
+        c.executemany(
+            "INSERT INTO stock_bouteilles(id_etagere, id_bouteille, quantite, slot) VALUES (?,?,?,?)",
+            ((eid, catalog[key], q, slot) for key, eid, q, slot in lots),
+        )
+        _touch_user(uid)
+    return rep
 
 
 # ---------------------------------------------------------------------
@@ -363,7 +1513,7 @@ class SortieArchive:
         id_bouteille: int,
         id_etagere: int,
     ) -> None:
-        with Database() as c:
+        with Database(write=True) as c:
             c.execute(
                 """
                 INSERT INTO sortie_archive(id_stock, id_utilisateur, date, quantite, motif, id_bouteille, id_etagere)
@@ -371,6 +1521,49 @@ class SortieArchive:
                 """,
                 (id_stock, id_utilisateur, quantite, motif, id_bouteille, id_etagere),
             )
+            _touch_user(id_utilisateur)
+
+    # Historique des sorties d'un utilisateur, rejoint avec bouteille/étagère (itérateur)
+    @staticmethod
+    def iter_for_user(uid: int, before: Optional[str] = None, limit: Optional[int] = None,
+                      batch: int = READ_BATCH):
+        """
+        Parcourt les sorties de la plus récente à la plus ancienne sans tout
+        charger (au plus `limit` lignes, toutes si None).
+        Pagination par clé (date, id_archive) : `before` = `curseur` de la
+        dernière ligne de la page précédente. Les lignes sont lues par blocs
+        de `batch`, chacun en entier avant d'être parcouru : aucune lecture
+        SQLite ne reste ouverte pendant qu'une réponse streamée est envoyée.
+        """
+        while limit is None or limit > 0:
+            n = batch if limit is None else min(batch, limit)
+            key, last_id = _parse_cursor(before)
+            where, params = "", [uid]
+            if key is not None:
+                where = "AND (a.date, a.id_archive) < (?, ?)"
+                params += [key, last_id]
+            with Database() as c:
+                rows = c.execute(
+                    f"""
+                    SELECT a.date, a.quantite, a.motif,
+                           b.domaine, b.nom, b.annee, b.type, b.region,
+                           COALESCE(e.nom, '(Étagère supprimée)') AS etagere_nom,
+                           a.date || '~' || a.id_archive AS curseur
+                    FROM sortie_archive a
+                    LEFT JOIN bouteille b ON b.id_bouteille = a.id_bouteille
+                    LEFT JOIN etagere  e  ON e.id_etagere   = a.id_etagere
+                    WHERE a.id_utilisateur = ? {where}
+                    ORDER BY a.date DESC, a.id_archive DESC
+                    LIMIT ?
+                    """,
+                    (*params, n),
+                ).fetchall()
+            yield from rows
+            if len(rows) < n:
+                return
+            before = rows[-1]["curseur"]
+            if limit is not None:
+                limit -= n
 
 
 # ---------------------------------------------------------------------
@@ -390,12 +1583,13 @@ class Revue:
     def add(
         bouteille_id: int, auteur_id: int, score: Optional[float], commentaire: Optional[str]
     ) -> int:
-        with Database() as c:
+        with Database(write=True) as c:
             cur = c.execute(
                 'INSERT INTO revue (bouteille_id, auteur_id, score, commentaire, "date") '
                 'VALUES (?,?,?,?, DATETIME("now"))',
                 (bouteille_id, auteur_id, score, commentaire),
             )
+            _touch_reviews(auteur_id)
             return cur.lastrowid
 
     # Liste les avis d'une bouteille avec le nom de l'auteur
@@ -413,49 +1607,222 @@ class Revue:
                 (bid,),
             ).fetchall()
 
-    # Calcule la moyenne des notes d'une bouteille (arrondie à 2 décimales)
+    # Moyenne des notes d'une bouteille (arrondie à 2 décimales, lue dans bouteille_rating)
     @staticmethod
     def avg_for_bottle(bid: int) -> Optional[float]:
         with Database() as c:
             r = c.execute(
-                "SELECT ROUND(AVG(score),2) AS m FROM revue WHERE bouteille_id=?", (bid,)
+                "SELECT moyenne AS m FROM bouteille_rating WHERE id_bouteille=?", (bid,)
             ).fetchone()
         return r["m"] if r and r["m"] is not None else None
 
-    # Recherche d'avis communautaires (filtre nom/domaine/région)
+    # Classement des bouteilles les mieux notées (parcours de l'index moyenne/n)
     @staticmethod
-    def community_reviews(q: str) -> List[sqlite3.Row]:
+    def top_rated(limit: int = 4) -> List[sqlite3.Row]:
+        with Database() as c:
+            return c.execute(
+                """
+                SELECT b.id_bouteille, b.nom, b.domaine, b.annee, b.type, b.region,
+                       br.moyenne, br.n
+                FROM bouteille_rating br
+                JOIN bouteille b ON b.id_bouteille = br.id_bouteille
+                ORDER BY br.moyenne DESC, br.n DESC
+                LIMIT ?
+                """,
+                (limit,),
+            ).fetchall()
+
+    # Resynchronise bouteille_rating avec `revue` ; renvoie le nb de bouteilles notées
+    @staticmethod
+    def rebuild_ratings() -> int:
+        with Database(write=True) as c:
+            n = _rebuild_ratings(c)
+            _touch_reviews()
+            return n
+
+    # Recherche d'avis communautaires (plein texte nom/domaine/région/commentaire)
+    @staticmethod
+    def community_reviews(q: str, after: Optional[str] = None, limit: int = 200) -> List[sqlite3.Row]:
         """
-        Retourne les avis rejoints avec bouteille + auteur.
-        Filtre optionnel sur nom/domaine/région (LIKE).
+        Retourne les avis rejoints avec bouteille + auteur, par pages de `limit`.
+        - sans recherche : du plus récent au plus ancien,
+        - avec recherche : index FTS5 `revue_fts`, classés par pertinence (bm25),
+          insensible aux accents/à la casse, chaque mot est un préfixe ("chat" -> Château).
+        Pagination par clé : `after` = colonne `curseur` de la dernière ligne reçue.
         """
+        match = _fts_query(q)
+        key, last_id = _parse_cursor(after)
         with Database() as c:
-            if q:
-                like = f"%{q}%"
+            if match:
+                where = ""
+                params: list = [match]
+                rank = _to_float(key)
+                if rank is not None:
+                    where = "AND (f.rank > ? OR (f.rank = ? AND f.rowid > ?))"
+                    params += [rank, rank, last_id]
                 return c.execute(
-                    """
+                    f"""
                     SELECT r.id_revue, r.score, r.commentaire, r.date,
                            b.id_bouteille, b.nom, b.domaine, b.annee, b.type, b.region,
-                           u.nom AS auteur_nom
-                    FROM revue r
-                    JOIN bouteille b ON b.id_bouteille = r.bouteille_id
+                           u.nom AS auteur_nom,
+                           printf('%.17g~%d', f.rank, r.id_revue) AS curseur
+                    FROM revue_fts f
+                    JOIN revue r       ON r.id_revue = f.rowid
+                    JOIN bouteille b   ON b.id_bouteille = r.bouteille_id
                     JOIN utilisateur u ON u.id_utilisateur = r.auteur_id
-                    WHERE b.nom LIKE ? OR b.domaine LIKE ? OR b.region LIKE ?
-                    ORDER BY r.date DESC
-                    LIMIT 200
+                    WHERE revue_fts MATCH ? {where}
+                    ORDER BY f.rank, f.rowid
+                    LIMIT ?
                     """,
-                    (like, like, like),
-                ).fetchall()
-            else:
-                return c.execute(
-                    """
-                    SELECT r.id_revue, r.score, r.commentaire, r.date,
-                           b.id_bouteille, b.nom, b.domaine, b.annee, b.type, b.region,
-                           u.nom AS auteur_nom
-                    FROM revue r
-                    JOIN bouteille b ON b.id_bouteille = r.bouteille_id
-                    JOIN utilisateur u ON u.id_utilisateur = r.auteur_id
-                    ORDER BY r.date DESC
-                    LIMIT 200
-                    """
+                    (*params, limit),
                 ).fetchall()
+            where = ""
+            params = []
+            if key is not None:
+                where = "WHERE (r.date, r.id_revue) < (?, ?)"
+                params = [key, last_id]
+            return c.execute(
+                f"""
+                SELECT r.id_revue, r.score, r.commentaire, r.date,
+                       b.id_bouteille, b.nom, b.domaine, b.annee, b.type, b.region,
+                       u.nom AS auteur_nom,
+                       r.date || '~' || r.id_revue AS curseur
+                FROM revue r
+                JOIN bouteille b ON b.id_bouteille = r.bouteille_id
+                JOIN utilisateur u ON u.id_utilisateur = r.auteur_id
+                {where}
+                ORDER BY r.date DESC, r.id_revue DESC
+                LIMIT ?
+                """,
+                (*params, limit),
+            ).fetchall()
+
+
+# Transforme la saisie utilisateur en requête FTS5 sûre : "mot1"* "mot2"* (ET implicite)
+def _fts_query(q: str) -> Optional[str]:
+    words = re.findall(r"\w+", q or "")
+    return " ".join(f'"{w}"*' for w in words) or None
+
+
+def _to_float(v) -> Optional[float]:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+# Découpe un curseur "clé~id" ; (None, None) si absent ou invalide
+def _parse_cursor(after: Optional[str]):
+    if not after or "~" not in after:
+        return None, None
+    key, _, last_id = after.rpartition("~")
+    try:
+        return key, int(last_id)
+    except ValueError:
+        return None, None
+
+
+# ---------------------------------------------------------------------
+# Vérification des plans d'exécution des requêtes chaudes
+# ---------------------------------------------------------------------
+def _is_full_scan(detail: str) -> bool:
+    # "SCAN t" = parcours complet ; "SCAN t USING INDEX ix" = parcours ordonné borné par LIMIT ;
+    # "SCAN f VIRTUAL TABLE INDEX ..." = requête MATCH servie par l'index FTS5
+    return detail.startswith("SCAN ") and " USING " not in detail and " VIRTUAL TABLE " not in detail
+
+
+# Une lecture sans WHERE ni LIMIT demande toute la table (ex: list_all_light) : rien à indexer
+def _reads_whole_table(sql: str) -> bool:
+    up = " ".join(sql.upper().split())
+    return up.startswith("SELECT") and " WHERE " not in up and " LIMIT " not in up
+
+
+def check_query_plans(path: str = DB_PATH) -> List[tuple]:
+    """
+    Rejoue les appels modèle des pages chaudes (lectures + écritures, annulées
+    à la fin) en capturant le SQL réellement exécuté, puis passe chaque
+    instruction dans EXPLAIN QUERY PLAN.
+    Renvoie [(sql, détail du plan)] pour chaque parcours complet de table.
+    """
+    sess = begin_session(path)
+    statements: List[str] = []
+    try:
+        conn = sess.connection(write=True)
+        u = conn.execute("SELECT id_utilisateur, email FROM utilisateur LIMIT 1").fetchone()
+        lot = conn.execute("SELECT * FROM stock_bouteilles WHERE quantite > 0 LIMIT 1").fetchone()
+        conn.set_trace_callback(statements.append)
+        uid = u["id_utilisateur"] if u else 1
+        bid = lot["id_bouteille"] if lot else 1
+        Utilisateur.get_by_email(u["email"] if u else "x@example.org")
+        Utilisateur.get(uid)
+        Utilisateur.kpis(uid)
+        cave = Cave.get_by_user(uid)
+        Etagere.list_for_cave(cave.id_cave if cave else 1)
+        Bouteille.get(bid)
+        Bouteille.list_all_light()
+        b = Bouteille.get(bid)
+        if b:
+            Bouteille.upsert(b.domaine, b.nom, b.type, b.annee, b.region, b.prix)
+        Bouteille.merge_duplicates(dry_run=True)
+        Stock_bouteilles.list_for_user(uid)
+        Stock_bouteilles.list_for_user(uid, sort="nom", direction="desc", filt_field="region", filt_value="Bordeaux")
+        Stock_bouteilles.list_for_user(uid, sort="annee", filt_field="annee", filt_value="2015")
+        Stock_bouteilles.list_for_user(uid, id_etageres=[lot["id_etagere"] if lot else 1])
+        stats_cache.invalidate(("facets", uid))
+        Stock_bouteilles.facets(uid)
+        Stock_bouteilles.list_unassigned_for_user(uid)
+        list(Stock_bouteilles.iter_for_user(uid, batch=2))
+        Revue.list_for_bottle(bid)
+        Revue.avg_for_bottle(bid)
+        Revue.top_rated()
+        Revue.community_reviews("")
+        Revue.community_reviews("", after="2999-01-01~1")
+        Revue.community_reviews("chateau")
+        Revue.community_reviews("chateau", after="0~1")
+        list(SortieArchive.iter_for_user(uid, limit=50))
+        list(SortieArchive.iter_for_user(uid, before="2999-01-01~1", limit=50))
+        if lot:
+            Etagere.capacity_left(lot["id_etagere"])
+            Stock_bouteilles.next_free_slot(lot["id_etagere"])
+            Stock_bouteilles.get_lot(lot["id_stock"])
+            Stock_bouteilles.get_owned_lot(lot["id_stock"], uid)
+            Etagere.get_owned(lot["id_etagere"], uid)
+            Stock_bouteilles.add_or_increment(lot["id_etagere"], bid, 1, lot["slot"])
+            Stock_bouteilles.decrement(lot["id_stock"], 1)
+            Stock_bouteilles.set_slot(lot["id_stock"], lot["slot"])
+            SortieArchive.add(lot["id_stock"], uid, 1, "BUE", bid, lot["id_etagere"])
+            conn.execute("UPDATE stock_bouteilles SET slot=NULL WHERE id_stock=?", (lot["id_stock"],))
+            try:   # lot d'un autre utilisateur : refus après la lecture, qui reste tracée
+                Stock_bouteilles.move_many(uid, [(lot["id_stock"], None, None)])
+                Stock_bouteilles.consume_many(uid, [(lot["id_stock"], 1)])
+            except ValueError:
+                pass
+        resource_versions([f"user:{uid}", "catalogue"])
+        Revue.add(bid, uid, 10, "plan")
+        import jobs   # import tardif : jobs importe models
+        import photos
+        photos._photo_changed(b.photo if b and b.photo else "uploads/x.png")
+        jobs.enqueue("check-indexes")
+        job = jobs._claim("check-indexes", 1.0)
+        if job:
+            jobs._finish(job)
+        jobs.stats()
+        jobs.purge()
+        conn.set_trace_callback(None)
+
+        offenders, seen = [], set()
+        for sql in statements:
+            head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+            if head not in ("SELECT", "INSERT", "UPDATE", "DELETE") or sql in seen:
+                continue
+            seen.add(sql)
+            if _reads_whole_table(sql):
+                continue
+            for row in conn.execute("EXPLAIN QUERY PLAN " + sql):
+                if _is_full_scan(row["detail"]):
+                    offenders.append((" ".join(sql.split()), row["detail"]))
+        return offenders
+    finally:
+        if sess.conn is not None:
+            sess.conn.set_trace_callback(None)
+        end_session(sess, commit=False)
@@ -0,0 +1,299 @@
+# photos.py
+"""
+Photos de bouteilles, stockées par contenu :
+    static/uploads/sha256/<aa>/<sha256>.ext
+- l'empreinte est calculée au fil de l'écriture (pas de fichier entier en mémoire) ;
+  un même contenu n'est stocké qu'une fois, et son URL peut être cachée "immutable",
+- table `photo` (migration 0011) : une ligne par fichier, refs = nb de bouteilles
+  qui l'utilisent (triggers sur bouteille.photo) ; gc_photos() supprime le reste,
+- miniatures à largeur fixe (THUMB_WIDTHS) générées par une tâche de fond
+  "miniatures" (jobs.py), en WebP si Pillow le gère, sinon JPEG. Pillow est facultatif : sans lui, les
+  pages servent l'image d'origine. Une fois les miniatures écrites, les pages
+  déjà rendues avec l'original changent de version (fragments, ETags),
+- import_uploads() : range les anciens uploads (`<nom>_<uid>_<timestamp>.ext`)
+  dans le stockage par contenu et repointe bouteille.photo (doublons fusionnés).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import time
+from typing import Dict, Optional
+
+import jobs
+import metrics
+from models import Database
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:   # miniatures désactivées
+    Image = None
+
+UPLOAD_DIR = os.path.join("static", "uploads")
+STORE_DIR = os.path.join(UPLOAD_DIR, "sha256")
+THUMB_DIR = os.path.join(UPLOAD_DIR, "thumbs")
+THUMB_WIDTHS = (160, 480)
+THUMB_FORMAT = ("webp" if Image is not None and features.check("webp") else "jpeg")
+THUMB_EXT = {"webp": ".webp", "jpeg": ".jpg"}[THUMB_FORMAT]
+PLACEHOLDER = "placeholder.jpg"
+CHUNK = 1 << 16
+GC_GRACE = 3600   # s : un fichier plus récent peut appartenir à un upload pas encore validé
+
+# <sha256>.ext, ancien <empreinte16>.ext, ou miniature <empreinte>-<largeur>.ext : contenu figé
+HASHED_NAME = re.compile(r"^(?:[0-9a-f]{64}|[0-9a-f]{16})(-\d+)?\.[a-z0-9]+$")
+
+_thumbs_ready: set = set()
+
+
+# ---------------------------------------------------------------------
+# Stockage par contenu
+# ---------------------------------------------------------------------
+def store_path(digest: str, ext: str) -> str:
+    """Chemin relatif à static/ (valeur de bouteille.photo)."""
+    return f"uploads/sha256/{digest[:2]}/{digest}{ext.lower()}"
+
+
+def _store_stream(stream, ext: str, tmp_dir: str = STORE_DIR) -> tuple:
+    """
+    Copie un flux dans un fichier temporaire en calculant SHA-256 et taille au fil
+    de l'eau, puis le range sous son empreinte (os.replace, atomique). Même si le
+    contenu existe déjà, il est remplacé : un gc_photos() en cours peut être en train
+    de le supprimer, et le mtime frais le protège du balayage des orphelins.
+    Renvoie (chemin relatif, sha256, taille).
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp = os.path.join(tmp_dir, f".upload-{os.getpid()}-{time.monotonic_ns()}.tmp")
+    h, size = hashlib.sha256(), 0
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in iter(lambda: stream.read(CHUNK), b""):
+                h.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        digest = h.hexdigest()
+        photo = store_path(digest, ext)
+        final = os.path.join("static", photo)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(tmp, final)
+        return photo, digest, size
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+# Déclare un fichier du stockage (refs inchangé : ce sont les triggers de bouteille qui comptent)
+def _register(c, photo: str, digest: str, size: int) -> None:
+    c.execute(
+        """
+        INSERT INTO photo(chemin, sha256, taille) VALUES (?,?,?)
+        ON CONFLICT(chemin) DO UPDATE SET sha256=excluded.sha256, taille=excluded.taille,
+                                          cree_le=DATETIME('now')
+        """,
+        (photo, digest, size),
+    )
+
+
+def save_upload(file) -> str:
+    """
+    Enregistre un FileStorage dans le stockage par contenu et renvoie le chemin
+    relatif à static/ à mettre dans bouteille.photo. Miniatures en tâche de fond.
+    """
+    ext = os.path.splitext(file.filename or "")[1] or ".jpg"
+    photo, digest, size = _store_stream(file.stream, ext)
+    metrics.UPLOAD_BYTES.observe(size)
+    with Database(write=True) as c:
+        _register(c, photo, digest, size)
+        # gc_photos() supprime les fichiers sous le verrou d'écriture : s'il est passé
+        # entre la copie et l'enregistrement, on réécrit le fichier avant de valider
+        if not os.path.exists(os.path.join("static", photo)):
+            file.stream.seek(0)
+            _store_stream(file.stream, ext)
+    schedule_thumbnails(photo)
+    return photo
+
+
+def is_hashed(filename: str) -> bool:
+    return bool(HASHED_NAME.match(os.path.basename(filename)))
+
+
+# ---------------------------------------------------------------------
+# Miniatures
+# ---------------------------------------------------------------------
+def thumbnail_name(photo: str, width: int) -> str:
+    stem = os.path.splitext(os.path.basename(photo))[0]
+    return f"uploads/thumbs/{stem}-{width}{THUMB_EXT}"
+
+
+def make_thumbnails(photo: str) -> int:
+    """Crée les miniatures manquantes d'une photo ; renvoie le nb de fichiers écrits."""
+    if Image is None:
+        return 0
+    src = os.path.join("static", photo)
+    todo = [w for w in THUMB_WIDTHS if not os.path.exists(os.path.join("static", thumbnail_name(photo, w)))]
+    if not todo or not os.path.exists(src):
+        return 0
+    os.makedirs(THUMB_DIR, exist_ok=True)
+    written = 0
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        if THUMB_FORMAT == "jpeg" and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        for w in todo:
+            out = os.path.join("static", thumbnail_name(photo, w))
+            t = im.copy()
+            t.thumbnail((w, w * 4))
+            t.save(f"{out}.tmp", format=THUMB_FORMAT, quality=80)
+            os.replace(f"{out}.tmp", out)
+            written += 1
+    return written
+
+
+def schedule_thumbnails(photo: str) -> None:
+    if Image is not None:
+        jobs.enqueue("miniatures", {"photo": photo})
+
+
+@jobs.handler("miniatures")
+def _thumbnails_job(payload: dict) -> None:
+    if make_thumbnails(payload["photo"]):
+        _photo_changed(payload["photo"])
+
+
+# Une photo s'affiche autrement (miniature prête) : nouvelle version pour les fragments
+# d'étagères en cache (etagere.version) et les ETags des pages qui la montrent
+def _photo_changed(photo: str) -> None:
+    with Database(write=True) as c:
+        c.execute(
+            """
+            UPDATE etagere SET version = version + 1
+            WHERE id_etagere IN (SELECT s.id_etagere FROM bouteille b
+                                 JOIN stock_bouteilles s ON s.id_bouteille = b.id_bouteille
+                                 WHERE b.photo = ?)
+            """,
+            (photo,),
+        )
+        c.execute(
+            """
+            INSERT INTO version_ressource(cle, version)
+            SELECT 'bouteille:' || id_bouteille, 1 FROM bouteille WHERE photo = ?
+            UNION
+            SELECT 'user:' || cv.id_utilisateur, 1 FROM bouteille b
+            JOIN stock_bouteilles s ON s.id_bouteille = b.id_bouteille
+            JOIN etagere e          ON e.id_etagere   = s.id_etagere
+            JOIN cave cv            ON cv.id_cave     = e.id_cave
+            WHERE b.photo = ?
+            ON CONFLICT(cle) DO UPDATE SET version = version + 1
+            """,
+            (photo, photo),
+        )
+
+
+def thumb(photo: Optional[str], width: int) -> str:
+    """Filtre Jinja : miniature si elle existe déjà, sinon la photo (ou le placeholder)."""
+    if not photo:
+        return PLACEHOLDER
+    name = thumbnail_name(photo, width)
+    if name in _thumbs_ready:
+        return name
+    if os.path.exists(os.path.join("static", name)):
+        _thumbs_ready.add(name)
+        return name
+    return photo
+
+
+# ---------------------------------------------------------------------
+# Import des anciens uploads + ramasse-miettes
+# ---------------------------------------------------------------------
+def import_uploads(dry_run: bool = False) -> Dict[str, int]:
+    """
+    Range chaque fichier posé directement dans static/uploads (anciens noms
+    `<nom>_<uid>_<timestamp>.ext`) dans le stockage par contenu, fait pointer
+    bouteille.photo vers le nouveau chemin (les triggers reportent les refs) et
+    supprime les originaux après validation de la transaction.
+    """
+    moves: Dict[str, tuple] = {}   # "uploads/<ancien>" -> (chemin, sha256, taille)
+    for entry in sorted(os.scandir(UPLOAD_DIR), key=lambda e: e.name):
+        if not entry.is_file() or entry.name.endswith(".tmp"):
+            continue
+        ext = os.path.splitext(entry.name)[1]
+        if dry_run:
+            h = hashlib.sha256()
+            with open(entry.path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK), b""):
+                    h.update(chunk)
+            moves[f"uploads/{entry.name}"] = (store_path(h.hexdigest(), ext), h.hexdigest(), entry.stat().st_size)
+        else:
+            with open(entry.path, "rb") as f:
+                moves[f"uploads/{entry.name}"] = _store_stream(f, ext)
+
+    stats = {"fichiers": len(moves), "uniques": len({m[0] for m in moves.values()}), "references": 0}
+    if dry_run or not moves:
+        return stats
+
+    with Database(write=True) as c:
+        for photo, digest, size in set(moves.values()):
+            _register(c, photo, digest, size)
+        stats["references"] = sum(
+            c.execute("UPDATE bouteille SET photo=? WHERE photo=?", (new[0], old)).rowcount
+            for old, new in moves.items()
+        )
+        c.executemany("DELETE FROM photo WHERE chemin=? AND refs<=0", [(old,) for old in moves])
+    for old in moves:
+        os.remove(os.path.join("static", old))
+    for photo, _, _ in set(moves.values()):
+        schedule_thumbnails(photo)
+    return stats
+
+
+def _remove_with_thumbs(photo: str) -> None:
+    for name in [photo] + [thumbnail_name(photo, w) for w in THUMB_WIDTHS]:
+        _thumbs_ready.discard(name)
+        try:
+            os.remove(os.path.join("static", name))
+        except FileNotFoundError:
+            pass
+
+
+def gc_photos(dry_run: bool = False, grace: float = GC_GRACE) -> Dict[str, int]:
+    """
+    Supprime les photos qu'aucune bouteille n'utilise :
+    - lignes `photo` à refs = 0 (plus anciennes que `grace`) et leurs fichiers, supprimés
+      dans la même transaction (un upload concurrent du même contenu attend le verrou),
+    - fichiers du stockage sans ligne `photo` (upload interrompu) plus vieux que `grace`,
+    - miniatures dont l'original a disparu.
+    """
+    cutoff = time.time() - grace
+    with Database(write=not dry_run) as c:
+        dead = [r["chemin"] for r in c.execute(
+            "SELECT chemin FROM photo WHERE refs <= 0 AND cree_le <= DATETIME(?, 'unixepoch')", (cutoff,)
+        )]
+        known = {r["chemin"] for r in c.execute("SELECT chemin FROM photo")}
+        if dead and not dry_run:
+            c.executemany("DELETE FROM photo WHERE chemin=? AND refs <= 0", [(p,) for p in dead])
+            for photo in dead:
+                _remove_with_thumbs(photo)
+
+    orphans = []
+    for root, _, files in os.walk(UPLOAD_DIR):
+        if os.path.abspath(root).startswith(os.path.abspath(THUMB_DIR)):
+            continue
+        for name in files:
+            full = os.path.join(root, name)
+            photo = os.path.relpath(full, "static").replace(os.sep, "/")
+            if photo not in known and os.path.getmtime(full) <= cutoff:
+                orphans.append(photo)
+
+    thumbs = []
+    if os.path.isdir(THUMB_DIR):
+        alive = {os.path.splitext(os.path.basename(p))[0] for p in known - set(dead)}
+        thumbs = [f"uploads/thumbs/{n}" for n in os.listdir(THUMB_DIR) if n.rsplit("-", 1)[0] not in alive]
+
+    if not dry_run:
+        for photo in orphans:
+            _remove_with_thumbs(photo)
+        for name in thumbs:
+            _thumbs_ready.discard(name)
+            os.remove(os.path.join("static", name))
+    return {"non_referencees": len(dead), "orphelins": len(orphans), "miniatures": len(thumbs)}
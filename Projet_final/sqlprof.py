@@ -0,0 +1,287 @@
+# sqlprof.py
+"""
+Instrumentation SQL (opt-in, aucun coût tant que install() n'est pas appelé) :
+- install() fait ouvrir les connexions du pool avec TracedConnection : chaque
+  instruction est chronométrée (exécution + lecture des lignes) et ses lignes
+  comptées (renvoyées, ou modifiées pour INSERT/UPDATE/DELETE),
+- profil par unité de travail (start/stop/finish, ex: une requête HTTP ;
+  stream() pour un corps de réponse streamé) : instructions
+  normalisées (littéraux -> ?), attente de connexion / de la file des
+  écrivains (models.ENGINE_HOOKS) et coût des commits ; les derniers profils
+  restent dans `recent` (page /_sql),
+- journal des requêtes lentes : au-delà de `slow_ms`, l'instruction est
+  écrite dans le logger "cave.sql.lent" avec son EXPLAIN QUERY PLAN,
+- STATEMENT_HOOKS : compteurs par verbe SQL, hors profil (ex: metrics.py).
+"""
+from __future__ import annotations
+
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import List, Optional
+
+import models
+
+SLOW_MS: Optional[float] = None      # seuil du journal des requêtes lentes (None = désactivé)
+RECENT = 50                          # profils gardés pour /_sql
+STATEMENT_HOOKS: list = []           # fn(verbe, secondes, exécutions) : (v, 0, 1) au lancement, (v, dt, 0) ensuite
+
+log = logging.getLogger("cave.sql.lent")
+recent: deque = deque(maxlen=RECENT)
+installed = False
+
+_PROFILE: ContextVar[Optional["Profile"]] = ContextVar("cave_sql_profile", default=None)
+_explaining = threading.local()
+
+_DATA = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize(sql: str) -> str:
+    """Forme canonique d'une instruction : littéraux -> ?, listes IN (...) repliées."""
+    s = _NUMBER.sub("?", _STRING.sub("?", sql))
+    return " ".join(_IN_LIST.sub("(?…)", s).split())
+
+
+class Statement:
+    __slots__ = ("raw", "params", "verb", "seconds", "rows", "logged", "_sql")
+
+    def __init__(self, raw: str, params):
+        self.raw, self.params = raw, params
+        words = raw.split(None, 1)
+        self.verb = words[0].upper() if words else ""
+        self.seconds, self.rows, self.logged = 0.0, 0, False
+        self._sql: Optional[str] = None
+
+    @property
+    def sql(self) -> str:
+        """Forme normalisée, calculée à la demande (affichage, regroupement)."""
+        if self._sql is None:
+            self._sql = normalize(self.raw)
+        return self._sql
+
+    @property
+    def is_data(self) -> bool:
+        return self.verb in _DATA
+
+
+class Profile:
+    """Instructions et attentes d'une unité de travail (une requête HTTP)."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.time()
+        self.statements: List[Statement] = []
+        self.waits = {"connexion": 0.0, "file_ecriture": 0.0}
+        self.commit_s, self.commits = 0.0, 0
+        self.status: Optional[int] = None
+        self.total_s: Optional[float] = None
+
+    @property
+    def queries(self) -> List[Statement]:
+        return [st for st in self.statements if st.is_data]
+
+    @property
+    def sql_s(self) -> float:
+        return sum(st.seconds for st in self.statements)
+
+    def by_statement(self) -> list:
+        """[(sql normalisé, nb d'exécutions, secondes, lignes)], le plus coûteux d'abord."""
+        agg: dict = {}
+        for st in self.statements:
+            n, sec, rows = agg.get(st.sql, (0, 0.0, 0))
+            agg[st.sql] = (n + 1, sec + st.seconds, rows + st.rows)
+        return sorted(((sql, *v) for sql, v in agg.items()), key=lambda r: -r[2])
+
+    def server_timing(self) -> str:
+        """Valeur d'en-tête Server-Timing (visible dans les outils du navigateur)."""
+        return (f'sql;dur={self.sql_s * 1000:.2f};desc="{len(self.queries)} requête(s)", '
+                f"sql-connexion;dur={self.waits['connexion'] * 1000:.2f}, "
+                f"sql-file;dur={self.waits['file_ecriture'] * 1000:.2f}, "
+                f"sql-commit;dur={self.commit_s * 1000:.2f}")
+
+
+# ---------------------------------------------------------------------
+# Connexion / curseur instrumentés
+# ---------------------------------------------------------------------
+def _begin(sql: str, params) -> Optional[Statement]:
+    if getattr(_explaining, "on", False):
+        return None
+    st = Statement(sql, params)
+    prof = _PROFILE.get()
+    if prof is not None:
+        prof.statements.append(st)
+    for hook in STATEMENT_HOOKS:
+        hook(st.verb, 0.0, 1)
+    return st
+
+
+def _add(cur: "TracedCursor", seconds: float, rows: int) -> None:
+    st = cur._stmt
+    if st is None:
+        return
+    st.seconds += seconds
+    st.rows += rows
+    for hook in STATEMENT_HOOKS:
+        hook(st.verb, seconds, 0)
+    if SLOW_MS is not None and not st.logged and st.seconds * 1000 >= SLOW_MS:
+        st.logged = True
+        _log_slow(cur.connection, st)
+
+
+def _log_slow(conn: sqlite3.Connection, st: Statement) -> None:
+    plan = []
+    if st.is_data:
+        _explaining.on = True
+        try:
+            plan = [r[3] for r in sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + st.raw, st.params)]
+        except (sqlite3.Error, ValueError):
+            plan = ["(plan indisponible)"]
+        finally:
+            _explaining.on = False
+    prof = _PROFILE.get()
+    log.warning("%.1f ms, %d ligne(s)%s : %s%s", st.seconds * 1000, st.rows,
+                f" [{prof.label}]" if prof else "", st.sql,
+                "".join(f"\n    {p}" for p in plan))
+
+
+class TracedCursor(sqlite3.Cursor):
+    _stmt: Optional[Statement] = None
+
+    def execute(self, sql, parameters=()):
+        self._stmt = _begin(sql, parameters)
+        t0 = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            dt = time.perf_counter() - t0
+        _add(self, dt, max(self.rowcount, 0) if self.description is None else 0)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._stmt = _begin(sql, None)
+        t0 = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            dt = time.perf_counter() - t0
+        _add(self, dt, max(self.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        _add(self, time.perf_counter() - t0, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        _add(self, time.perf_counter() - t0, len(rows))
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        _add(self, time.perf_counter() - t0, len(rows))
+        return rows
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            _add(self, time.perf_counter() - t0, 0)
+            raise
+        _add(self, time.perf_counter() - t0, 1)
+        return row
+
+
+class TracedConnection(sqlite3.Connection):
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        t0 = time.perf_counter()
+        super().commit()
+        prof = _PROFILE.get()
+        if prof is not None:
+            prof.commit_s += time.perf_counter() - t0
+            prof.commits += 1
+
+
+def _on_wait(name: str, seconds: float) -> None:
+    prof = _PROFILE.get()
+    if prof is not None:
+        prof.waits[name] = prof.waits.get(name, 0.0) + seconds
+
+
+# ---------------------------------------------------------------------
+# API
+# ---------------------------------------------------------------------
+def install(slow_ms: Optional[float] = None) -> None:
+    """Instrumente les connexions ouvertes à partir de maintenant (pools recréés)."""
+    global installed, SLOW_MS
+    SLOW_MS = slow_ms
+    if not installed:
+        installed = True
+        models.ENGINE_HOOKS.append(_on_wait)
+        models.configure_pool(factory=TracedConnection)
+
+
+def start(label: str) -> Profile:
+    """Démarre le profil d'une unité de travail (ex: requête HTTP) dans le contexte courant."""
+    prof = Profile(label)
+    _PROFILE.set(prof)
+    return prof
+
+
+def stop() -> None:
+    """Détache le profil du contexte courant (les instructions suivantes n'y vont plus)."""
+    _PROFILE.set(None)
+
+
+def finish(prof: Profile, status: Optional[int] = None) -> None:
+    """Clôt le profil et le garde dans `recent`."""
+    prof.status = status if status is not None else prof.status
+    prof.total_s = time.time() - prof.started
+    recent.append(prof)
+
+
+def stream(prof: Profile, iterable):
+    """
+    Corps de réponse streamé : chaque morceau est produit avec le profil
+    rattaché (ses requêtes SQL y sont comptées), puis le profil est clos.
+    """
+    it = iter(iterable)
+    try:
+        while True:
+            _PROFILE.set(prof)
+            try:
+                chunk = next(it)
+            except StopIteration:
+                return
+            finally:
+                _PROFILE.set(None)
+            yield chunk
+    finally:
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()
+        finish(prof)
+
+
+def current() -> Optional[Profile]:
+    return _PROFILE.get()